@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Live building- and floor-level aggregates for Electricity Monitor
+Totals are kept up to date as each reading replaces an apartment's previous one (subtract the
+old power, add the new), so building load, floor load and the top consumers are read in O(1)
+"""
+
+import bisect
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Aggregate Configuration
+AGGREGATE_UNIT_DIGITS = int(os.getenv('AGGREGATE_UNIT_DIGITS', 2))  # Trailing digits of the unit: 1203 = floor 12, unit 03
+AGGREGATE_STALE_AFTER = float(os.getenv('AGGREGATE_STALE_AFTER', 300))  # Seconds without a reading before an apartment drops out
+AGGREGATE_TOP_MAX = 100
+
+def floor_of(apartment_number, unit_digits=AGGREGATE_UNIT_DIGITS):
+    """Floor encoded in an apartment number ('0' if the number only has unit digits)"""
+    floor = apartment_number[:-unit_digits] if unit_digits else apartment_number
+    return floor or '0'
+
+class _FloorTotal:
+    __slots__ = ('power', 'apartments')
+
+    def __init__(self):
+        self.power = 0.0
+        self.apartments = 0
+
+class BuildingAggregates:
+    """
+    Running building total, per-floor totals and a sorted list of apartment loads
+
+    Updated by whichever thread feeds the LatestValueStore and read by web requests.
+    """
+
+    def __init__(self, unit_digits=AGGREGATE_UNIT_DIGITS, stale_after=AGGREGATE_STALE_AFTER):
+        self.unit_digits = unit_digits
+        self.stale_after = stale_after
+        self.total = 0.0
+        self.floors = {}  # floor -> _FloorTotal
+        self.current = OrderedDict()  # apartment_number -> (power, timestamp), least recently updated first
+        self.ranked = []  # (power, apartment_number) ascending
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.current)
+
+    def update(self, apartment_number, power, timestamp):
+        """Replace the apartment's contribution with a new reading"""
+        if not math.isfinite(power):
+            return  # NaN would break the ordering of the ranked list
+        floor_key = floor_of(apartment_number, self.unit_digits)
+        with self._lock:
+            previous = self.current.pop(apartment_number, None)
+            if previous is None:
+                floor = self.floors.get(floor_key)
+                if floor is None:
+                    floor = self.floors[floor_key] = _FloorTotal()
+                floor.apartments += 1
+                delta = power
+            else:
+                floor = self.floors[floor_key]
+                self._unrank(previous[0], apartment_number)
+                delta = power - previous[0]
+            self.total += delta
+            floor.power += delta
+            self.current[apartment_number] = (power, timestamp)
+            bisect.insort(self.ranked, (power, apartment_number))
+            self._expire(timestamp)
+
+    def _unrank(self, power, apartment_number):
+        index = bisect.bisect_left(self.ranked, (power, apartment_number))
+        del self.ranked[index]
+
+    def _expire(self, now):
+        """Drop apartments that stopped reporting; the oldest update is always first"""
+        cutoff = now - self.stale_after
+        while self.current:
+            apartment_number, (power, timestamp) = next(iter(self.current.items()))
+            if timestamp >= cutoff:
+                break
+            del self.current[apartment_number]
+            self._unrank(power, apartment_number)
+            floor_key = floor_of(apartment_number, self.unit_digits)
+            floor = self.floors[floor_key]
+            floor.power -= power
+            floor.apartments -= 1
+            self.total -= power
+            if floor.apartments == 0:
+                del self.floors[floor_key]
+            if not self.current:
+                # Nothing left: reset instead of carrying floating-point residue
+                self.total = 0.0
+
+    def expire(self, now=None):
+        """Drop stale apartments even if no reading arrives"""
+        with self._lock:
+            self._expire(time.time() if now is None else now)
+
+    def building(self):
+        """Total power and number of reporting apartments and floors"""
+        with self._lock:
+            return {
+                'power': self.total,
+                'apartments': len(self.current),
+                'floors': len(self.floors)
+            }
+
+    def floor(self, floor):
+        """Total power and reporting apartments of one floor, or None if none report"""
+        with self._lock:
+            total = self.floors.get(floor)
+            if total is None:
+                return None
+            return {'floor': floor, 'power': total.power, 'apartments': total.apartments}
+
+    def floor_totals(self):
+        """Every floor's total power and reporting apartments"""
+        with self._lock:
+            return [
+                {'floor': floor, 'power': total.power, 'apartments': total.apartments}
+                for floor, total in sorted(self.floors.items(), key=lambda item: (len(item[0]), item[0]))
+            ]
+
+    def top(self, count=10):
+        """The `count` apartments drawing the most power, highest first"""
+        count = max(0, min(count, AGGREGATE_TOP_MAX))
+        with self._lock:
+            leaders = self.ranked[-count:] if count else []
+            return [
+                {'apartment_number': apartment_number, 'floor': floor_of(apartment_number, self.unit_digits),
+                 'power': power,
+                 'timestamp': datetime.utcfromtimestamp(self.current[apartment_number][1]).isoformat()}
+                for power, apartment_number in reversed(leaders)
+            ]
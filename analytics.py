@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Vectorized analytics over reading history for Electricity Monitor
+An apartment's readings are loaded into NumPy arrays once and every statistic is computed
+on the whole arrays instead of row by row over ORM objects
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from dotenv import load_dotenv
+import numpy as np
+
+from models import db
+from storage import read_engine
+from columnar import reading_store
+from energy import ENERGY_MAX_GAP
+
+# Load environment variables
+load_dotenv()
+
+# Analytics Configuration
+ANALYTICS_TIMEZONE = os.getenv('ANALYTICS_TIMEZONE', 'UTC')  # Local time for profiles and histograms
+ANALYTICS_MAX_DAYS = int(os.getenv('ANALYTICS_MAX_DAYS', 366))  # Longest range loaded at once
+ANALYTICS_CHUNK_SIZE = 100000  # Rows fetched and converted per step
+DEMAND_INTERVAL = 900  # Seconds; peak demand and base load use 15-minute averages
+PERCENTILES = (5, 25, 50, 75, 95, 99)
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+# Timestamps are fetched as the stored text and parsed by NumPy, so no datetime objects
+# are created per row
+_SERIES_SQL = """
+SELECT timestamp, power
+FROM power_reading
+WHERE user_id = ? AND timestamp >= ? AND timestamp < ?
+ORDER BY timestamp
+"""
+SQLITE_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+_ROW_DTYPE = np.dtype([('timestamp', 'datetime64[us]'), ('power', np.float64)])
+
+class Series:
+    """Time-ordered power readings of one apartment as NumPy arrays"""
+    __slots__ = ('start', 'end', 'timestamps', 'power', 'weights')
+
+    def __init__(self, start, end, timestamps, power, max_gap=ENERGY_MAX_GAP):
+        self.start = start
+        self.end = end
+        self.timestamps = timestamps  # float64 seconds since the epoch (UTC)
+        self.power = power  # float64 Watts
+        # Each reading stands for the time until the next one; gaps longer than max_gap
+        # are missing data and carry no weight
+        weights = np.zeros(len(timestamps))
+        if len(timestamps) > 1:
+            gaps = np.diff(timestamps)
+            weights[:-1] = np.where(gaps <= max_gap, gaps, 0.0)
+        if not weights.any():
+            weights[:] = 1.0  # Single reading or nothing but gaps: plain sample statistics
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.timestamps)
+
+def load_series(user_id, start, end, chunk_size=ANALYTICS_CHUNK_SIZE):
+    """Load an apartment's readings in [start, end) as a Series"""
+    if end - start > timedelta(days=ANALYTICS_MAX_DAYS):
+        raise ValueError(f"Range is longer than {ANALYTICS_MAX_DAYS} days")
+
+    if reading_store is not None:
+        # Mapped segment slices go straight into the arrays, no rows in between
+        parts = list(reading_store.scan(user_id, start, end))
+        timestamps = np.concatenate([part[0] for part in parts]) if parts else np.empty(0, dtype=np.int64)
+        power = np.concatenate([part[1]['power'] for part in parts]) if parts else np.empty(0, dtype=np.float32)
+        return Series(start, end, timestamps / 1e6, power.astype(np.float64))
+
+    chunks = []
+    connection = read_engine(db.engine).raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(_SERIES_SQL, (user_id, start.strftime(SQLITE_DATETIME_FORMAT),
+                                     end.strftime(SQLITE_DATETIME_FORMAT)))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=_ROW_DTYPE))
+    finally:
+        connection.close()
+
+    data = np.concatenate(chunks) if chunks else np.empty(0, dtype=_ROW_DTYPE)
+    return Series(start, end, data['timestamp'].astype(np.int64) / 1e6, data['power'])
+
+def local_seconds(timestamps, tz_name=ANALYTICS_TIMEZONE):
+    """Shift UTC epoch seconds to local wall-clock seconds, DST included"""
+    try:
+        tz = ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {tz_name}")
+    if len(timestamps) == 0 or tz_name == 'UTC':
+        return timestamps
+    # UTC offsets change at most a few times a year, so look them up once per hour
+    hours = np.arange(np.floor(timestamps[0] / 3600), np.floor(timestamps[-1] / 3600) + 1)
+    offsets = np.array([
+        datetime.fromtimestamp(hour * 3600, timezone.utc).astimezone(tz).utcoffset().total_seconds()
+        for hour in hours
+    ])
+    index = (np.floor(timestamps / 3600) - hours[0]).astype(np.int64)
+    return timestamps + offsets[index]
+
+def weighted_percentiles(values, weights, percentiles=PERCENTILES):
+    """Percentiles of values where each value counts in proportion to its weight"""
+    order = np.argsort(values, kind='stable')
+    cumulative = np.cumsum(weights[order])
+    positions = np.searchsorted(cumulative, np.asarray(percentiles) / 100 * cumulative[-1])
+    return values[order][np.minimum(positions, len(values) - 1)]
+
+def demand_intervals(series, interval=DEMAND_INTERVAL):
+    """(interval start seconds, time-weighted average power) of every interval with data"""
+    slots = np.floor(series.timestamps / interval).astype(np.int64)
+    first = slots[0]
+    slots -= first
+    weight = np.bincount(slots, weights=series.weights)
+    energy = np.bincount(slots, weights=series.weights * series.power)
+    present = weight > 0
+    return (np.nonzero(present)[0] + first) * interval, energy[present] / weight[present]
+
+def summary(series):
+    """Percentiles, mean, peak, peak demand, load factor and base load of the series"""
+    if len(series) == 0:
+        return {'samples': 0}
+
+    weights = series.weights
+    power = series.power
+    mean = float(np.dot(weights, power) / weights.sum())
+    peak_index = int(np.argmax(power))
+    demand_starts, demand = demand_intervals(series)
+    demand_peak_index = int(np.argmax(demand))
+    peak_demand = float(demand[demand_peak_index])
+
+    return {
+        'samples': len(series),
+        'covered_hours': float(weights.sum() / 3600) if len(series) > 1 else 0.0,
+        'power_mean': mean,
+        'power_min': float(power.min()),
+        'power_percentiles': {
+            f"p{percentile}": float(value)
+            for percentile, value in zip(PERCENTILES, weighted_percentiles(power, weights))
+        },
+        'peak': {
+            'power': float(power[peak_index]),
+            'timestamp': datetime.utcfromtimestamp(series.timestamps[peak_index]).isoformat()
+        },
+        'peak_demand': {
+            'power': peak_demand,
+            'start': datetime.utcfromtimestamp(demand_starts[demand_peak_index]).isoformat(),
+            'interval_seconds': DEMAND_INTERVAL
+        },
+        # Average load relative to the highest 15-minute demand
+        'load_factor': mean / peak_demand if peak_demand > 0 else None,
+        # Standby consumption: what the apartment draws in its quietest 15-minute intervals
+        'base_load': float(weighted_percentiles(demand, np.ones(len(demand)), (5,))[0])
+    }
+
+def load_profile(series, kind='daily', tz_name=ANALYTICS_TIMEZONE):
+    """
+    Average power by hour of day ('daily') or by weekday and hour ('weekly'), local time
+
+    Hours without any readings are None.
+    """
+    if kind not in ('daily', 'weekly'):
+        raise ValueError(f"Invalid profile: {kind}")
+    local = local_seconds(series.timestamps, tz_name)
+    hour = (np.floor(local / 3600) % 24).astype(np.int64)
+    if kind == 'daily':
+        slots, length = hour, 24
+    else:
+        # 1970-01-01 was a Thursday (weekday 3 with Monday = 0)
+        weekday = ((np.floor(local / 86400) + 3) % 7).astype(np.int64)
+        slots, length = weekday * 24 + hour, 7 * 24
+
+    weight = np.bincount(slots, weights=series.weights, minlength=length)
+    energy = np.bincount(slots, weights=series.weights * series.power, minlength=length)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average = np.where(weight > 0, energy / weight, np.nan)
+    values = [None if np.isnan(value) else float(value) for value in average]
+
+    if kind == 'daily':
+        return {'timezone': tz_name, 'hours': values}
+    return {'timezone': tz_name, 'days': {day: values[index * 24:(index + 1) * 24]
+                                          for index, day in enumerate(WEEKDAYS)}}
+
+def time_of_day_histogram(series, bin_minutes=60, tz_name=ANALYTICS_TIMEZONE):
+    """Energy (kWh) consumed in each time-of-day bin over the whole range, local time"""
+    if bin_minutes <= 0 or 1440 % bin_minutes:
+        raise ValueError("bin_minutes must divide a day evenly")
+    local = local_seconds(series.timestamps, tz_name)
+    slots = (np.floor(local % 86400 / (bin_minutes * 60))).astype(np.int64)
+    weights = series.weights if len(series) > 1 else np.zeros(len(series))
+    energy = np.bincount(slots, weights=weights * series.power, minlength=1440 // bin_minutes) / 3600 / 1000
+    return {
+        'timezone': tz_name,
+        'bin_minutes': bin_minutes,
+        'energy_kwh': [float(value) for value in energy]
+    }
+
+def power_histogram(series, bins=20):
+    """Hours spent in each power band (time-weighted distribution of the load)"""
+    if len(series) == 0:
+        return {'edges': [], 'hours': []}
+    hours, edges = np.histogram(series.power, bins=bins, weights=series.weights / 3600)
+    return {
+        'edges': [float(edge) for edge in edges],
+        'hours': [float(value) for value in hours]
+    }
+
+def analytics_range(start, end, default_days=30):
+    """Fill in a missing from/to (default: the last 30 days) and validate the range"""
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=default_days)
+    if start >= end:
+        raise ValueError("'from' must be before 'to'")
+    return start, end
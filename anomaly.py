@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Streaming anomaly detection for Electricity Monitor
+Every reading is checked against O(1) per-apartment state (EWMA baselines, CUSUM sums and a
+repeat counter) inside the MQTT pipeline; state for at most a fixed number of apartments is kept
+"""
+
+import math
+import os
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Anomaly Detection Configuration
+ANOMALY_NOMINAL_VOLTAGE = float(os.getenv('ANOMALY_NOMINAL_VOLTAGE', 230))
+ANOMALY_VOLTAGE_TOLERANCE = float(os.getenv('ANOMALY_VOLTAGE_TOLERANCE', 0.10))  # ±10% as in EN 50160
+ANOMALY_Z_THRESHOLD = float(os.getenv('ANOMALY_Z_THRESHOLD', 4.0))  # Deviations from the EWMA baseline
+ANOMALY_ALPHA = float(os.getenv('ANOMALY_ALPHA', 0.05))  # EWMA smoothing factor
+ANOMALY_WARMUP = int(os.getenv('ANOMALY_WARMUP', 30))  # Readings before baselines are trusted
+ANOMALY_CUSUM_THRESHOLD = float(os.getenv('ANOMALY_CUSUM_THRESHOLD', 8.0))  # Level-shift decision limit
+ANOMALY_STUCK_COUNT = int(os.getenv('ANOMALY_STUCK_COUNT', 30))  # Identical readings in a row
+ANOMALY_COOLDOWN = float(os.getenv('ANOMALY_COOLDOWN', 60))  # Seconds before the same kind is flagged again
+ANOMALY_MAX_APARTMENTS = int(os.getenv('ANOMALY_MAX_APARTMENTS', 100000))  # Least recently seen are evicted
+
+ANOMALY_KINDS = ('voltage_sag', 'voltage_swell', 'current_spike', 'level_shift', 'stuck_sensor')
+
+# Drift allowed per reading before the CUSUM sums grow, and the most one reading can add
+# (in standard deviations); the clip makes a single spike too small to count as a level shift
+CUSUM_SLACK = 0.5
+CUSUM_CLIP = 3.0
+
+_NONE = ()
+
+class _Ewma:
+    """Exponentially weighted mean and variance of one signal"""
+    __slots__ = ('mean', 'var')
+
+    def __init__(self, value):
+        self.mean = value
+        self.var = 0.0
+
+    def zscore(self, value):
+        """Deviation of value from the baseline in standard deviations"""
+        # The floor keeps near-constant signals from turning rounding noise into huge scores
+        std = max(math.sqrt(self.var), 0.01 * abs(self.mean), 1e-3)
+        return (value - self.mean) / std
+
+    def update(self, value, alpha):
+        diff = value - self.mean
+        increment = alpha * diff
+        self.mean += increment
+        self.var = (1 - alpha) * (self.var + diff * increment)
+
+class ApartmentState:
+    """Everything the detectors remember about one apartment"""
+    __slots__ = ('count', 'voltage', 'current', 'power', 'cusum_high', 'cusum_low',
+                 'last_voltage', 'last_current', 'repeats', 'flagged')
+
+    def __init__(self, voltage, current, power):
+        self.count = 0
+        self.voltage = _Ewma(voltage)
+        self.current = _Ewma(current)
+        self.power = _Ewma(power)
+        self.cusum_high = 0.0
+        self.cusum_low = 0.0
+        self.last_voltage = None
+        self.last_current = None
+        self.repeats = 0
+        self.flagged = None  # kind -> time it was last reported, created on first anomaly
+
+class AnomalyDetector:
+    """
+    Per-apartment detectors for voltage sags and swells, current spikes, level shifts and stuck sensors
+
+    Not thread-safe: call check() from the single thread that handles MQTT messages.
+    """
+
+    def __init__(self, max_apartments=ANOMALY_MAX_APARTMENTS, alpha=ANOMALY_ALPHA,
+                 z_threshold=ANOMALY_Z_THRESHOLD, warmup=ANOMALY_WARMUP,
+                 cusum_threshold=ANOMALY_CUSUM_THRESHOLD, stuck_count=ANOMALY_STUCK_COUNT,
+                 cooldown=ANOMALY_COOLDOWN, nominal_voltage=ANOMALY_NOMINAL_VOLTAGE,
+                 voltage_tolerance=ANOMALY_VOLTAGE_TOLERANCE):
+        self.max_apartments = max_apartments
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.warmup = warmup
+        self.cusum_threshold = cusum_threshold
+        self.stuck_count = stuck_count
+        self.cooldown = cooldown
+        self.voltage_low = nominal_voltage * (1 - voltage_tolerance)
+        self.voltage_high = nominal_voltage * (1 + voltage_tolerance)
+        self.states = OrderedDict()  # apartment_number -> ApartmentState, least recently seen first
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.states)
+
+    def check(self, apartment_number, voltage, current, power, timestamp):
+        """
+        Update the apartment's state with one reading
+
+        Returns:
+            tuple: (kind, value, expected, score) for each anomaly found (usually empty)
+        """
+        state = self.states.get(apartment_number)
+        if state is None:
+            state = self.states[apartment_number] = ApartmentState(voltage, current, power)
+            if len(self.states) > self.max_apartments:
+                self.states.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.states.move_to_end(apartment_number)
+
+        found = _NONE
+        state.count += 1
+        warm = state.count > self.warmup
+
+        # Voltage sags and swells: outside the supply tolerance or far from this apartment's norm
+        z_voltage = state.voltage.zscore(voltage) if warm else 0.0
+        if voltage < self.voltage_low or z_voltage <= -self.z_threshold:
+            found = self._flag(state, found, 'voltage_sag', voltage, state.voltage.mean, z_voltage, timestamp)
+        elif voltage > self.voltage_high or z_voltage >= self.z_threshold:
+            found = self._flag(state, found, 'voltage_swell', voltage, state.voltage.mean, z_voltage, timestamp)
+
+        # Current spikes: sudden draw far above the baseline
+        if warm:
+            z_current = state.current.zscore(current)
+            if z_current >= self.z_threshold:
+                found = self._flag(state, found, 'current_spike', current, state.current.mean, z_current, timestamp)
+
+            # Level shifts: two-sided CUSUM of the power z-scores
+            z_power = min(max(state.power.zscore(power), -CUSUM_CLIP), CUSUM_CLIP)
+            state.cusum_high = max(0.0, state.cusum_high + z_power - CUSUM_SLACK)
+            state.cusum_low = max(0.0, state.cusum_low - z_power - CUSUM_SLACK)
+            if state.cusum_high > self.cusum_threshold or state.cusum_low > self.cusum_threshold:
+                score = state.cusum_high if state.cusum_high > state.cusum_low else -state.cusum_low
+                found = self._flag(state, found, 'level_shift', power, state.power.mean, score, timestamp)
+                state.cusum_high = state.cusum_low = 0.0
+                # Move the power baseline to the new level, keeping the learned spread
+                state.power.mean = power
+
+        # Stuck sensor: the exact same reading over and over
+        if voltage == state.last_voltage and current == state.last_current:
+            state.repeats += 1
+            if state.repeats == self.stuck_count:
+                found = self._flag(state, found, 'stuck_sensor', voltage, voltage, float(state.repeats),
+                                   timestamp, cooldown=0)
+        else:
+            state.last_voltage = voltage
+            state.last_current = current
+            state.repeats = 1
+
+        state.voltage.update(voltage, self.alpha)
+        state.current.update(current, self.alpha)
+        state.power.update(power, self.alpha)
+        return found
+
+    def _flag(self, state, found, kind, value, expected, score, timestamp, cooldown=None):
+        """Add an anomaly unless the same kind was reported for this apartment within the cooldown"""
+        if state.flagged is None:
+            state.flagged = {}
+        last = state.flagged.get(kind)
+        if last is not None and timestamp - last < (self.cooldown if cooldown is None else cooldown):
+            return found
+        state.flagged[kind] = timestamp
+        return found + ((kind, value, expected, score),)
@@ -1,56 +1,120 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, session
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, Email, Length
 import paho.mqtt.client as mqtt
-import json
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import threading
 import time
-from datetime import datetime
+import logging
+import math
+from functools import wraps
+from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 
+from models import db, User, PowerReading, Anomaly
+from ingest import ROLLUP_SEAL_INTERVAL, BatchWriter
+from history import decode_cursor, fetch_readings_page, parse_time, reading_to_dict
+from rollups import (RESOLUTION_NAMES, ROLLUP_SEAL_GRACE, bucket_start, choose_resolution, fetch_rollups,
+                     retained_resolutions, rollup_to_dict)
+from energy import PERIODS, energy_to_dict, fetch_energy, period_start
+import analytics
+import storage
+from migrate_db import migrate_database
+from live import LiveBroadcaster, format_event
+from store import LatestValueStore
+from anomaly import ANOMALY_KINDS, AnomalyDetector
+from aggregates import AGGREGATE_TOP_MAX, BuildingAggregates
+from cache import ResponseCache
+from columnar import reading_store
+from flow_control import IngestQueue
+from payload_codecs import DecodeError, batch_topic, codec_for_message, epoch_seconds, parse_batch_topic, parse_topic
+from metrics import REGISTRY, RateLimitedLogger
+from export import EXPORT_FORMATS, iter_reading_chunks, stream_export
+from ingest_workers import INGEST_MODE, LatestReadingPoller
+
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///electricity_monitor.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///electricity_monitor.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Ingest workers and web processes share the file; WAL, one writer connection and a read pool
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = storage.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 
 # Initialize extensions
-db = SQLAlchemy(app)
+db.init_app(app)
+storage.init_storage(app, db)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Admin Configuration (building managers; comma-separated account emails)
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()}
+
+def admin_required(view):
+    """Like login_required, but the account's email must also be listed in ADMIN_EMAILS"""
+    @wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if current_user.email.lower() not in ADMIN_EMAILS:
+            return jsonify({'status': 'error', 'message': 'Admin access required'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
 # MQTT Configuration
 MQTT_BROKER = os.getenv('MQTT_BROKER', '99c268dc5c2849e4a28a6723863ddb8d.s1.eu.hivemq.cloud')
 MQTT_PORT = int(os.getenv('MQTT_PORT', 8883))
 MQTT_USERNAME = os.getenv('MQTT_USERNAME', 'UNIVESP')
 MQTT_PASSWORD = os.getenv('MQTT_PASSWORD', 'Univesp2025')
 MQTT_TOPIC_PREFIX = os.getenv('MQTT_TOPIC_PREFIX', 'electricity/building')
+MQTT_SUBSCRIBE_QOS = int(os.getenv('MQTT_SUBSCRIBE_QOS', 1))  # 1: the broker holds messages while ingest is blocked
+MQTT_RECEIVE_MAXIMUM = int(os.getenv('MQTT_RECEIVE_MAXIMUM', 0))  # Unacknowledged QoS 1 deliveries at most; >0 uses MQTT 5
+OLDEST_READING_TIMESTAMP = 946684800  # 2000-01-01: batch readings older than this come from a broken clock
+
+# Seconds between keep-alive comments on idle live streams
+LIVE_KEEPALIVE = int(os.getenv('LIVE_KEEPALIVE', 15))
+
+# Per-message events are logged at a bounded rate instead of printed for every reading
+logger = logging.getLogger('electricity_monitor.mqtt')
+reading_log = RateLimitedLogger(logger, limit=int(os.getenv('LOG_READINGS_PER_INTERVAL', 5)),
+                                interval=float(os.getenv('LOG_READINGS_INTERVAL', 10)))
+error_log = RateLimitedLogger(logger, limit=5, interval=10)
+anomaly_log = RateLimitedLogger(logger, limit=5, interval=10)
+
+# Ingest metrics (see /metrics)
+# Labelled by kind of topic, not the topic itself, which would add a series per apartment
+mqtt_messages = REGISTRY.counter('mqtt_messages_total', 'MQTT messages received', ['kind'])
+mqtt_decode_errors = REGISTRY.counter('mqtt_decode_errors_total',
+                                      'MQTT messages (or readings of a batch) that could not be decoded')
+mqtt_batch_readings = REGISTRY.histogram('mqtt_batch_readings', 'Readings per received batch message',
+                                         buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000))
+mqtt_connection_changes = REGISTRY.counter('mqtt_connection_changes_total',
+                                           'MQTT connection state changes', ['state'])
+anomalies_detected = REGISTRY.counter('anomalies_detected_total', 'Anomalies flagged by the streaming detectors',
+                                      ['kind'])
+ingest_stage_seconds = REGISTRY.histogram('ingest_stage_seconds',
+                                          'Time spent per ingest stage of one message', ['stage'])
+
+# Building, floor and top-N load, updated with every latest value (see /api/admin)
+building_aggregates = BuildingAggregates()
 
-# Global variables for MQTT data - now user-specific
-user_power_data = {}  # Dictionary to store data for each user
-
-# Database Models
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
-    apartment_number = db.Column(db.String(10), unique=True, nullable=False)  # Floor/Apartment number
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class PowerReading(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    voltage = db.Column(db.Float, nullable=False)
-    current = db.Column(db.Float, nullable=False)
-    power = db.Column(db.Float, nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+# Latest value and recent samples for each apartment, shared by MQTT and web threads
+power_store = LatestValueStore(aggregates=building_aggregates)
+
+# Streaming detectors fed by the MQTT thread; state per apartment is O(1) and LRU-bounded
+anomaly_detector = AnomalyDetector()
+
+def get_apartment_data(apartment_number):
+    """Latest reading of an apartment as a dict (zeros if it has not reported yet)"""
+    sample = power_store.latest(apartment_number)
+    if sample is None:
+        return {'voltage': 0, 'current': 0, 'power': 0, 'timestamp': None}
+    return sample.to_dict()
 
 # Forms
 class LoginForm(FlaskForm):
@@ -66,14 +130,32 @@ class RegisterForm(FlaskForm):
 
 # MQTT Manager for Multiple Users
 class MQTTManager:
-    def __init__(self):
-        self.client = mqtt.Client()
+    def __init__(self, client_id='', topic_filters=None):
+        # All apartments by default; ingest workers pass shared-subscription filters
+        # or none at all and subscribe apartment by apartment
+        if topic_filters is None:
+            topic_filters = [f"{MQTT_TOPIC_PREFIX}/+/+", f"{MQTT_TOPIC_PREFIX}/+/+/+"]
+        self.topic_filters = topic_filters
+        self.apartments = set()  # Apartments subscribed individually, renewed on reconnect
+        # Receive Maximum is an MQTT 5 property; without a cap, MQTT 3.1.1 also works with older brokers
+        protocol = mqtt.MQTTv5 if MQTT_RECEIVE_MAXIMUM > 0 else mqtt.MQTTv311
+        self.client = mqtt.Client(client_id=client_id, protocol=protocol)
+        self.connect_properties = None
+        if MQTT_RECEIVE_MAXIMUM > 0:
+            self.connect_properties = Properties(PacketTypes.CONNECT)
+            self.connect_properties.ReceiveMaximum = MQTT_RECEIVE_MAXIMUM
         self.client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
         self.connected = False
         
+        # Received messages wait here for the processing thread (see flow_control.py)
+        self.queue = IngestQueue()
+        self.blocking = True  # False when on_message runs on an event loop, which pauses reading instead
+        self._stop_event = threading.Event()
+        self._thread = None
+        
         # Enable SSL/TLS for HiveMQ Cloud
         import ssl
         context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
@@ -81,10 +163,11 @@ class MQTTManager:
         context.verify_mode = ssl.CERT_NONE
         self.client.tls_set_context(context)
         
-    def on_connect(self, client, userdata, flags, rc):
+    def on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
             print("Connected to MQTT Broker!")
             self.connected = True
+            mqtt_connection_changes.inc(state='connected')
             # Subscribe to all apartment topics
             self.subscribe_to_all_apartments()
         else:
@@ -92,50 +175,206 @@ class MQTTManager:
             self.connected = False
     
     def on_message(self, client, userdata, msg):
+        """Queue the message for the processing thread; the network thread never decodes or stores"""
+        # The 'latest' policy keeps the newest message per apartment; batch messages carry
+        # readings of many apartments (or replayed older ones), so they are never superseded
+        apartment_number = parse_topic(msg.topic)[0]
+        if apartment_number is not None:
+            mqtt_messages.inc(kind='reading')
+        else:
+            mqtt_messages.inc(kind='batch' if parse_batch_topic(msg.topic) is not None else 'other')
+        self.queue.put((msg, time.perf_counter()), key=apartment_number, block=self.blocking)
+    
+    def paused(self):
+        """Whether an event loop driving the client should stop reading (see mqtt_asyncio)"""
+        return self.queue.policy == 'block' and self.queue.full()
+    
+    def start_processing(self):
+        """Start the thread that processes queued messages"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._process, name='mqtt-processing', daemon=True)
+        self._thread.start()
+    
+    def stop_processing(self, timeout=10):
+        """Stop the processing thread after it has handled everything already queued"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+    
+    def _process(self):
+        while True:
+            item = self.queue.get(timeout=0.5)
+            if item is None:
+                if self._stop_event.is_set():
+                    return
+                continue
+            msg, received = item
+            ingest_stage_seconds.observe(time.perf_counter() - received, stage='queue')
+            try:
+                self.handle_message(msg, received)
+            except Exception as e:
+                error_log.warning("processing_error topic=%s error=%s", msg.topic, e)
+    
+    def handle_message(self, msg, received):
+        """Decode a received message and ingest its reading(s); `received` is its perf_counter() arrival"""
+        started = time.perf_counter()
+        
+        # Extract apartment number (and optional codec suffix) from topic
+        apartment_number, codec_name = parse_topic(msg.topic)
+        if apartment_number is None:
+            codec_name = parse_batch_topic(msg.topic)
+            if codec_name is not None:
+                self.on_batch(msg, codec_name, received)
+            return
+        
         try:
-            # Extract apartment number from topic
-            topic_parts = msg.topic.split('/')
-            if len(topic_parts) >= 3:
-                apartment_number = topic_parts[-1]  # Last part is apartment number
-                
-                data = json.loads(msg.payload.decode())
-                voltage = float(data.get('voltage', 0))
-                current = float(data.get('current', 0))
-                power = voltage * current  # P = V × I
-                
-                global user_power_data
-                user_power_data[apartment_number] = {
-                    'voltage': voltage,
-                    'current': current,
-                    'power': power,
-                    'timestamp': datetime.now()
-                }
-                
-                print(f"Apartment {apartment_number}: V={voltage}V, I={current}A, P={power}W")
-            
-        except (json.JSONDecodeError, ValueError, KeyError) as e:
-            print(f"Error processing MQTT message: {e}")
+            data = codec_for_message(msg, codec_name).decode(msg.payload)
+            voltage = float(data.get('voltage', 0))
+            current = float(data.get('current', 0))
+        except (ValueError, KeyError, TypeError) as e:
+            mqtt_decode_errors.inc()
+            error_log.warning("decode_error topic=%s error=%s", msg.topic, e)
+            return
+        power = voltage * current  # P = V × I
+        decoded = time.perf_counter()
+        
+        sample = self._store(apartment_number, voltage, current, power, None, received)
+        stored = time.perf_counter()
+        
+        self._detect(apartment_number, voltage, current, power, sample.timestamp)
+        detected = time.perf_counter()
+        
+        ingest_stage_seconds.observe(decoded - started, stage='decode')
+        ingest_stage_seconds.observe(stored - decoded, stage='store')
+        ingest_stage_seconds.observe(detected - stored, stage='detect')
+        reading_log.info("reading apartment=%s voltage=%.2f current=%.2f power=%.2f",
+                         apartment_number, voltage, current, power)
     
-    def on_disconnect(self, client, userdata, rc):
+    def on_batch(self, msg, codec_name, received):
+        """Ingest every reading of a gateway batch, each with its own apartment and timestamp"""
+        started = time.perf_counter()
+        try:
+            items = codec_for_message(msg, codec_name).decode_batch(msg.payload)
+        except DecodeError as e:
+            mqtt_decode_errors.inc()
+            error_log.warning("decode_error topic=%s error=%s", msg.topic, e)
+            return
+        
+        # Processes subscribed apartment by apartment receive every batch and keep their own share
+        owned = None if self.topic_filters else self.apartments
+        now = time.time()
+        readings = []
+        for item in items:
+            try:
+                apartment_number = str(item['apartment'])
+                if owned is not None and apartment_number not in owned:
+                    continue
+                voltage = float(item.get('voltage', 0))
+                current = float(item.get('current', 0))
+                # A gateway clock running ahead must not put readings in the future
+                timestamp = item.get('timestamp')
+                timestamp = min(epoch_seconds(timestamp), now) if timestamp is not None else now
+                if not (math.isfinite(timestamp) and timestamp >= OLDEST_READING_TIMESTAMP):
+                    raise ValueError(f"timestamp out of range: {item.get('timestamp')!r}")
+            except (ValueError, KeyError, TypeError) as e:
+                mqtt_decode_errors.inc()
+                error_log.warning("decode_error topic=%s error=%s", msg.topic, e)
+                continue
+            readings.append((apartment_number, voltage, current, voltage * current, timestamp))
+        decoded = time.perf_counter()
+        
+        for apartment_number, voltage, current, power, timestamp in readings:
+            self._store(apartment_number, voltage, current, power, timestamp, received)
+        stored = time.perf_counter()
+        
+        for apartment_number, voltage, current, power, timestamp in readings:
+            self._detect(apartment_number, voltage, current, power, timestamp)
+        detected = time.perf_counter()
+        
+        mqtt_batch_readings.observe(len(items))
+        ingest_stage_seconds.observe(decoded - started, stage='decode')
+        ingest_stage_seconds.observe(stored - decoded, stage='store')
+        ingest_stage_seconds.observe(detected - stored, stage='detect')
+        reading_log.info("batch topic=%s readings=%d", msg.topic, len(readings))
+    
+    def _store(self, apartment_number, voltage, current, power, timestamp, received):
+        """
+        Queue a reading for the database and, if it is newer than the apartment's latest value,
+        record it as the latest value and push it to dashboards; returns its Sample, or None
+        """
+        if timestamp is not None:
+            previous = power_store.latest(apartment_number)
+            if previous is not None and previous.timestamp >= timestamp:
+                # A late batch reading (or a spool replay): history only, the live view has moved on
+                batch_writer.submit(apartment_number, voltage, current, power,
+                                    datetime.utcfromtimestamp(timestamp), received)
+                return None
+        sample = power_store.update(apartment_number, voltage, current, power, timestamp)
+        
+        # Hand off to the background writer; never touch the database here
+        batch_writer.submit(apartment_number, voltage, current, power,
+                            datetime.utcfromtimestamp(sample.timestamp), received)
+        
+        # Push to dashboards watching this apartment
+        live_broadcaster.publish(apartment_number, sample.to_dict())
+        return sample
+    
+    def _detect(self, apartment_number, voltage, current, power, timestamp):
+        """Flag sags, swells, spikes, level shifts and stuck sensors as they happen"""
+        for kind, value, expected, score in anomaly_detector.check(apartment_number, voltage, current,
+                                                                   power, timestamp):
+            anomalies_detected.inc(kind=kind)
+            batch_writer.submit_anomaly(apartment_number, kind, datetime.utcfromtimestamp(timestamp),
+                                        value, expected, score)
+            anomaly_log.warning("anomaly apartment=%s kind=%s value=%.2f expected=%.2f score=%.2f",
+                                apartment_number, kind, value, expected, score)
+    
+    def on_disconnect(self, client, userdata, rc, properties=None):
         print("Disconnected from MQTT Broker")
         self.connected = False
+        mqtt_connection_changes.inc(state='disconnected')
     
     def subscribe_to_all_apartments(self):
         """Subscribe to all apartment topics"""
-        # Subscribe to pattern: electricity/building/floor/apartment
-        topic_pattern = f"{MQTT_TOPIC_PREFIX}/+/+"
-        self.client.subscribe(topic_pattern)
-        print(f"Subscribed to topic pattern: {topic_pattern}")
+        # Subscribe to pattern: electricity/building/floor/apartment[/codec]
+        # (which covers electricity/building/batch/gateway[/codec]); subscribed apartment by
+        # apartment, batches still need their own filters
+        topic_filters = self.topic_filters or [batch_topic(MQTT_TOPIC_PREFIX, '+'),
+                                               f"{batch_topic(MQTT_TOPIC_PREFIX, '+')}/+"]
+        for topic_pattern in topic_filters:
+            self.client.subscribe(topic_pattern, MQTT_SUBSCRIBE_QOS)
+            print(f"Subscribed to topic pattern: {topic_pattern}")
+        self._subscribe_apartment_topics(sorted(self.apartments))
     
     def subscribe_to_apartment(self, apartment_number):
         """Subscribe to specific apartment topic"""
-        topic = f"{MQTT_TOPIC_PREFIX}/floor/{apartment_number}"
-        self.client.subscribe(topic)
-        print(f"Subscribed to apartment {apartment_number}: {topic}")
+        self.subscribe_to_apartments([apartment_number])
+        print(f"Subscribed to apartment {apartment_number}: {self.get_apartment_topic(apartment_number)}")
+    
+    def subscribe_to_apartments(self, apartment_numbers):
+        """Subscribe to the topics of several apartments (kept across reconnects)"""
+        new = sorted(set(apartment_numbers) - self.apartments)
+        self.apartments.update(new)
+        if self.connected:
+            self._subscribe_apartment_topics(new)
+        return new
+    
+    def _subscribe_apartment_topics(self, apartment_numbers):
+        # A handful of apartments per SUBSCRIBE packet keeps each packet small
+        for index in range(0, len(apartment_numbers), 50):
+            filters = []
+            for apartment_number in apartment_numbers[index:index + 50]:
+                topic = self.get_apartment_topic(apartment_number)
+                filters += [(topic, MQTT_SUBSCRIBE_QOS), (f"{topic}/+", MQTT_SUBSCRIBE_QOS)]
+            self.client.subscribe(filters)
     
     def start(self):
+        self.start_processing()
         try:
-            self.client.connect(MQTT_BROKER, MQTT_PORT, 60)
+            self.client.connect(MQTT_BROKER, MQTT_PORT, 60, properties=self.connect_properties)
             self.client.loop_start()
         except Exception as e:
             print(f"Failed to connect to MQTT broker: {e}")
@@ -144,8 +383,69 @@ class MQTTManager:
         """Get the MQTT topic for a specific apartment"""
         return f"{MQTT_TOPIC_PREFIX}/floor/{apartment_number}"
 
-# Initialize MQTT manager
+# Initialize MQTT manager and the write-behind persistence for its readings
+response_cache = ResponseCache()
+batch_writer = BatchWriter(app, cache=response_cache)
+live_broadcaster = LiveBroadcaster()
 mqtt_manager = MQTTManager()
+# With INGEST_MODE=workers, readings arrive through the database instead (see ingest_workers.py)
+latest_poller = LatestReadingPoller(app, power_store, live_broadcaster, cache=response_cache)
+
+# Values owned by other components are read when /metrics is scraped
+REGISTRY.gauge('mqtt_connected', 'Whether the MQTT client is connected',
+               function=lambda: 1 if mqtt_manager.connected else 0)
+REGISTRY.gauge('mqtt_queue_depth', 'Received MQTT messages waiting to be processed',
+               function=lambda: len(mqtt_manager.queue))
+REGISTRY.gauge('ingest_queue_depth', 'Readings waiting for the batch writer',
+               function=batch_writer.queue.qsize)
+REGISTRY.counter('ingest_readings_written_total', 'Readings persisted by the batch writer',
+                 function=lambda: batch_writer.written)
+REGISTRY.counter('ingest_readings_dropped_total', 'Readings dropped because the ingest queue was full',
+                 function=lambda: batch_writer.dropped)
+REGISTRY.counter('ingest_readings_unknown_total', 'Readings for apartments without a registered user',
+                 function=lambda: batch_writer.unknown)
+REGISTRY.counter('ingest_readings_failed_total', 'Readings lost to failed database writes',
+                 function=lambda: batch_writer.failed)
+REGISTRY.gauge('latest_store_apartments', 'Apartments in the latest-value store', function=lambda: len(power_store))
+REGISTRY.gauge('anomaly_tracked_apartments', 'Apartments with anomaly detector state',
+               function=lambda: len(anomaly_detector))
+REGISTRY.gauge('building_power_watts', 'Total power of the apartments reporting recently',
+               function=lambda: building_aggregates.total)
+REGISTRY.gauge('response_cache_entries', 'Responses in the cache', function=lambda: len(response_cache))
+REGISTRY.gauge('response_cache_bytes', 'Approximate memory used by cached responses',
+               function=lambda: response_cache.size)
+REGISTRY.counter('response_cache_hits_total', 'Responses served from the cache', function=lambda: response_cache.hits)
+REGISTRY.counter('response_cache_misses_total', 'Responses rendered because they were not cached',
+                 function=lambda: response_cache.misses)
+REGISTRY.counter('response_cache_invalidations_total', 'Cached responses dropped because new readings arrived',
+                 function=lambda: response_cache.invalidations)
+REGISTRY.counter('response_cache_evictions_total', 'Cached responses dropped to stay under the memory cap',
+                 function=lambda: response_cache.evictions)
+REGISTRY.gauge('live_subscribers', 'Open live dashboard streams', function=live_broadcaster.subscriber_count)
+
+def cached_response(kind, start, end, render):
+    """
+    Serve the current user's response from the cache, or render and cache it
+
+    The key is the apartment, path and query string. [start, end] bounds the reading timestamps
+    the response depends on (None: unbounded). Only 200 responses are cached; every response
+    carries an ETag so browsers can revalidate with If-None-Match and skip the body.
+    """
+    apartment_number = current_user.apartment_number
+    key = (apartment_number, request.path, tuple(sorted(request.args.items(multi=True))))
+    entry = response_cache.get(key)
+    if entry is None:
+        token = response_cache.begin()
+        rendered = app.make_response(render())
+        if rendered.status_code != 200:
+            return rendered
+        entry = response_cache.put(key, token, rendered.get_data(), rendered.mimetype,
+                                   apartment_number, kind, start, end)
+    response = Response(entry.body, mimetype=entry.mimetype)
+    response.set_etag(entry.etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True  # Always revalidate; a 304 is cheap
+    return response.make_conditional(request)
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -156,12 +456,7 @@ def load_user(user_id):
 def index():
     if current_user.is_authenticated:
         # Get data for current user's apartment
-        apartment_data = user_power_data.get(current_user.apartment_number, {
-            'voltage': 0,
-            'current': 0,
-            'power': 0,
-            'timestamp': None
-        })
+        apartment_data = get_apartment_data(current_user.apartment_number)
         return render_template('dashboard.html', data=apartment_data, apartment_number=current_user.apartment_number)
     return redirect(url_for('login'))
 
@@ -206,8 +501,11 @@ def register():
         db.session.add(user)
         db.session.commit()
         
-        # Subscribe to this apartment's MQTT topic
-        mqtt_manager.subscribe_to_apartment(form.apartment_number.data)
+        # Subscribe to this apartment's MQTT topic. Ingest workers, and serve.py processes that
+        # each own a share of the apartments, pick it up in their periodic refresh, so that
+        # only the owning process ingests it
+        if INGEST_MODE == 'embedded' and mqtt_manager.topic_filters:
+            mqtt_manager.subscribe_to_apartment(form.apartment_number.data)
         
         flash('Registration successful! Please login.')
         return redirect(url_for('login'))
@@ -223,32 +521,74 @@ def logout():
 @app.route('/api/power-data')
 @login_required
 def get_power_data():
-    apartment_data = user_power_data.get(current_user.apartment_number, {
-        'voltage': 0,
-        'current': 0,
-        'power': 0,
-        'timestamp': None
-    })
+    apartment_data = get_apartment_data(current_user.apartment_number)
     return jsonify(apartment_data)
 
+@app.route('/api/power-data/recent')
+@login_required
+def get_recent_power_data():
+    """Samples and summary of the last few minutes, served from memory"""
+    try:
+        seconds = float(request.args.get('seconds', 300))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid seconds'}), 400
+
+    apartment_number = current_user.apartment_number
+    return jsonify({
+        'samples': power_store.recent(apartment_number, seconds),
+        'stats': power_store.stats(apartment_number, seconds)
+    })
+
+@app.route('/api/stream')
+@login_required
+def stream_power_data():
+    """Server-Sent Events stream of the current user's apartment readings"""
+    apartment_number = current_user.apartment_number
+    subscription = live_broadcaster.subscribe(apartment_number)
+
+    def generate():
+        try:
+            # Start with the latest known value so the dashboard is filled immediately
+            sample = power_store.latest(apartment_number)
+            if sample is not None:
+                yield format_event(sample.to_dict())
+            while True:
+                message = subscription.wait(LIVE_KEEPALIVE)
+                # Comments keep proxies from closing idle connections
+                yield message if message is not None else ": keep-alive\n\n"
+        finally:
+            live_broadcaster.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Ingest metrics in the Prometheus text exposition format"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/save-reading', methods=['POST'])
 @login_required
 def save_reading():
     try:
-        apartment_data = user_power_data.get(current_user.apartment_number, {
-            'voltage': 0,
-            'current': 0,
-            'power': 0
-        })
+        apartment_data = get_apartment_data(current_user.apartment_number)
         
         reading = PowerReading(
             user_id=current_user.id,
             voltage=apartment_data['voltage'],
             current=apartment_data['current'],
-            power=apartment_data['power']
+            power=apartment_data['power'],
+            timestamp=datetime.utcnow()
         )
-        db.session.add(reading)
-        db.session.commit()
+        if reading_store is not None:
+            reading_store.append([{column: getattr(reading, column)
+                                   for column in ('user_id', 'voltage', 'current', 'power', 'timestamp')}])
+        else:
+            db.session.add(reading)
+            db.session.commit()
+        response_cache.invalidate(current_user.apartment_number, reading.timestamp, reading.timestamp)
         return jsonify({'status': 'success'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
@@ -256,16 +596,269 @@ def save_reading():
 @app.route('/history')
 @login_required
 def history():
-    readings = PowerReading.query.filter_by(user_id=current_user.id).order_by(PowerReading.timestamp.desc()).limit(100).all()
-    return render_template('history.html', readings=readings)
+    def render():
+        readings, _ = fetch_readings_page(current_user.id, limit=100)
+        return render_template('history.html', readings=readings)
+    # Pending flash messages are rendered into the page once, so never serve or cache them
+    if session.get('_flashes'):
+        return render()
+    return cached_response('history', None, None, render)
+
+@app.route('/api/history')
+@login_required
+def get_history():
+    """Readings in an optional from/to range, paginated with an opaque cursor"""
+    try:
+        start = parse_time(request.args.get('from'))
+        end = parse_time(request.args.get('to'))
+        limit = int(request.args.get('limit', 100))
+        cursor = request.args.get('cursor')
+        # Later pages only hold readings up to the cursor
+        newest = decode_cursor(cursor)[0] if cursor else None
+        if newest is not None and end is not None:
+            newest = min(newest, end)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    def render():
+        readings, next_cursor = fetch_readings_page(current_user.id, start, end, cursor, limit)
+        return jsonify({
+            'readings': [reading_to_dict(reading) for reading in readings],
+            'next_cursor': next_cursor
+        })
+    return cached_response('history', start, newest or end, render)
+
+@app.route('/api/export')
+@login_required
+def export_history():
+    """Download the apartment's readings in a from/to range as CSV or Parquet"""
+    export_format = request.args.get('format', 'csv')
+    try:
+        start = parse_time(request.args.get('from'))
+        end = parse_time(request.args.get('to'))
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {export_format}")
+        chunks = iter_reading_chunks(storage.read_engine(db.engine), [(current_user.id, current_user.apartment_number)], start, end)
+        body = stream_export(chunks, export_format)
+    except (ValueError, RuntimeError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    filename = f"readings-{current_user.apartment_number}.{export_format}"
+    return Response(body, mimetype=EXPORT_FORMATS[export_format], headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
+
+@app.route('/api/history/rollups')
+@login_required
+def get_history_rollups():
+    """Aggregated buckets for a range; the resolution is picked from the range unless given"""
+    try:
+        end = parse_time(request.args.get('to')) or datetime.utcnow()
+        start = parse_time(request.args.get('from')) or end - timedelta(days=1)
+        resolution = request.args.get('resolution')
+        if resolution is not None and resolution not in RESOLUTION_NAMES:
+            raise ValueError(f"Invalid resolution: {resolution}")
+        if start >= end:
+            raise ValueError("'from' must be before 'to'")
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    # Finer buckets may already be gone for older ranges
+    resolution = RESOLUTION_NAMES.get(resolution) or choose_resolution(start, end,
+                                                                       resolutions=retained_resolutions(start))
+
+    def render():
+        _, buckets = fetch_rollups(current_user.id, start, end, resolution)
+        return jsonify({
+            'resolution': resolution,
+            'buckets': [rollup_to_dict(bucket) for bucket in buckets]
+        })
+    # Recent buckets may still be sealed without new readings arriving, so treat them as open
+    settled = datetime.utcnow() - timedelta(seconds=resolution + ROLLUP_SEAL_GRACE + ROLLUP_SEAL_INTERVAL)
+    newest = end + timedelta(seconds=resolution) if end < settled else None
+    return cached_response('rollups', bucket_start(start, resolution), newest, render)
+
+def load_analytics_series():
+    """The current user's readings over the requested from/to range (default: last 30 days)"""
+    start, end = analytics.analytics_range(parse_time(request.args.get('from')),
+                                           parse_time(request.args.get('to')))
+    return analytics.load_series(current_user.id, start, end)
+
+def cached_analytics(render):
+    """Cache an analytics response over its from/to range; without 'to' it runs up to now"""
+    try:
+        start, end = analytics.analytics_range(parse_time(request.args.get('from')),
+                                               parse_time(request.args.get('to')))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return cached_response('analytics', start, end if request.args.get('to') else None, render)
+
+@app.route('/api/history/stats')
+@login_required
+def get_history_stats():
+    """Percentiles, peak and peak demand, load factor and base load over a range"""
+    def render():
+        try:
+            series = load_analytics_series()
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        return jsonify({'from': series.start.isoformat(), 'to': series.end.isoformat(),
+                        **analytics.summary(series)})
+    return cached_analytics(render)
+
+@app.route('/api/history/profile')
+@login_required
+def get_history_profile():
+    """Average load by hour of day (kind=daily) or by weekday and hour (kind=weekly)"""
+    def render():
+        try:
+            series = load_analytics_series()
+            profile = analytics.load_profile(series, request.args.get('kind', 'daily'),
+                                             request.args.get('tz', analytics.ANALYTICS_TIMEZONE))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        return jsonify({'from': series.start.isoformat(), 'to': series.end.isoformat(), **profile})
+    return cached_analytics(render)
+
+@app.route('/api/history/histogram')
+@login_required
+def get_history_histogram():
+    """Energy per time of day (kind=time) or hours per power band (kind=power)"""
+    kind = request.args.get('kind', 'time')
+
+    def render():
+        try:
+            series = load_analytics_series()
+            if kind == 'time':
+                histogram = analytics.time_of_day_histogram(series, int(request.args.get('bin_minutes', 60)),
+                                                            request.args.get('tz', analytics.ANALYTICS_TIMEZONE))
+            elif kind == 'power':
+                histogram = analytics.power_histogram(series, min(int(request.args.get('bins', 20)), 200))
+            else:
+                raise ValueError(f"Invalid histogram: {kind}")
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        return jsonify({'from': series.start.isoformat(), 'to': series.end.isoformat(), **histogram})
+    return cached_analytics(render)
+
+@app.route('/api/anomalies')
+@login_required
+def get_anomalies():
+    """Anomalies flagged for the apartment, newest first; optional from/to range and kind"""
+    try:
+        start = parse_time(request.args.get('from'))
+        end = parse_time(request.args.get('to'))
+        kind = request.args.get('kind')
+        if kind is not None and kind not in ANOMALY_KINDS:
+            raise ValueError(f"Invalid kind: {kind}")
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    query = Anomaly.query.filter(Anomaly.user_id == current_user.id)
+    if start is not None:
+        query = query.filter(Anomaly.timestamp >= start)
+    if end is not None:
+        query = query.filter(Anomaly.timestamp < end)
+    if kind is not None:
+        query = query.filter(Anomaly.kind == kind)
+    anomalies = query.order_by(Anomaly.timestamp.desc(), Anomaly.id.desc()).limit(limit).all()
+    return jsonify({'anomalies': [
+        {
+            'kind': anomaly.kind,
+            'timestamp': anomaly.timestamp.isoformat(),
+            'value': anomaly.value,
+            'expected': anomaly.expected,
+            'score': anomaly.score
+        }
+        for anomaly in anomalies
+    ]})
+
+@app.route('/api/energy')
+@login_required
+def get_energy():
+    """Consumption of the day, month, year (containing 'at', default now) and in total"""
+    try:
+        at = parse_time(request.args.get('at')) or datetime.utcnow()
+        period = request.args.get('period')
+        if period is not None and period not in PERIODS:
+            raise ValueError(f"Invalid period: {period}")
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    periods = (period,) if period else PERIODS
+    counters = fetch_energy(current_user.id, at, periods)
+    return jsonify({
+        'energy': [energy_to_dict(name, period_start(at, name), counters[name]) for name in periods]
+    })
+
+@app.route('/api/admin/building')
+@admin_required
+def get_building_load():
+    """Live building total, per-floor totals and the top consumers (`top`, default 10)"""
+    try:
+        top = min(max(int(request.args.get('top', 10)), 0), AGGREGATE_TOP_MAX)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid top'}), 400
+    building_aggregates.expire()
+    return jsonify({
+        'building': building_aggregates.building(),
+        'floors': building_aggregates.floor_totals(),
+        'top': building_aggregates.top(top)
+    })
+
+@app.route('/api/admin/floors/<floor>')
+@admin_required
+def get_floor_load(floor):
+    """Live total of one floor"""
+    building_aggregates.expire()
+    total = building_aggregates.floor(floor)
+    if total is None:
+        return jsonify({'status': 'error', 'message': f"No apartments reporting on floor {floor}"}), 404
+    return jsonify(total)
+
+@app.route('/api/admin/top')
+@admin_required
+def get_top_consumers():
+    """The `n` apartments (default 10) drawing the most power right now"""
+    try:
+        count = min(max(int(request.args.get('n', 10)), 1), AGGREGATE_TOP_MAX)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid n'}), 400
+    building_aggregates.expire()
+    return jsonify({'top': building_aggregates.top(count)})
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    
     with app.app_context():
-        db.create_all()
+        migrate_database()
+    
+    # Imported here: app.py is imported by retention.py when that runs as a script
+    from retention import RetentionJob
+    retention_job = RetentionJob(app, cache=response_cache)
     
-    # Start MQTT manager in a separate thread
-    mqtt_thread = threading.Thread(target=mqtt_manager.start)
-    mqtt_thread.daemon = True
-    mqtt_thread.start()
+    if INGEST_MODE == 'workers':
+        # ingest_workers.py consumes MQTT; only follow the latest values it stores
+        latest_poller.start()
+    else:
+        # Start the background writer before any readings arrive
+        batch_writer.start()
+        
+        # Start MQTT manager in a separate thread
+        mqtt_thread = threading.Thread(target=mqtt_manager.start)
+        mqtt_thread.daemon = True
+        mqtt_thread.start()
+    
+        # Expired history is deleted by whichever process writes readings
+        retention_job.start()
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    try:
+        # The reloader would run this block again in a child process, doubling the MQTT
+        # subscription, the batch writer and the retention job (and every stored reading)
+        app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=False)
+    finally:
+        retention_job.stop()
+        mqtt_manager.stop_processing()
+        batch_writer.stop()
+        latest_poller.stop()
\ No newline at end of file
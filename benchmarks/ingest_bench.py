@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Broker-free ingest benchmark for Electricity Monitor
+Feeds synthetic or recorded MQTT messages straight into MQTTManager.handle_message (the work
+of the processing thread behind on_message's queue) and the batch writer, and reports
+throughput, per-message latency and peak memory per scenario.
+
+Examples:
+    python benchmarks/ingest_bench.py
+    python benchmarks/ingest_bench.py --apartments 10 1000 --payload-sizes 64 512 --codec bin
+    python benchmarks/ingest_bench.py --batch-size 50    # gateway batches of 50 readings
+    python benchmarks/ingest_bench.py --replay recorded.jsonl
+    python benchmarks/ingest_bench.py --save benchmarks/baselines/ingest.json
+    python benchmarks/ingest_bench.py --compare benchmarks/baselines/ingest.json
+
+Recorded traffic is JSON Lines with one message per line:
+    {"topic": "electricity/building/floor/101", "payload": "{\\"voltage\\": 230.1, \\"current\\": 2.5}"}
+or "payload_b64" instead of "payload" for binary codecs.
+"""
+
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baselines', 'ingest.json')
+
+# Relative change that --compare reports as a regression
+THROUGHPUT_TOLERANCE = 0.10
+LATENCY_TOLERANCE = 0.20
+
+class FakeMessage:
+    """Stand-in for paho's MQTTMessage with just the fields on_message reads"""
+    __slots__ = ('topic', 'payload')
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+def synthetic_messages(count, apartments, payload_size, codec_name, prefix, batch_size=1):
+    """
+    Readings spread round-robin over the apartments, padded to roughly payload_size bytes
+
+    With batch_size > 1, `count` readings are sent as gateway batches of batch_size readings.
+    """
+    from payload_codecs import batch_topic, get_codec, reading_topic
+
+    codec = get_codec(codec_name)
+    if batch_size > 1:
+        topic = batch_topic(prefix, 'bench', codec.name)
+        readings = [
+            {'apartment': str(1000 + index % apartments), 'voltage': round(random.uniform(220.0, 240.0), 2),
+             'current': round(random.uniform(0.5, 15.0), 2), 'timestamp': time.time()}
+            for index in range(count)
+        ]
+        return [FakeMessage(topic, codec.encode_batch(readings[index:index + batch_size]))
+                for index in range(0, count, batch_size)]
+
+    topics = [reading_topic(prefix, str(1000 + index), codec.name) for index in range(apartments)]
+    messages = []
+    for index in range(count):
+        reading = {
+            'voltage': round(random.uniform(220.0, 240.0), 2),
+            'current': round(random.uniform(0.5, 15.0), 2),
+            'timestamp': time.time()
+        }
+        payload = codec.encode(reading)
+        if codec.name != 'bin' and len(payload) < payload_size:
+            reading['padding'] = 'x' * (payload_size - len(payload) - 14)
+            payload = codec.encode(reading)
+        messages.append(FakeMessage(topics[index % apartments], payload))
+    return messages
+
+def recorded_messages(path):
+    messages = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'payload_b64' in record:
+                payload = base64.b64decode(record['payload_b64'])
+            else:
+                payload = record['payload'].encode()
+            messages.append(FakeMessage(record['topic'], payload))
+    return messages
+
+def message_apartments(message):
+    """Apartment numbers a message carries readings for"""
+    from payload_codecs import codec_for_message, parse_batch_topic, parse_topic
+
+    apartment_number, _ = parse_topic(message.topic)
+    if apartment_number is not None:
+        return [apartment_number]
+    codec_name = parse_batch_topic(message.topic)
+    if codec_name is None:
+        return []
+    return [str(reading.get('apartment')) for reading in codec_for_message(message, codec_name).decode_batch(message.payload)]
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run_scenario(scenario, results):
+    """Run one scenario in a fresh process so peak RSS is not shared between scenarios"""
+    workdir = tempfile.mkdtemp(prefix='ingest-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    sys.path.insert(0, ROOT)
+
+    import app as app_module
+    from ingest import BatchWriter
+    from store import LatestValueStore
+    from models import db, User
+
+    if scenario['replay']:
+        messages = recorded_messages(scenario['replay'])
+    else:
+        messages = synthetic_messages(scenario['messages'], scenario['apartments'], scenario['payload_size'],
+                                      scenario['codec'], app_module.MQTT_TOPIC_PREFIX, scenario['batch_size'])
+
+    # Register every apartment that appears so all readings are persisted
+    carried = [message_apartments(message) for message in messages]
+    apartments = sorted({number for numbers in carried for number in numbers})
+    readings = sum(len(numbers) for numbers in carried)
+    with app_module.app.app_context():
+        db.create_all()
+        db.session.execute(db.insert(User), [
+            {'email': f"{number}@bench.local", 'password_hash': 'bench', 'apartment_number': number}
+            for number in apartments
+        ])
+        db.session.commit()
+
+    # Fresh components so scenarios do not see each other's state
+    writer = BatchWriter(app_module.app, max_queue=readings + 1)
+    app_module.batch_writer = writer
+    app_module.power_store = LatestValueStore()
+    writer.start()
+
+    handle_message = app_module.mqtt_manager.handle_message
+    latencies = []
+    clock = time.perf_counter
+    started = clock()
+    for message in messages:
+        before = clock()
+        handle_message(message, before)
+        latencies.append(clock() - before)
+    handled = clock()
+    writer.stop(timeout=600)
+    persisted = clock()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies.sort()
+    results.put({
+        'name': scenario['name'],
+        'messages': len(messages),
+        'apartments': len(apartments),
+        'payload_bytes': round(sum(len(message.payload) for message in messages) / max(1, len(messages)), 1),
+        'codec': scenario['codec'],
+        'on_message_per_sec': round(len(messages) / (handled - started), 1),
+        'readings_per_sec': round(readings / (handled - started), 1),
+        'end_to_end_per_sec': round(writer.written / (persisted - started), 1),
+        'p50_us': round(percentile(latencies, 0.50) * 1e6, 2),
+        'p99_us': round(percentile(latencies, 0.99) * 1e6, 2),
+        'written': writer.written,
+        'dropped': writer.dropped,
+        'failed': writer.failed,
+        # ru_maxrss is kilobytes on Linux and bytes on macOS
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                             / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    })
+
+def compare(results, baseline_path):
+    """Print regressions against a saved baseline; returns True if any were found"""
+    with open(baseline_path) as f:
+        baseline = {entry['name']: entry for entry in json.load(f)['results']}
+
+    regressed = False
+    for result in results:
+        previous = baseline.get(result['name'])
+        if previous is None:
+            continue
+        checks = (
+            ('on_message_per_sec', -THROUGHPUT_TOLERANCE),
+            ('end_to_end_per_sec', -THROUGHPUT_TOLERANCE),
+            ('p99_us', LATENCY_TOLERANCE),
+        )
+        for key, tolerance in checks:
+            change = (result[key] - previous[key]) / previous[key] if previous[key] else 0.0
+            if (tolerance < 0 and change < tolerance) or (tolerance > 0 and change > tolerance):
+                regressed = True
+                print(f"❌ {result['name']}: {key} {previous[key]} -> {result[key]} ({change:+.0%})")
+    if not regressed:
+        print("✅ No regressions against baseline")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description='Broker-free ingest benchmark')
+    parser.add_argument('--messages', '-n', type=int, default=20000, help='Messages per synthetic scenario')
+    parser.add_argument('--apartments', type=int, nargs='+', default=[10, 1000], help='Apartment counts to test')
+    parser.add_argument('--payload-sizes', type=int, nargs='+', default=[64, 512], help='Approximate payload sizes in bytes')
+    parser.add_argument('--codec', default='json', help='Payload codec for synthetic messages')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Readings per synthetic message (>1: gateway batches; payload sizes are ignored)')
+    parser.add_argument('--replay', help='JSON Lines file of recorded messages (replaces synthetic scenarios)')
+    parser.add_argument('--save', nargs='?', const=DEFAULT_BASELINE, help='Write results as a baseline JSON file')
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE, help='Compare results with a baseline file')
+    args = parser.parse_args()
+
+    if args.replay:
+        scenarios = [{'name': f"replay-{os.path.basename(args.replay)}", 'replay': args.replay, 'codec': 'recorded'}]
+    else:
+        scenarios = [
+            {'name': f"{args.codec}-{apartments}apt-{size}b", 'replay': None, 'messages': args.messages,
+             'apartments': apartments, 'payload_size': size, 'codec': args.codec, 'batch_size': 1}
+            for apartments in args.apartments
+            for size in args.payload_sizes
+        ] if args.batch_size <= 1 else [
+            {'name': f"{args.codec}-{apartments}apt-batch{args.batch_size}", 'replay': None,
+             'messages': args.messages, 'apartments': apartments, 'payload_size': 0, 'codec': args.codec,
+             'batch_size': args.batch_size}
+            for apartments in args.apartments
+        ]
+
+    print("🏁 Electricity Monitor - Ingest Benchmark")
+    print("=" * 100)
+    print(f"{'scenario':<28}{'msgs':>8}{'on_msg/s':>11}{'readings/s':>12}{'e2e/s':>10}{'p50 µs':>9}{'p99 µs':>9}"
+          f"{'rss MB':>9}{'written':>9}")
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for scenario in scenarios:
+        queue = context.Queue()
+        process = context.Process(target=run_scenario, args=(scenario, queue))
+        process.start()
+        result = None
+        while result is None and (process.is_alive() or not queue.empty()):
+            try:
+                result = queue.get(timeout=1)
+            except Exception:
+                pass
+        process.join()
+        if result is None:
+            print(f"❌ {scenario['name']}: benchmark process exited with code {process.exitcode}")
+            sys.exit(1)
+        results.append(result)
+        print(f"{result['name']:<28}{result['messages']:>8}{result['on_message_per_sec']:>11.0f}"
+              f"{result['readings_per_sec']:>12.0f}{result['end_to_end_per_sec']:>10.0f}{result['p50_us']:>9.1f}{result['p99_us']:>9.1f}"
+              f"{result['peak_rss_mb']:>9.1f}{result['written']:>9}")
+    print("=" * 100)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({
+                'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results
+            }, f, indent=2)
+        print(f"💾 Baseline written to {args.save}")
+
+    if args.compare and compare(results, args.compare):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
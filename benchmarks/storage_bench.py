@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+SQLite storage benchmark for Electricity Monitor
+Runs the batch writer in its own process (like an ingest worker) while web threads save single
+readings (like /save_reading) and read history pages against the same database file, once with
+SQLite's defaults (SQLITE_TUNING=off) and once with WAL, tuned pragmas, the single writer
+connection and the read pool (SQLITE_TUNING=on).
+
+Examples:
+    python benchmarks/storage_bench.py
+    python benchmarks/storage_bench.py --duration 20 --readers 16 --request-writers 4
+    python benchmarks/storage_bench.py --ingest-rate 0    # batch writer unthrottled
+    python benchmarks/storage_bench.py --save benchmarks/baselines/storage.json
+    python benchmarks/storage_bench.py --compare benchmarks/baselines/storage.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baselines', 'storage.json')
+
+# Relative change that --compare reports as a regression
+THROUGHPUT_TOLERANCE = 0.10
+LATENCY_TOLERANCE = 0.20
+
+# Seconds the ingest process gets to import the app before the clock starts
+INGEST_STARTUP = 3
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class Worker(threading.Thread):
+    """Repeats one operation until the deadline, recording latencies and errors"""
+
+    def __init__(self, operation, deadline):
+        super().__init__(daemon=True)
+        self.operation = operation
+        self.deadline = deadline
+        self.latencies = []
+        self.errors = 0
+        self.locked = 0  # "database is locked" errors
+        self.rows = 0
+
+    def run(self):
+        clock = time.perf_counter
+        while clock() < self.deadline:
+            before = clock()
+            try:
+                self.rows += self.operation() or 0
+            except Exception as e:
+                self.errors += 1
+                if 'locked' in str(e):
+                    self.locked += 1
+                continue
+            self.latencies.append(clock() - before)
+
+def setup(scenario):
+    """Point this process at the scenario's database; storage settings are read at import time"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(scenario['workdir'], 'bench.db')}"
+    os.environ['SQLITE_TUNING'] = scenario['tuning']
+    os.environ['DATABASE_BUSY_TIMEOUT'] = str(scenario['busy_timeout'])
+    sys.path.insert(0, ROOT)
+
+def run_ingest(scenario, ready, results):
+    """Batch writer in its own process, like an ingest worker next to the web tier"""
+    setup(scenario)
+    import app as app_module
+    from ingest import BatchWriter
+
+    apartments = [str(1000 + index) for index in range(scenario['apartments'])]
+    writer = BatchWriter(app_module.app)
+
+    interval = scenario['batch_size'] / scenario['ingest_rate'] if scenario['ingest_rate'] else 0
+    next_flush = [time.perf_counter()]
+
+    def ingest():
+        # Paced like MQTT arrivals so both configurations carry the same write load
+        next_flush[0] += interval
+        time.sleep(max(0.0, next_flush[0] - time.perf_counter()))
+        now = datetime.utcnow()
+        batch = [(random.choice(apartments), 230.0, 2.0, 460.0, now, time.perf_counter())
+                 for _ in range(scenario['batch_size'])]
+        written = writer.written
+        writer.flush(batch)
+        return writer.written - written
+
+    ready.wait()
+    next_flush[0] = time.perf_counter()
+    worker = Worker(ingest, next_flush[0] + scenario['duration'])
+    worker.run()
+    results.put({'rows': worker.rows, 'failed': writer.failed, 'latencies': worker.latencies,
+                 'errors': worker.errors, 'locked': worker.locked})
+
+def run_scenario(scenario, results):
+    """Run one configuration in fresh processes against a new database file"""
+    scenario = dict(scenario, workdir=tempfile.mkdtemp(prefix='storage-bench-'))
+    setup(scenario)
+
+    import app as app_module
+    from history import fetch_readings_page
+    from models import db, User, PowerReading
+    from sqlalchemy import text
+
+    app = app_module.app
+    with app.app_context():
+        db.create_all()
+        db.session.execute(db.insert(User), [
+            {'email': f"{1000 + index}@bench.local", 'password_hash': 'bench', 'apartment_number': str(1000 + index)}
+            for index in range(scenario['apartments'])
+        ])
+        user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+        # Existing history so page reads do real index work
+        start = datetime.utcnow() - timedelta(seconds=scenario['preload'])
+        db.session.execute(db.insert(PowerReading), [
+            {'user_id': user_ids[index % len(user_ids)], 'voltage': 230.0, 'current': 1.0, 'power': 230.0,
+             'timestamp': start + timedelta(seconds=index)}
+            for index in range(scenario['preload'])
+        ])
+        db.session.commit()
+        journal_mode = db.session.execute(text("PRAGMA journal_mode")).scalar()
+
+    def request_write():
+        with app.app_context():
+            db.session.add(PowerReading(user_id=random.choice(user_ids), voltage=230.0, current=1.0, power=230.0))
+            db.session.commit()
+        return 1
+
+    def read():
+        with app.app_context():
+            readings, _ = fetch_readings_page(random.choice(user_ids), limit=100)
+        return len(readings)
+
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    ingest_results = context.Queue()
+    ingester = context.Process(target=run_ingest, args=(scenario, ready, ingest_results))
+    ingester.start()
+    time.sleep(INGEST_STARTUP)
+
+    deadline = time.perf_counter() + scenario['duration']
+    request_writers = [Worker(request_write, deadline) for _ in range(scenario['request_writers'])]
+    readers = [Worker(read, deadline) for _ in range(scenario['readers'])]
+    workers = request_writers + readers
+    ready.set()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    ingest = ingest_results.get()
+    ingester.join()
+    shutil.rmtree(scenario['workdir'], ignore_errors=True)
+
+    def summary(latencies, errors, locked):
+        latencies = sorted(latencies)
+        return {
+            'ops_per_sec': round(len(latencies) / scenario['duration'], 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1e3, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1e3, 2),
+            'errors': errors,
+            'locked': locked,
+        }
+
+    def group_summary(group):
+        return summary([latency for worker in group for latency in worker.latencies],
+                       sum(worker.errors for worker in group), sum(worker.locked for worker in group))
+
+    results.put({
+        'name': scenario['name'],
+        'journal_mode': journal_mode,
+        'ingest_rows_per_sec': round(ingest['rows'] / scenario['duration'], 1),
+        'ingest_failed': ingest['failed'],
+        'ingest': summary(ingest['latencies'], ingest['errors'], ingest['locked']),
+        'request_writes': group_summary(request_writers),
+        'reads': group_summary(readers),
+    })
+
+def compare(results, baseline_path):
+    """Print regressions against a saved baseline; returns True if any were found"""
+    with open(baseline_path) as f:
+        baseline = {entry['name']: entry for entry in json.load(f)['results']}
+
+    regressed = False
+    for result in results:
+        previous = baseline.get(result['name'])
+        if previous is None:
+            continue
+        checks = (
+            (('ingest_rows_per_sec',), -THROUGHPUT_TOLERANCE),
+            (('reads', 'ops_per_sec'), -THROUGHPUT_TOLERANCE),
+            (('reads', 'p99_ms'), LATENCY_TOLERANCE),
+            (('request_writes', 'p99_ms'), LATENCY_TOLERANCE),
+        )
+        for path, tolerance in checks:
+            old, new = previous, result
+            for key in path:
+                old, new = old[key], new[key]
+            change = (new - old) / old if old else 0.0
+            if (tolerance < 0 and change < tolerance) or (tolerance > 0 and change > tolerance):
+                regressed = True
+                print(f"❌ {result['name']}: {'.'.join(path)} {old} -> {new} ({change:+.0%})")
+    if not regressed:
+        print("✅ No regressions against baseline")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite storage benchmark')
+    parser.add_argument('--duration', '-d', type=float, default=10, help='Seconds per configuration')
+    parser.add_argument('--apartments', type=int, default=200, help='Registered apartments')
+    parser.add_argument('--preload', type=int, default=200000, help='Readings in the database before the run')
+    parser.add_argument('--batch-size', type=int, default=500, help='Readings per batch writer flush')
+    parser.add_argument('--ingest-rate', type=float, default=1000,
+                        help='Readings per second offered to the batch writer (0: as fast as it can write)')
+    parser.add_argument('--readers', type=int, default=8, help='Threads reading history pages')
+    parser.add_argument('--request-writers', type=int, default=2, help='Threads saving single readings')
+    parser.add_argument('--busy-timeout', type=float, default=30, help='DATABASE_BUSY_TIMEOUT for both runs')
+    parser.add_argument('--save', nargs='?', const=DEFAULT_BASELINE, help='Write results as a baseline JSON file')
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE, help='Compare results with a baseline file')
+    args = parser.parse_args()
+
+    scenarios = [
+        {'name': name, 'tuning': tuning, 'duration': args.duration, 'apartments': args.apartments,
+         'preload': args.preload, 'batch_size': args.batch_size, 'ingest_rate': args.ingest_rate,
+         'readers': args.readers, 'request_writers': args.request_writers, 'busy_timeout': args.busy_timeout}
+        for name, tuning in (('default', 'off'), ('tuned', 'on'))
+    ]
+
+    print("🏁 Electricity Monitor - Storage Benchmark")
+    print("=" * 100)
+    print(f"{'config':<10}{'journal':>9}{'ingest rows/s':>15}{'save p99 ms':>13}"
+          f"{'reads/s':>10}{'read p50 ms':>13}{'read p99 ms':>13}{'locked':>8}{'errors':>8}")
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for scenario in scenarios:
+        queue = context.Queue()
+        process = context.Process(target=run_scenario, args=(scenario, queue))
+        process.start()
+        result = None
+        while result is None and (process.is_alive() or not queue.empty()):
+            try:
+                result = queue.get(timeout=1)
+            except Exception:
+                pass
+        process.join()
+        if result is None:
+            print(f"❌ {scenario['name']}: benchmark process exited with code {process.exitcode}")
+            sys.exit(1)
+        results.append(result)
+        groups = (result['ingest'], result['request_writes'], result['reads'])
+        print(f"{result['name']:<10}{result['journal_mode']:>9}{result['ingest_rows_per_sec']:>15.0f}"
+              f"{result['request_writes']['p99_ms']:>13.1f}{result['reads']['ops_per_sec']:>10.0f}"
+              f"{result['reads']['p50_ms']:>13.1f}{result['reads']['p99_ms']:>13.1f}"
+              f"{sum(group['locked'] for group in groups):>8}"
+              f"{sum(group['errors'] for group in groups) + result['ingest_failed']:>8}")
+    print("=" * 100)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({
+                'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results
+            }, f, indent=2)
+        print(f"💾 Baseline written to {args.save}")
+
+    if args.compare and compare(results, args.compare):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
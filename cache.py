@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Response cache for Electricity Monitor
+Rendered history, rollup and analytics responses are kept per apartment in an LRU with a TTL
+and a memory cap; the batch writer drops exactly the entries whose range received new readings
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Response Cache Configuration
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # 0 disables the cache
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 300))  # Bounds staleness from other processes
+ENTRY_OVERHEAD = 256  # Approximate bytes per entry besides the body
+RECENT_INVALIDATIONS = 1024  # Invalidations remembered to catch responses computed during a write
+
+class CachedResponse:
+    """A rendered response body with its ETag"""
+    __slots__ = ('body', 'mimetype', 'etag', 'apartment_number', 'kind', 'start', 'end', 'expires')
+
+    def __init__(self, body, mimetype, apartment_number, kind, start, end, expires):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.apartment_number = apartment_number
+        self.kind = kind  # 'history', 'rollups' or 'analytics'
+        self.start = start  # Oldest reading timestamp the body depends on (None: unbounded)
+        self.end = end  # Newest one (None: open-ended, changes with every new reading)
+        self.expires = expires
+
+    def overlaps(self, start, end):
+        """Whether readings timestamped within [start, end] could change this response"""
+        return (self.start is None or end >= self.start) and (self.end is None or start <= self.end)
+
+class ResponseCache:
+    """Thread-safe LRU of CachedResponse objects with per-apartment, range-precise invalidation"""
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 16
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> CachedResponse, least recently used first
+        self.by_apartment = {}  # apartment_number -> set of keys
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._sequence = 0
+        self._recent = deque(maxlen=RECENT_INVALIDATIONS)  # (sequence, apartment_number, start, end)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Cached response for key, or None if missing or expired"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.expires < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def begin(self):
+        """Token to pass to put(); taken before the data for a response is read"""
+        with self._lock:
+            return self._sequence
+
+    def put(self, key, token, body, mimetype, apartment_number, kind, start=None, end=None):
+        """
+        Cache a rendered body covering readings in [start, end] (None = unbounded)
+
+        Nothing is stored if readings in that range were written since begin() returned token,
+        because the body may have been computed from the data before the write.
+
+        Returns:
+            CachedResponse: The entry (also returned when it was not stored, for its ETag)
+        """
+        entry = CachedResponse(body, mimetype, apartment_number, kind, start, end,
+                               time.monotonic() + self.ttl)
+        cost = len(body) + ENTRY_OVERHEAD
+        if cost > self.max_entry_bytes:
+            return entry
+        with self._lock:
+            if self._changed_since(token, entry):
+                return entry
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.by_apartment.setdefault(apartment_number, set()).add(key)
+            self.size += cost
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return entry
+
+    def _changed_since(self, token, entry):
+        if token == self._sequence:
+            return False
+        if not self._recent or self._recent[0][0] > token + 1:
+            return True  # Older invalidations were forgotten; assume the worst
+        return any(
+            sequence > token and apartment_number in (None, entry.apartment_number)
+            and (start is None or entry.overlaps(start, end))
+            for sequence, apartment_number, start, end in self._recent
+        )
+
+    def invalidate(self, apartment_number, start, end):
+        """Drop the apartment's entries that depend on readings timestamped within [start, end]"""
+        with self._lock:
+            self._sequence += 1
+            self._recent.append((self._sequence, apartment_number, start, end))
+            keys = self.by_apartment.get(apartment_number)
+            if not keys:
+                return
+            for key in [key for key in keys if self.entries[key].overlaps(start, end)]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_open(self, kind):
+        """Drop the open-ended entries of one kind for every apartment"""
+        with self._lock:
+            self._sequence += 1
+            self._recent.append((self._sequence, None, None, None))
+            for key in [key for key, entry in self.entries.items()
+                        if entry.kind == kind and entry.end is None]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._sequence += 1
+            self._recent.append((self._sequence, None, None, None))
+            self.entries.clear()
+            self.by_apartment.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= len(entry.body) + ENTRY_OVERHEAD
+        keys = self.by_apartment[entry.apartment_number]
+        keys.discard(key)
+        if not keys:
+            del self.by_apartment[entry.apartment_number]
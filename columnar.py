@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Columnar reading storage for Electricity Monitor
+An optional backend for PowerReading history: each apartment's readings are appended to monthly
+segment files with one file per column (int64 microsecond timestamps, float32 values) and read
+back zero-copy through mmap, so range scans and analytics run over NumPy arrays instead of rows
+
+Layout:
+    <COLUMNAR_DIR>/<user_id>/<YYYY-MM>/timestamp.i8, voltage.f4, current.f4, power.f4
+
+Writers append the value columns first and the timestamps last under an exclusive lock on
+the timestamp file, so a reader that derives the row count from the timestamp file never sees
+a partial row. Readings arriving out of order mark the segment unsorted; it is then sorted on
+read. Rows are identified by (timestamp, position in the segment) for keyset pagination.
+"""
+
+import fcntl
+import os
+import shutil
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import numpy as np
+
+# Load environment variables
+load_dotenv()
+
+# Reading Backend Configuration
+READING_BACKEND = os.getenv('READING_BACKEND', 'sql')  # 'sql' (PowerReading rows) or 'columnar'
+COLUMNAR_DIR = os.getenv('COLUMNAR_DIR', 'readings')  # Segment root for the columnar backend
+READING_BACKENDS = ('sql', 'columnar')
+
+TIMESTAMP_COLUMN = ('timestamp', np.dtype('<i8'))
+VALUE_COLUMNS = (('voltage', np.dtype('<f4')), ('current', np.dtype('<f4')), ('power', np.dtype('<f4')))
+UNSORTED_MARKER = 'unsorted'
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+def to_micros(timestamp):
+    """Naive UTC datetime as integer microseconds since the epoch"""
+    return (timestamp - EPOCH) // MICROSECOND
+
+def partition_name(timestamp):
+    return f"{timestamp.year:04d}-{timestamp.month:02d}"
+
+def partition_bounds(name):
+    """[start, end) of a monthly partition in microseconds"""
+    year, month = int(name[:4]), int(name[5:7])
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    return to_micros(start), to_micros(end)
+
+def widen(values):
+    """float32 column as float64 rounded to float32 precision (230.12, not 230.1199951171875)"""
+    values = values.astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitude = np.floor(np.log10(np.abs(values)))
+    scale = 10.0 ** (6 - np.where(np.isfinite(magnitude), magnitude, 0))
+    return np.round(values * scale) / scale
+
+def _file(directory, column):
+    name, dtype = column
+    return os.path.join(directory, f"{name}.{dtype.kind}{dtype.itemsize}")
+
+class Segment:
+    """Read-only view of one partition: time-ordered column arrays plus each row's position"""
+    __slots__ = ('name', 'timestamps', 'columns', 'positions')
+
+    def __init__(self, name, timestamps, columns, positions):
+        self.name = name
+        self.timestamps = timestamps
+        self.columns = columns  # name -> float32 array, same order as timestamps
+        self.positions = positions  # Row position in the files (None: identical to the index)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def position(self, index):
+        return int(index if self.positions is None else self.positions[index])
+
+    def bounds(self, start=None, end=None):
+        """Index range of rows with start <= timestamp < end (microseconds)"""
+        low = 0 if start is None else int(np.searchsorted(self.timestamps, start, 'left'))
+        high = len(self) if end is None else int(np.searchsorted(self.timestamps, end, 'left'))
+        return low, max(low, high)
+
+    def before(self, timestamp, position):
+        """Index of the first row not strictly before (timestamp, position)"""
+        low, high = self.bounds(timestamp, timestamp + 1)
+        if self.positions is None:
+            return min(max(low, position), high)
+        # Ties keep file order after the stable sort, so their positions are increasing
+        return low + int(np.searchsorted(self.positions[low:high], position, 'left'))
+
+class ColumnarStore:
+    """Append-only columnar segments of PowerReading history under a root directory"""
+
+    def __init__(self, root=COLUMNAR_DIR):
+        self.root = root
+
+    def _directory(self, user_id, name):
+        return os.path.join(self.root, str(user_id), name)
+
+    def partitions(self, user_id, start=None, end=None):
+        """Partition names of an apartment overlapping [start, end) microseconds, oldest first"""
+        try:
+            names = sorted(os.listdir(os.path.join(self.root, str(user_id))))
+        except FileNotFoundError:
+            return []
+        selected = []
+        for name in names:
+            first, last = partition_bounds(name)
+            if (start is None or last > start) and (end is None or first < end):
+                selected.append(name)
+        return selected
+
+    def append(self, rows):
+        """
+        Append reading dicts (user_id, voltage, current, power, timestamp)
+
+        Not part of any database transaction: rows are visible to readers as soon as each
+        partition's timestamps are written.
+        """
+        groups = {}
+        for row in rows:
+            groups.setdefault((row['user_id'], partition_name(row['timestamp'])), []).append(row)
+        for (user_id, name), group in groups.items():
+            group.sort(key=lambda row: row['timestamp'])
+            timestamps = np.array([to_micros(row['timestamp']) for row in group], dtype=TIMESTAMP_COLUMN[1])
+            values = {column: np.array([row[column] for row in group], dtype=dtype)
+                      for column, dtype in VALUE_COLUMNS}
+            self._append_partition(self._directory(user_id, name), timestamps, values)
+
+    def _append_partition(self, directory, timestamps, values):
+        os.makedirs(directory, exist_ok=True)
+        fd = os.open(_file(directory, TIMESTAMP_COLUMN), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            itemsize = TIMESTAMP_COLUMN[1].itemsize
+            count = os.fstat(fd).st_size // itemsize
+            if count:
+                last = np.frombuffer(os.pread(fd, itemsize, (count - 1) * itemsize), dtype=TIMESTAMP_COLUMN[1])[0]
+                if timestamps[0] < last:
+                    open(os.path.join(directory, UNSORTED_MARKER), 'a').close()
+            # Values first, at the row count the timestamps define, which also overwrites
+            # whatever a crashed append left behind
+            for column in VALUE_COLUMNS:
+                column_fd = os.open(_file(directory, column), os.O_WRONLY | os.O_CREAT, 0o644)
+                try:
+                    os.pwrite(column_fd, values[column[0]].tobytes(), count * column[1].itemsize)
+                finally:
+                    os.close(column_fd)
+            os.pwrite(fd, timestamps.tobytes(), count * itemsize)
+        finally:
+            os.close(fd)
+
+    def drop_before(self, user_id, timestamp, dry_run=False):
+        """Delete the apartment's partitions that end at or before timestamp; returns readings removed"""
+        limit = to_micros(timestamp)
+        removed = 0
+        for name in self.partitions(user_id, end=limit):
+            if partition_bounds(name)[1] > limit:
+                break
+            segment = self.segment(user_id, name)
+            removed += len(segment) if segment is not None else 0
+            if not dry_run:
+                # Readers that already mapped the files keep their (unlinked) pages
+                shutil.rmtree(self._directory(user_id, name), ignore_errors=True)
+        return removed
+
+    def segment(self, user_id, name):
+        """Memory-mapped Segment of a partition, or None if it is empty"""
+        directory = self._directory(user_id, name)
+        try:
+            count = os.path.getsize(_file(directory, TIMESTAMP_COLUMN)) // TIMESTAMP_COLUMN[1].itemsize
+        except FileNotFoundError:
+            return None
+        if count == 0:
+            return None
+        try:
+            timestamps = np.memmap(_file(directory, TIMESTAMP_COLUMN), dtype=TIMESTAMP_COLUMN[1], mode='r', shape=(count,))
+            columns = {name: np.memmap(_file(directory, (name, dtype)), dtype=dtype, mode='r', shape=(count,))
+                       for name, dtype in VALUE_COLUMNS}
+        except FileNotFoundError:
+            return None  # Dropped by retention meanwhile
+        positions = None
+        if os.path.exists(os.path.join(directory, UNSORTED_MARKER)):
+            positions = np.argsort(timestamps, kind='stable')
+            timestamps = timestamps[positions]
+            columns = {name: column[positions] for name, column in columns.items()}
+        return Segment(name, timestamps, columns, positions)
+
+    def scan(self, user_id, start=None, end=None):
+        """
+        Yield (timestamps, columns) array slices of readings in [start, end), oldest first
+
+        Slices of sorted segments are views of the mapped files; nothing is copied.
+        """
+        start = to_micros(start) if start is not None else None
+        end = to_micros(end) if end is not None else None
+        for name in self.partitions(user_id, start, end):
+            segment = self.segment(user_id, name)
+            if segment is None:
+                continue
+            low, high = segment.bounds(start, end)
+            if high > low:
+                yield segment.timestamps[low:high], {name: column[low:high] for name, column in segment.columns.items()}
+
+    def page(self, user_id, start=None, end=None, before=None, limit=100):
+        """
+        Up to limit readings newest first, as (timestamp, position, voltage, current, power)
+
+        `before` is a (timestamp, position) key; only rows strictly older are returned.
+        """
+        start = to_micros(start) if start is not None else None
+        end = to_micros(end) if end is not None else None
+        cursor = None
+        if before is not None:
+            cursor = (to_micros(before[0]), before[1])
+            end = cursor[0] + 1 if end is None else min(end, cursor[0] + 1)
+
+        rows = []
+        for name in reversed(self.partitions(user_id, start, end)):
+            segment = self.segment(user_id, name)
+            if segment is None:
+                continue
+            low, high = segment.bounds(start, end)
+            if cursor is not None and segment.name == partition_name(EPOCH + cursor[0] * MICROSECOND):
+                high = max(low, min(high, segment.before(*cursor)))
+            first = max(low, high - (limit - len(rows)))
+            timestamps = segment.timestamps[first:high].astype('datetime64[us]').tolist()
+            values = [widen(segment.columns[column][first:high]).tolist() for column, _ in VALUE_COLUMNS]
+            for index in range(high - first - 1, -1, -1):
+                rows.append((timestamps[index], segment.position(first + index),
+                             values[0][index], values[1][index], values[2][index]))
+            if len(rows) >= limit:
+                break
+        return rows
+
+# The configured store; None while readings are stored as PowerReading rows
+reading_store = ColumnarStore(COLUMNAR_DIR) if READING_BACKEND == 'columnar' else None
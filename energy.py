@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Incremental energy accounting for Electricity Monitor
+Readings are integrated into kWh at ingest time and kept as running counters per apartment
+for each day, month, year and in total, so consumption queries are single-row lookups
+"""
+
+import os
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, EnergyCounter, PowerReading
+
+# Load environment variables
+load_dotenv()
+
+# Energy Configuration (ROLLUP_MAX_GAP is the older name of the same setting)
+ENERGY_MAX_GAP = float(os.getenv('ENERGY_MAX_GAP', os.getenv('ROLLUP_MAX_GAP', 300)))  # Longer gaps count as missing
+
+PERIODS = ('day', 'month', 'year', 'total')
+
+EPOCH = datetime(1970, 1, 1)
+
+def to_epoch(timestamp):
+    """Naive UTC datetime -> seconds since the epoch"""
+    return (timestamp - EPOCH).total_seconds()
+
+def period_start(timestamp, period):
+    """Start of the UTC day, month or year containing timestamp (EPOCH for 'total')"""
+    if period == 'day':
+        return datetime(timestamp.year, timestamp.month, timestamp.day)
+    if period == 'month':
+        return datetime(timestamp.year, timestamp.month, 1)
+    if period == 'year':
+        return datetime(timestamp.year, 1, 1)
+    if period == 'total':
+        return EPOCH
+    raise ValueError(f"Invalid period: {period}")
+
+def period_end(start, period):
+    """End (exclusive) of the period that begins at start"""
+    if period == 'day':
+        return start + timedelta(days=1)
+    if period == 'month':
+        return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    if period == 'year':
+        return datetime(start.year + 1, 1, 1)
+    return None
+
+class _LastSample:
+    __slots__ = ('seconds', 'power')
+
+    def __init__(self, seconds, power):
+        self.seconds = seconds
+        self.power = power
+
+class EnergyIntegrator:
+    """Trapezoidal integration of each apartment's power over the actual gaps between samples"""
+
+    def __init__(self, max_gap=ENERGY_MAX_GAP):
+        self.max_gap = max_gap
+        self.last = {}  # user_id -> _LastSample of the newest reading
+
+    def __contains__(self, user_id):
+        return user_id in self.last
+
+    def restore(self, user_id, seconds, power):
+        """Continue from a checkpointed sample (after a restart)"""
+        self.last[user_id] = _LastSample(seconds, power)
+
+    def forget(self, user_id):
+        """Drop the apartment's newest sample, so it is restored from its checkpoint again"""
+        self.last.pop(user_id, None)
+
+    def add(self, user_id, seconds, power):
+        """
+        Integrate one sample
+
+        Returns:
+            tuple: (energy in Wh, seconds covered, seconds missing) since the previous sample.
+            Gaps longer than max_gap are not integrated but reported as missing; readings
+            older than the newest one (out of order) contribute nothing.
+        """
+        previous = self.last.get(user_id)
+        if previous is None:
+            self.last[user_id] = _LastSample(seconds, power)
+            return 0.0, 0.0, 0.0
+        gap = seconds - previous.seconds
+        if gap <= 0:
+            return 0.0, 0.0, 0.0
+        energy = (previous.power + power) / 2 * gap / 3600
+        previous.seconds = seconds
+        previous.power = power
+        if gap > self.max_gap:
+            return 0.0, 0.0, gap
+        return energy, gap, 0.0
+
+class _CounterDelta:
+    __slots__ = ('energy', 'covered', 'missing', 'last_timestamp', 'last_power')
+
+    def __init__(self):
+        self.energy = 0.0
+        self.covered = 0.0
+        self.missing = 0.0
+        self.last_timestamp = None
+        self.last_power = None
+
+class EnergyAccumulator:
+    """Integrates ingested batches and adds them to the EnergyCounter rows in the writer's transaction"""
+
+    def __init__(self, max_gap=ENERGY_MAX_GAP):
+        self.integrator = EnergyIntegrator(max_gap)
+
+    def apply(self, rows):
+        """
+        Integrate reading rows (dicts with user_id, power, timestamp) in order and update
+        the counters. Does not commit.
+
+        Returns:
+            list: Energy in Wh attributed to each row (used for the rollups)
+        """
+        self._restore_checkpoints({row['user_id'] for row in rows})
+
+        energies = []
+        deltas = {}
+        for row in rows:
+            user_id = row['user_id']
+            timestamp = row['timestamp']
+            energy, covered, missing = self.integrator.add(user_id, to_epoch(timestamp), row['power'])
+            energies.append(energy)
+
+            # Energy between two samples is booked in the period of the later one
+            for period in PERIODS:
+                key = (user_id, period, period_start(timestamp, period))
+                delta = deltas.get(key)
+                if delta is None:
+                    delta = deltas[key] = _CounterDelta()
+                delta.energy += energy
+                delta.covered += covered
+                delta.missing += missing
+                if delta.last_timestamp is None or timestamp >= delta.last_timestamp:
+                    delta.last_timestamp = timestamp
+                    delta.last_power = row['power']
+
+        if deltas:
+            self._upsert(deltas)
+        return energies
+
+    def forget(self, user_ids):
+        """Discard integration state of apartments whose batch was rolled back"""
+        for user_id in user_ids:
+            self.integrator.forget(user_id)
+
+    def _restore_checkpoints(self, user_ids):
+        """Resume integration from the 'total' counters of apartments not seen since startup"""
+        missing = [user_id for user_id in user_ids if user_id not in self.integrator]
+        if not missing:
+            return
+        checkpoints = db.session.query(
+            EnergyCounter.user_id, EnergyCounter.last_timestamp, EnergyCounter.last_power
+        ).filter(
+            EnergyCounter.period == 'total',
+            EnergyCounter.user_id.in_(missing)
+        ).all()
+        for user_id, last_timestamp, last_power in checkpoints:
+            if last_timestamp is not None:
+                self.integrator.restore(user_id, to_epoch(last_timestamp), last_power)
+
+    def _upsert(self, deltas):
+        table = EnergyCounter.__table__
+        stmt = sqlite_insert(table)
+        excluded = stmt.excluded
+        newer = excluded.last_timestamp >= db.func.coalesce(table.c.last_timestamp, excluded.last_timestamp)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'period', 'period_start'],
+            set_={
+                'energy_wh': table.c.energy_wh + excluded.energy_wh,
+                'covered_seconds': table.c.covered_seconds + excluded.covered_seconds,
+                'missing_seconds': table.c.missing_seconds + excluded.missing_seconds,
+                'last_timestamp': db.case((newer, excluded.last_timestamp), else_=table.c.last_timestamp),
+                'last_power': db.case((newer, excluded.last_power), else_=table.c.last_power),
+            }
+        )
+        db.session.execute(stmt, [
+            {
+                'user_id': user_id,
+                'period': period,
+                'period_start': start,
+                'energy_wh': delta.energy,
+                'covered_seconds': delta.covered,
+                'missing_seconds': delta.missing,
+                'last_timestamp': delta.last_timestamp,
+                'last_power': delta.last_power
+            }
+            for (user_id, period, start), delta in deltas.items()
+        ])
+
+def fetch_energy(user_id, at=None, periods=PERIODS):
+    """
+    Counters of the periods containing `at` (default: now) in a single indexed query
+
+    Returns:
+        dict: period -> EnergyCounter or None if nothing was recorded in that period
+    """
+    at = at or datetime.utcnow()
+    keys = [(period, period_start(at, period)) for period in periods]
+    counters = EnergyCounter.query.filter(
+        EnergyCounter.user_id == user_id,
+        db.tuple_(EnergyCounter.period, EnergyCounter.period_start).in_(keys)
+    ).all()
+    found = {counter.period: counter for counter in counters}
+    return {period: found.get(period) for period in periods}
+
+def energy_to_dict(period, start, counter):
+    """Serialize one period's counter for JSON responses (zeros if nothing was recorded)"""
+    end = period_end(start, period)
+    energy_wh = counter.energy_wh if counter else 0.0
+    covered = counter.covered_seconds if counter else 0.0
+    missing = counter.missing_seconds if counter else 0.0
+    return {
+        'period': period,
+        'start': start.isoformat() if period != 'total' else None,
+        'end': end.isoformat() if end else None,
+        'energy_wh': energy_wh,
+        'energy_kwh': energy_wh / 1000,
+        # Share of the metered time that was integrated; gaps longer than ENERGY_MAX_GAP are excluded
+        'coverage': covered / (covered + missing) if covered + missing else None,
+        'missing_seconds': missing,
+        'last_reading': counter.last_timestamp.isoformat() if counter and counter.last_timestamp else None
+    }
+
+# Recomputes the day counters of one apartment in [:start, :end) from raw rows, starting
+# from the last reading before :start so the first gap is integrated or counted as missing.
+# SQLite returns the bare `power` column from the row that holds max(timestamp).
+_REBUILD_DAYS_SQL = """
+INSERT INTO energy_counter (user_id, period, period_start, energy_wh, covered_seconds,
+                            missing_seconds, last_timestamp, last_power)
+SELECT :user_id, 'day', date(timestamp) || ' 00:00:00.000000',
+       sum(energy), sum(covered), sum(missing), max(timestamp), power
+FROM (
+    SELECT timestamp, power,
+           CASE WHEN gap > 0 AND gap <= :max_gap THEN (power + prev_power) / 2 * gap / 3600 ELSE 0 END AS energy,
+           CASE WHEN gap > 0 AND gap <= :max_gap THEN gap ELSE 0 END AS covered,
+           CASE WHEN gap > :max_gap THEN gap ELSE 0 END AS missing
+    FROM (
+        SELECT timestamp, power, epoch,
+               epoch - LAG(epoch) OVER w AS gap,
+               LAG(power) OVER w AS prev_power
+        FROM (
+            SELECT id, timestamp, power,
+                   CAST(strftime('%s', substr(timestamp, 1, 19)) AS INTEGER)
+                   + CAST('0' || substr(timestamp, 20) AS REAL) AS epoch
+            FROM power_reading
+            WHERE user_id = :user_id AND timestamp >= :read_from AND timestamp < :end
+        )
+        WINDOW w AS (ORDER BY timestamp, id)
+    )
+    WHERE timestamp >= :start
+)
+GROUP BY date(timestamp)
+"""
+
+# Month, year and total counters are folded from all day counters of the apartment
+_REBUILD_FOLD_SQL = """
+INSERT INTO energy_counter (user_id, period, period_start, energy_wh, covered_seconds,
+                            missing_seconds, last_timestamp, last_power)
+SELECT :user_id, :period, {start},
+       sum(energy_wh), sum(covered_seconds), sum(missing_seconds), max(last_timestamp), last_power
+FROM energy_counter
+WHERE user_id = :user_id AND period = 'day'
+GROUP BY 3
+"""
+_FOLD_STARTS = {
+    'month': "strftime('%Y-%m-01 00:00:00.000000', period_start)",
+    'year': "strftime('%Y-01-01 00:00:00.000000', period_start)",
+    'total': "'1970-01-01 00:00:00.000000'",
+}
+
+def rebuild_energy_counters(user_ids, start, end, max_gap=ENERGY_MAX_GAP):
+    """
+    Recompute the counters of the given apartments from PowerReading after a bulk import
+
+    Day counters are rebuilt for the whole days between start and end, the longer periods
+    from the day counters. Does not commit.
+    """
+    start = period_start(start, 'day')
+    end = period_start(end, 'day') + timedelta(days=1)
+    date_type = EnergyCounter.__table__.c.period_start.type
+    days_sql = db.text(_REBUILD_DAYS_SQL).bindparams(
+        db.bindparam('read_from', type_=date_type), db.bindparam('start', type_=date_type),
+        db.bindparam('end', type_=date_type))
+
+    for user_id in user_ids:
+        previous = db.session.query(db.func.max(PowerReading.timestamp)).filter(
+            PowerReading.user_id == user_id,
+            PowerReading.timestamp < start
+        ).scalar()
+        EnergyCounter.query.filter(
+            EnergyCounter.user_id == user_id,
+            db.or_(
+                EnergyCounter.period != 'day',
+                db.and_(EnergyCounter.period_start >= start, EnergyCounter.period_start < end)
+            )
+        ).delete(synchronize_session=False)
+        db.session.execute(days_sql, {
+            'user_id': user_id,
+            'read_from': previous or start,
+            'start': start,
+            'end': end,
+            'max_gap': max_gap
+        })
+        for period, start_sql in _FOLD_STARTS.items():
+            db.session.execute(db.text(_REBUILD_FOLD_SQL.format(start=start_sql)),
+                               {'user_id': user_id, 'period': period})
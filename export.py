@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Streaming export of reading history for Electricity Monitor
+Readings are fetched in chunks from a streaming cursor and encoded chunk by chunk,
+so memory stays flat no matter how many rows are exported
+"""
+
+import csv
+import io
+
+from models import db, User, PowerReading
+from columnar import VALUE_COLUMNS, reading_store, widen
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+EXPORT_CHUNK_SIZE = 10000
+EXPORT_COLUMNS = ('apartment', 'timestamp', 'voltage', 'current', 'power')
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+def iter_reading_chunks(engine, apartments, start=None, end=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield lists of (apartment, timestamp, voltage, current, power) rows
+
+    Apartments are exported one after another, each in time order, so every query is a
+    range scan of the (user_id, timestamp) index.
+
+    Args:
+        engine: SQLAlchemy engine (db.engine, captured while an app context is active)
+        apartments (list): (user_id, apartment_number) pairs
+        start (datetime): Inclusive lower bound (optional)
+        end (datetime): Exclusive upper bound (optional)
+    """
+    if reading_store is not None:
+        yield from _iter_columnar_chunks(apartments, start, end, chunk_size)
+        return
+    with engine.connect() as connection:
+        streaming = connection.execution_options(stream_results=True, yield_per=chunk_size)
+        for user_id, apartment_number in apartments:
+            stmt = db.select(
+                PowerReading.timestamp, PowerReading.voltage, PowerReading.current, PowerReading.power
+            ).where(PowerReading.user_id == user_id)
+            if start is not None:
+                stmt = stmt.where(PowerReading.timestamp >= start)
+            if end is not None:
+                stmt = stmt.where(PowerReading.timestamp < end)
+            stmt = stmt.order_by(PowerReading.timestamp, PowerReading.id)
+
+            for partition in streaming.execute(stmt).partitions():
+                yield [(apartment_number,) + tuple(row) for row in partition]
+
+def _iter_columnar_chunks(apartments, start, end, chunk_size):
+    for user_id, apartment_number in apartments:
+        for timestamps, columns in reading_store.scan(user_id, start, end):
+            for offset in range(0, len(timestamps), chunk_size):
+                window = slice(offset, offset + chunk_size)
+                values = [widen(columns[name][window]).tolist() for name, _ in VALUE_COLUMNS]
+                yield [(apartment_number,) + row for row in
+                       zip(timestamps[window].astype('datetime64[us]').tolist(), *values)]
+
+def export_apartments(apartment_number=None):
+    """(user_id, apartment_number) pairs for one apartment or the whole building"""
+    query = db.session.query(User.id, User.apartment_number).order_by(User.apartment_number)
+    if apartment_number is not None:
+        query = query.filter(User.apartment_number == apartment_number)
+    return [tuple(row) for row in query.all()]
+
+def stream_csv(chunks):
+    """Encode row chunks as CSV, yielding bytes once per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in chunks:
+        writer.writerows(
+            (apartment, timestamp.isoformat() if timestamp else '', voltage, current, power)
+            for apartment, timestamp, voltage, current, power in chunk
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands written bytes back to the generator"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+def stream_parquet(chunks):
+    """Encode row chunks as a Parquet file, one row group per chunk"""
+    schema = pa.schema([
+        ('apartment', pa.string()),
+        ('timestamp', pa.timestamp('us')),
+        ('voltage', pa.float64()),
+        ('current', pa.float64()),
+        ('power', pa.float64()),
+    ])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for chunk in chunks:
+            columns = list(zip(*chunk)) if chunk else [[] for _ in EXPORT_COLUMNS]
+            writer.write_table(pa.Table.from_arrays([pa.array(column, type=field.type)
+                                                     for column, field in zip(columns, schema)], schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+def stream_export(chunks, export_format):
+    """Encoded byte chunks for the given format ('csv' or 'parquet')"""
+    if export_format == 'csv':
+        return stream_csv(chunks)
+    if export_format == 'parquet':
+        if pa is None:
+            raise RuntimeError("Parquet export needs the pyarrow package (pip install pyarrow)")
+        return stream_parquet(chunks)
+    raise ValueError(f"Unsupported export format: {export_format}")
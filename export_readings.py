@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Export reading history to CSV or Parquet
+Streams one apartment or the whole building without loading it into memory
+"""
+
+import argparse
+import sys
+
+from history import parse_time
+from export import EXPORT_FORMATS, export_apartments, iter_reading_chunks, stream_export
+from storage import read_engine
+
+def main():
+    parser = argparse.ArgumentParser(description='Export Electricity Monitor readings')
+    parser.add_argument('--apartment', '-a', help='Apartment number (default: whole building)')
+    parser.add_argument('--from', dest='start', help='Start time, ISO 8601 (inclusive)')
+    parser.add_argument('--to', dest='end', help='End time, ISO 8601 (exclusive)')
+    parser.add_argument('--format', '-f', choices=sorted(EXPORT_FORMATS), default='csv', help='Output format')
+    parser.add_argument('--output', '-o', help='Output file (default: stdout)')
+    args = parser.parse_args()
+
+    from app import app, db
+
+    try:
+        start = parse_time(args.start)
+        end = parse_time(args.end)
+    except ValueError as e:
+        parser.error(str(e))
+
+    with app.app_context():
+        apartments = export_apartments(args.apartment)
+        if not apartments:
+            print(f"❌ Apartment {args.apartment} not found", file=sys.stderr)
+            sys.exit(1)
+        chunks = iter_reading_chunks(read_engine(db.engine), apartments, start, end)
+
+        output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        try:
+            for data in stream_export(chunks, args.format):
+                output.write(data)
+        finally:
+            if args.output:
+                output.close()
+
+    if args.output:
+        print(f"✅ Exported {len(apartments)} apartment(s) to {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
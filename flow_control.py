@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Flow control between the MQTT client and reading processing for Electricity Monitor
+The network thread (or event loop) only puts received messages on a bounded queue; a
+processing thread decodes and stores them. When processing falls behind, the overload
+policy decides what happens, so memory and latency stay bounded and every message that
+is shed is counted:
+
+    block        wait for room (the broker stops delivering once its in-flight window of
+                 unacknowledged QoS 1 messages is full); dropped only after MQTT_BLOCK_TIMEOUT
+    drop-oldest  discard the oldest queued message
+    latest       keep only the newest queued single-reading message per apartment (batches,
+                 which mix apartments, are never superseded), then discard the oldest
+"""
+
+import threading
+from collections import OrderedDict, deque
+import os
+from dotenv import load_dotenv
+
+from metrics import REGISTRY
+
+# Load environment variables
+load_dotenv()
+
+# Subscriber Flow Control Configuration
+MQTT_QUEUE_SIZE = int(os.getenv('MQTT_QUEUE_SIZE', 10000))  # Received messages waiting to be processed at most
+MQTT_OVERLOAD_POLICY = os.getenv('MQTT_OVERLOAD_POLICY', 'block')  # block, drop-oldest or latest
+MQTT_BLOCK_TIMEOUT = float(os.getenv('MQTT_BLOCK_TIMEOUT', 30))  # Seconds 'block' waits; below the keep-alive
+OVERLOAD_POLICIES = ('block', 'drop-oldest', 'latest')
+
+# Flow control metrics (see /metrics)
+mqtt_messages_dropped = REGISTRY.counter('mqtt_messages_dropped_total',
+                                         'Received MQTT messages discarded by the overload policy', ['reason'])
+
+class IngestQueue:
+    """Bounded, thread-safe queue of received messages with an overload policy"""
+
+    def __init__(self, max_size=MQTT_QUEUE_SIZE, policy=MQTT_OVERLOAD_POLICY, block_timeout=MQTT_BLOCK_TIMEOUT):
+        if policy not in OVERLOAD_POLICIES:
+            raise ValueError(f"Unknown overload policy {policy!r} (expected one of {', '.join(OVERLOAD_POLICIES)})")
+        self.max_size = max_size
+        self.policy = policy
+        self.block_timeout = block_timeout
+        # 'latest' replaces queued messages by key, the other policies only append and pop
+        self._items = OrderedDict() if policy == 'latest' else deque()
+        self._condition = threading.Condition()
+        self.dropped = {'overflow': 0, 'superseded': 0, 'timeout': 0}
+
+    def __len__(self):
+        return len(self._items)
+
+    def full(self):
+        return len(self._items) >= self.max_size
+
+    def put(self, item, key=None, block=True):
+        """
+        Queue an item; returns False if it was dropped instead
+
+        With the 'latest' policy it replaces a queued item with the same key (None: never replaced).
+        With the 'block' policy and block=False a full queue still takes the item: the caller
+        is expected to stop reading until full() is False (see mqtt_asyncio).
+        """
+        with self._condition:
+            if self.policy == 'latest':
+                if key is not None and key in self._items:
+                    # Keeps its place in the queue, with the newer message
+                    self._items[key] = item
+                    self._drop('superseded')
+                    return True
+                if self.full():
+                    self._items.popitem(last=False)
+                    self._drop('overflow')
+                self._items[object() if key is None else key] = item
+            else:
+                if self.full():
+                    if self.policy == 'drop-oldest':
+                        self._items.popleft()
+                        self._drop('overflow')
+                    elif block and not self._condition.wait_for(lambda: not self.full(), self.block_timeout):
+                        self._drop('timeout')
+                        return False
+                self._items.append(item)
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """Oldest item, or None if nothing arrived within timeout"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._items, timeout):
+                return None
+            if self.policy == 'latest':
+                item = self._items.popitem(last=False)[1]
+            else:
+                item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def _drop(self, reason):
+        self.dropped[reason] += 1
+        mqtt_messages_dropped.inc(reason=reason)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Reading history queries for Electricity Monitor
+Range filtering and keyset (cursor) pagination over PowerReading (or the columnar store)
+"""
+
+import base64
+from datetime import datetime, timezone
+
+from sqlalchemy import tuple_
+
+from models import PowerReading
+from columnar import reading_store
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def parse_time(value):
+    """Parse an ISO 8601 query parameter into a naive UTC datetime (None if empty)"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def encode_cursor(reading):
+    """Build an opaque cursor pointing just past the given reading"""
+    raw = f"{reading.timestamp.isoformat()}|{reading.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor into (timestamp, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, reading_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(reading_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+def fetch_readings_page(user_id, start=None, end=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of readings, newest first
+
+    Args:
+        user_id (int): Owner of the readings
+        start (datetime): Inclusive lower bound (optional)
+        end (datetime): Exclusive upper bound (optional)
+        cursor (str): Cursor returned with the previous page (optional)
+        limit (int): Page size, capped at MAX_PAGE_SIZE
+
+    Returns:
+        tuple: (list of PowerReading, next cursor or None)
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    if reading_store is not None:
+        return _fetch_columnar_page(user_id, start, end, cursor, limit)
+
+    query = PowerReading.query.filter(PowerReading.user_id == user_id)
+    if start is not None:
+        query = query.filter(PowerReading.timestamp >= start)
+    if end is not None:
+        query = query.filter(PowerReading.timestamp < end)
+    if cursor:
+        # Seek past the last row of the previous page instead of using OFFSET
+        timestamp, reading_id = decode_cursor(cursor)
+        query = query.filter(tuple_(PowerReading.timestamp, PowerReading.id) < (timestamp, reading_id))
+
+    readings = query.order_by(PowerReading.timestamp.desc(), PowerReading.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(readings) > limit:
+        readings = readings[:limit]
+        next_cursor = encode_cursor(readings[-1])
+    return readings, next_cursor
+
+def _fetch_columnar_page(user_id, start, end, cursor, limit):
+    # Rows come back as transient PowerReading objects whose id is the position in the segment
+    before = decode_cursor(cursor) if cursor else None
+    rows = reading_store.page(user_id, start, end, before, limit + 1)
+    readings = [
+        PowerReading(id=position, user_id=user_id, voltage=voltage, current=current, power=power, timestamp=timestamp)
+        for timestamp, position, voltage, current, power in rows
+    ]
+
+    next_cursor = None
+    if len(readings) > limit:
+        readings = readings[:limit]
+        next_cursor = encode_cursor(readings[-1])
+    return readings, next_cursor
+
+def reading_to_dict(reading):
+    """Serialize a PowerReading for JSON responses"""
+    return {
+        'voltage': reading.voltage,
+        'current': reading.current,
+        'power': reading.power,
+        'timestamp': reading.timestamp.isoformat() if reading.timestamp else None
+    }
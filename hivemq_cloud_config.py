@@ -5,13 +5,15 @@ This script is configured to connect to your HiveMQ Cloud cluster
 """
 
 import paho.mqtt.client as mqtt
-import json
 import time
 import random
 import sys
 import ssl
 from datetime import datetime
 
+from mqtt_utils import MQTT_ACK_TIMEOUT, connect_client
+from payload_codecs import CODEC_NAMES, DEFAULT_CODEC, get_codec, reading_topic
+
 # HiveMQ Cloud Configuration
 HIVEMQ_CLUSTER = "99c268dc5c2849e4a28a6723863ddb8d.s1.eu.hivemq.cloud"
 HIVEMQ_PORT = 8883
@@ -37,9 +39,10 @@ def on_publish(client, userdata, mid):
 def on_disconnect(client, userdata, rc):
     print("🔌 Disconnected from HiveMQ Cloud")
 
-def send_apartment_105_data(client, voltage, current, additional_data=None):
-    """Send electricity data for apartment 105 to HiveMQ Cloud"""
-    topic = f"{TOPIC_PREFIX}/floor/{APARTMENT_NUMBER}"
+def send_apartment_105_data(client, voltage, current, additional_data=None, codec=DEFAULT_CODEC, qos=0):
+    """Send electricity data for apartment 105 to HiveMQ Cloud (with QoS 1, wait for its acknowledgement)"""
+    codec = get_codec(codec)
+    topic = reading_topic(TOPIC_PREFIX, APARTMENT_NUMBER, codec.name)
     
     data = {
         "voltage": voltage,
@@ -56,10 +59,12 @@ def send_apartment_105_data(client, voltage, current, additional_data=None):
     if additional_data:
         data.update(additional_data)
     
-    message = json.dumps(data, indent=2)
-    result = client.publish(topic, message)
+    message = codec.encode(data)
+    result = client.publish(topic, message, qos)
+    if result.rc == mqtt.MQTT_ERR_SUCCESS and qos > 0:
+        result.wait_for_publish(MQTT_ACK_TIMEOUT)
     
-    if result.rc == mqtt.MQTT_ERR_SUCCESS:
+    if result.rc == mqtt.MQTT_ERR_SUCCESS and (qos == 0 or result.is_published()):
         power = voltage * current
         print(f"📊 Apartment {APARTMENT_NUMBER}: V={voltage}V, I={current}A, P={power:.2f}W")
         print(f"📡 Topic: {topic}")
@@ -68,7 +73,7 @@ def send_apartment_105_data(client, voltage, current, additional_data=None):
         print(f"❌ Failed to publish to HiveMQ Cloud: {result.rc}")
         return False
 
-def simulate_apartment_105_data(duration=60, interval=3):
+def simulate_apartment_105_data(duration=60, interval=3, codec=DEFAULT_CODEC):
     """Simulate continuous electricity data for apartment 105"""
     print(f"🏠 HiveMQ Cloud Electricity Monitor - Apartment {APARTMENT_NUMBER}")
     print("=" * 70)
@@ -91,20 +96,18 @@ def simulate_apartment_105_data(duration=60, interval=3):
     context.verify_mode = ssl.CERT_NONE
     client.tls_set_context(context)
     
+    reading_count = 0
     try:
         # Connect to HiveMQ Cloud
         print("🔄 Connecting to HiveMQ Cloud...")
-        client.connect(HIVEMQ_CLUSTER, HIVEMQ_PORT, 60)
-        client.loop_start()
-        
-        # Wait for connection
-        time.sleep(3)
+        if not connect_client(client, HIVEMQ_CLUSTER, HIVEMQ_PORT):
+            print("❌ Could not connect to HiveMQ Cloud")
+            return
         
         print(f"🔄 Starting simulation for apartment {APARTMENT_NUMBER}...")
         print("Press Ctrl+C to stop")
         
         start_time = time.time()
-        reading_count = 0
         
         while time.time() - start_time < duration:
             # Simulate realistic electricity values for apartment 105
@@ -119,7 +122,7 @@ def simulate_apartment_105_data(duration=60, interval=3):
                 "battery_level": round(random.uniform(80.0, 100.0), 1)
             }
             
-            if send_apartment_105_data(client, voltage, current, additional_data):
+            if send_apartment_105_data(client, voltage, current, additional_data, codec):
                 reading_count += 1
             
             time.sleep(interval)
@@ -129,11 +132,11 @@ def simulate_apartment_105_data(duration=60, interval=3):
     except Exception as e:
         print(f"❌ Error: {e}")
     finally:
-        client.loop_stop()
         client.disconnect()
+        client.loop_stop()
         print(f"📊 Simulation complete: {reading_count} readings sent to HiveMQ Cloud")
 
-def send_single_reading(voltage, current):
+def send_single_reading(voltage, current, codec=DEFAULT_CODEC):
     """Send a single reading for apartment 105"""
     client = mqtt.Client()
     client.username_pw_set(HIVEMQ_USERNAME, HIVEMQ_PASSWORD)
@@ -148,19 +151,19 @@ def send_single_reading(voltage, current):
     client.tls_set_context(context)
     
     try:
-        client.connect(HIVEMQ_CLUSTER, HIVEMQ_PORT, 60)
-        client.loop_start()
-        time.sleep(3)
+        if not connect_client(client, HIVEMQ_CLUSTER, HIVEMQ_PORT):
+            print("❌ Could not connect to HiveMQ Cloud")
+            return False
         
-        success = send_apartment_105_data(client, voltage, current)
-        return success
+        # QoS 1: done as soon as the broker has the reading
+        return send_apartment_105_data(client, voltage, current, codec=codec, qos=1)
     
     except Exception as e:
         print(f"❌ Error: {e}")
         return False
     finally:
-        client.loop_stop()
         client.disconnect()
+        client.loop_stop()
 
 def main():
     """Main function with command line options"""
@@ -172,16 +175,17 @@ def main():
     parser.add_argument('--continuous', action='store_true', help='Run continuous simulation')
     parser.add_argument('--duration', '-d', type=int, default=60, help='Duration in seconds for continuous mode')
     parser.add_argument('--interval', '-i', type=int, default=3, help='Interval in seconds for continuous mode')
+    parser.add_argument('--codec', choices=CODEC_NAMES, default=DEFAULT_CODEC, help='Payload encoding (default: json)')
     
     args = parser.parse_args()
     
     if args.continuous:
-        simulate_apartment_105_data(args.duration, args.interval)
+        simulate_apartment_105_data(args.duration, args.interval, args.codec)
     elif args.voltage is not None and args.current is not None:
-        send_single_reading(args.voltage, args.current)
+        send_single_reading(args.voltage, args.current, args.codec)
     else:
         # Default: run simulation for 30 seconds
-        simulate_apartment_105_data(30, 3)
+        simulate_apartment_105_data(30, 3, args.codec)
 
 if __name__ == "__main__":
     main()
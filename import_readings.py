@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Bulk import (backfill) of historical readings
+Loads CSV or JSON Lines meter dumps into PowerReading with executemany, in transactions
+short enough for a running app to keep writing in between, and rebuilds the rollups once
+all rows are in (or appends them to the columnar segments when READING_BACKEND=columnar)
+
+Expected columns / keys: apartment, timestamp (ISO 8601 or seconds since the epoch, as in
+gateway batches), voltage, current and optionally power (the same layout export_readings.py
+writes).
+"""
+
+import argparse
+import csv
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import count, islice
+
+from history import parse_time
+from payload_codecs import epoch_seconds
+
+INSERT_SQL = "INSERT INTO power_reading (user_id, voltage, current, power, timestamp) VALUES (?, ?, ?, ?, ?)"
+STAGE_SQL = ("INSERT INTO temp.power_reading (id, user_id, voltage, current, power, timestamp) "
+             "VALUES (?, ?, ?, ?, ?, ?)")
+# Same text format SQLAlchemy uses for DateTime columns on SQLite
+SQLITE_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+def read_records(path, file_format):
+    """Yield dict records from a CSV or JSON Lines file"""
+    if file_format == 'auto':
+        file_format = 'jsonl' if path.endswith(('.jsonl', '.json', '.ndjson')) else 'csv'
+    with open(path, newline='') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+class ImportStats:
+    __slots__ = ('rows', 'skipped_unknown', 'skipped_invalid', 'first', 'last', 'user_ids')
+
+    def __init__(self):
+        self.rows = 0
+        self.skipped_unknown = 0
+        self.skipped_invalid = 0
+        self.first = None
+        self.last = None
+        self.user_ids = set()
+
+def record_time(value):
+    """Naive UTC datetime of a record's timestamp: ISO 8601 text or seconds since the epoch"""
+    if value is None or value == '':
+        raise ValueError("missing timestamp")
+    if isinstance(value, str):
+        try:
+            value = float(value)  # CSV cells are text
+        except ValueError:
+            return parse_time(value)
+    return datetime.utcfromtimestamp(epoch_seconds(value))
+
+def convert_chunk(records, user_ids, stats, as_text=True):
+    """Turn records into INSERT parameter tuples, skipping unknown apartments and bad rows"""
+    rows = []
+    for record in records:
+        if not isinstance(record, dict):
+            stats.skipped_invalid += 1  # A JSON line that is not an object
+            continue
+        user_id = user_ids.get(str(record.get('apartment', '')))
+        if user_id is None:
+            stats.skipped_unknown += 1
+            continue
+        try:
+            timestamp = record_time(record.get('timestamp'))
+            voltage = float(record['voltage'])
+            current = float(record['current'])
+            power = float(record['power']) if record.get('power') not in (None, '') else voltage * current
+        except (ValueError, KeyError, TypeError, AttributeError, OverflowError, OSError):
+            stats.skipped_invalid += 1
+            continue
+
+        rows.append((user_id, voltage, current, power,
+                     timestamp.strftime(SQLITE_DATETIME_FORMAT) if as_text else timestamp))
+        stats.user_ids.add(user_id)
+        if stats.first is None or timestamp < stats.first:
+            stats.first = timestamp
+        if stats.last is None or timestamp > stats.last:
+            stats.last = timestamp
+    return rows
+
+def import_files(paths, file_format='auto', chunk_size=50000, commit_every=50000,
+                 drop_indexes=False, skip_rollups=False):
+    """Import the given files; returns ImportStats"""
+    from app import app
+    from models import db, User, PowerReading
+    from rollups import rebuild_rollups
+    from energy import rebuild_energy_counters
+    from storage import writing
+    from columnar import reading_store
+
+    stats = ImportStats()
+    with app.app_context():
+        user_ids = dict(db.session.query(User.apartment_number, User.id).all())
+        chunks = iter_chunks(paths, file_format, chunk_size, user_ids, stats, as_text=reading_store is None)
+        if reading_store is not None:
+            append_columnar(reading_store, chunks, stats)
+            deferred = []
+        else:
+            deferred = list(PowerReading.__table__.indexes) if drop_indexes else []
+            insert_sql(db.engine, chunks, deferred, commit_every, stats)
+
+        # Rebuild what was deferred, now in one pass over sorted data
+        for index in deferred:
+            print(f"🔧 Rebuilding index {index.name}", file=sys.stderr)
+            index.create(bind=db.engine, checkfirst=True)
+
+        if not skip_rollups and stats.rows:
+            print(f"🔧 Rebuilding rollups and energy counters for {len(stats.user_ids)} apartment(s)", file=sys.stderr)
+            with writing():
+                if reading_store is not None:
+                    stage_columnar(db.session, reading_store, sorted(stats.user_ids), stats.first, stats.last)
+                    db.session.commit()  # A TEMP table: no lock on the database file
+                kept = 0
+                for user_id in sorted(stats.user_ids):
+                    start = rebuild_start(user_id, stats.first)
+                    if start > stats.first:
+                        kept += 1
+                    if start <= stats.last:
+                        rebuild_rollups([user_id], start, stats.last)
+                        rebuild_energy_counters([user_id], start, stats.last)
+                        # One apartment per transaction, so live writers get the lock in between
+                        db.session.commit()
+                if kept:
+                    print(f"⚠️  Kept the existing rollups and energy counters of {kept} apartment(s) for days whose "
+                          f"raw readings retention may have deleted; imported readings of those days are not "
+                          f"included in them", file=sys.stderr)
+                if reading_store is not None:
+                    db.session.execute(db.text("DROP TABLE temp.power_reading"))
+                    db.session.commit()
+
+    return stats
+
+def rebuild_start(user_id, first, now=None):
+    """
+    Earliest time from which an apartment's rollups and energy counters can be rebuilt from raw rows
+
+    With RETENTION_RAW_DAYS, retention may have deleted the raw readings of days before the
+    window, leaving their rollups as the only record; a rebuild would replace those with the
+    imported rows alone. Such days are only rebuilt after the apartment's newest rollup
+    before the window (all of them for an apartment that has none, as when onboarding).
+    """
+    from models import db, PowerRollup
+    from rollups import DAY, bucket_start
+    from retention import RETENTION_RAW_DAYS
+
+    if not RETENTION_RAW_DAYS:
+        return first
+    cutoff = (now or datetime.utcnow()) - timedelta(days=RETENTION_RAW_DAYS)
+    window = bucket_start(cutoff, DAY)
+    if window < cutoff:
+        window += timedelta(seconds=DAY)  # The first whole day retention has not touched
+    if first >= window:
+        return first
+    newest = db.session.query(db.func.max(PowerRollup.bucket_start)).filter(
+        PowerRollup.user_id == user_id,
+        PowerRollup.bucket_start < window
+    ).scalar()
+    if newest is None:
+        return first
+    return max(first, min(bucket_start(newest, DAY) + timedelta(seconds=DAY), window))
+
+def iter_chunks(paths, file_format, chunk_size, user_ids, stats, as_text=True):
+    """Yield converted row tuples chunk by chunk over all files"""
+    for path in paths:
+        records = read_records(path, file_format)
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            yield convert_chunk(chunk, user_ids, stats, as_text)
+
+def insert_sql(engine, chunks, deferred, commit_every, stats):
+    """Insert into power_reading over a raw connection with the given indexes dropped"""
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        # Durability of the import itself is not needed: a failed import is simply re-run
+        cursor.execute("PRAGMA synchronous = OFF")
+        for index in deferred:
+            cursor.execute(f"DROP INDEX IF EXISTS {index.name}")
+
+        uncommitted = 0
+        started = time.monotonic()
+        for rows in chunks:
+            cursor.executemany(INSERT_SQL, rows)
+            stats.rows += len(rows)
+            uncommitted += len(rows)
+            if uncommitted >= commit_every:
+                connection.commit()
+                uncommitted = 0
+                elapsed = time.monotonic() - started
+                print(f"📥 {stats.rows} rows ({stats.rows / elapsed:.0f} rows/s)", file=sys.stderr)
+        connection.commit()
+    finally:
+        connection.close()
+
+def append_columnar(store, chunks, stats):
+    """Append to the columnar segments, one append per chunk"""
+    started = time.monotonic()
+    for rows in chunks:
+        store.append([
+            {'user_id': user_id, 'voltage': voltage, 'current': current, 'power': power, 'timestamp': timestamp}
+            for user_id, voltage, current, power, timestamp in rows
+        ])
+        stats.rows += len(rows)
+        elapsed = time.monotonic() - started
+        print(f"📥 {stats.rows} rows ({stats.rows / max(elapsed, 1e-9):.0f} rows/s)", file=sys.stderr)
+
+def stage_columnar(session, store, user_ids, first, last):
+    """
+    Copy the readings the rollup and energy rebuilds read into a TEMP power_reading table
+
+    On this connection the temp table shadows the real (empty) one, so the SQL rebuilds run
+    unchanged. Covers whole days plus ENERGY_MAX_GAP before them and the reading preceding that.
+    """
+    from energy import ENERGY_MAX_GAP
+    from columnar import VALUE_COLUMNS, widen
+
+    connection = session.connection()
+    connection.exec_driver_sql("CREATE TEMP TABLE power_reading AS SELECT * FROM main.power_reading WHERE 0")
+    start = datetime(first.year, first.month, first.day) - timedelta(seconds=ENERGY_MAX_GAP)
+    end = datetime(last.year, last.month, last.day) + timedelta(days=1)
+    ids = count(1)
+    for user_id in user_ids:
+        readings = [(timestamp, voltage, current, power)
+                    for timestamp, _, voltage, current, power in store.page(user_id, end=start, limit=1)]
+        for timestamps, columns in store.scan(user_id, start, end):
+            values = [widen(columns[name]).tolist() for name, _ in VALUE_COLUMNS]
+            readings.extend(zip(timestamps.astype('datetime64[us]').tolist(), *values))
+        connection.exec_driver_sql(STAGE_SQL, [
+            (next(ids), user_id, voltage, current, power, timestamp.strftime(SQLITE_DATETIME_FORMAT))
+            for timestamp, voltage, current, power in readings
+        ])
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import historical Electricity Monitor readings')
+    parser.add_argument('files', nargs='+', help='CSV or JSON Lines files')
+    parser.add_argument('--format', '-f', choices=('auto', 'csv', 'jsonl'), default='auto',
+                        help='Input format (default: from the file extension)')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='Rows parsed and inserted per executemany')
+    parser.add_argument('--commit-every', type=int, default=50000,
+                        help='Rows per transaction; the live batch writer waits for each one')
+    parser.add_argument('--drop-indexes', action='store_true',
+                        help='Drop the history index during the load and rebuild it afterwards (faster for '
+                             'large imports; only with the app and ingest workers stopped)')
+    parser.add_argument('--skip-rollups', action='store_true', help='Do not rebuild rollups and energy counters afterwards')
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    stats = import_files(args.files, args.format, args.chunk_size, args.commit_every,
+                         args.drop_indexes, args.skip_rollups)
+    elapsed = time.monotonic() - started
+
+    print(f"✅ Imported {stats.rows} readings in {elapsed:.1f}s ({stats.rows / max(elapsed, 1e-9):.0f} rows/s)")
+    if stats.rows:
+        print(f"   Range: {stats.first.isoformat()} - {stats.last.isoformat()}, {len(stats.user_ids)} apartment(s)")
+    if stats.skipped_unknown:
+        print(f"⚠️  Skipped {stats.skipped_unknown} rows for unregistered apartments")
+    if stats.skipped_invalid:
+        print(f"⚠️  Skipped {stats.skipped_invalid} invalid rows")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Write-behind persistence for MQTT readings
+Readings are queued by the MQTT network thread and stored in bulk by a background writer
+"""
+
+import logging
+import queue
+import threading
+import time
+import os
+from dotenv import load_dotenv
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, User, PowerReading, LatestReading, Anomaly
+from rollups import RollupAccumulator
+from energy import EnergyAccumulator
+from metrics import REGISTRY, RateLimitedLogger
+from storage import writing
+from columnar import reading_store
+
+# Load environment variables
+load_dotenv()
+
+# Ingest Configuration
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 50000))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 500))
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', 1.0))
+ANOMALY_QUEUE_SIZE = 10000  # Anomalies waiting to be written; more are dropped
+ROLLUP_SEAL_INTERVAL = 60  # Seconds between sweeps for buckets of apartments that went quiet
+
+# Writer metrics (see /metrics)
+db_commit_seconds = REGISTRY.histogram('db_commit_seconds', 'Duration of one batch insert and commit')
+persist_seconds = REGISTRY.histogram('ingest_persist_seconds', 'Time from MQTT receive until the reading is committed')
+batch_size_readings = REGISTRY.histogram('ingest_batch_size', 'Readings per committed batch',
+                                         buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000))
+
+# Failed batches are logged at a bounded rate, like the other per-message events
+error_log = RateLimitedLogger(logging.getLogger('electricity_monitor.ingest'), limit=5, interval=10)
+
+class BatchWriter:
+    """Background writer that drains queued readings into the database with bulk inserts"""
+
+    def __init__(self, app, max_queue=INGEST_QUEUE_SIZE, batch_size=INGEST_BATCH_SIZE,
+                 flush_interval=INGEST_FLUSH_INTERVAL, publish_latest=False, cache=None):
+        self.app = app
+        self.publish_latest = publish_latest  # Also upsert LatestReading for other processes
+        self.cache = cache  # Optional ResponseCache to invalidate after each commit
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.anomalies = queue.Queue(maxsize=ANOMALY_QUEUE_SIZE)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.user_ids = {}  # apartment_number -> User.id
+        self.energy = EnergyAccumulator()
+        self.rollups = RollupAccumulator()
+        self._next_seal = time.monotonic() + ROLLUP_SEAL_INTERVAL
+        self.written = 0
+        self.dropped = 0
+        self.unknown = 0
+        self.failed = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def submit(self, apartment_number, voltage, current, power, timestamp, received=None):
+        """
+        Queue a reading without blocking; returns False if the queue is full
+
+        `received` is the time.perf_counter() value at MQTT receive, used for latency metrics.
+        """
+        if received is None:
+            received = time.perf_counter()
+        try:
+            self.queue.put_nowait((apartment_number, voltage, current, power, timestamp, received))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def submit_anomaly(self, apartment_number, kind, timestamp, value, expected, score):
+        """Queue a detected anomaly; it is written with the next batch of readings"""
+        try:
+            self.anomalies.put_nowait((apartment_number, kind, timestamp, value, expected, score))
+            return True
+        except queue.Full:
+            return False
+
+    def start(self):
+        """Start the background writer thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='batch-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop the writer after flushing everything already queued"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while not (self._stop_event.is_set() and self.queue.empty()):
+            try:
+                batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                # Drain whatever is already waiting without blocking
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                if batch or not self.anomalies.empty():
+                    self.flush(batch)
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+        if batch or not self.anomalies.empty():
+            self.flush(batch)
+
+    def flush(self, batch):
+        """Insert a batch of queued readings (and pending anomalies) in a single transaction"""
+        anomalies = []
+        while True:
+            try:
+                anomalies.append(self.anomalies.get_nowait())
+            except queue.Empty:
+                break
+
+        # The whole flush runs on the writer connection, its lookups included
+        rows = []
+        with self.app.app_context(), writing():
+            try:
+                self._resolve_user_ids({item[0] for item in batch} | {item[0] for item in anomalies})
+
+                latest = {}
+                spans = {}  # apartment_number -> [oldest, newest] timestamp written
+                for apartment_number, voltage, current, power, timestamp, _ in batch:
+                    user_id = self.user_ids.get(apartment_number)
+                    if user_id is None:
+                        self.unknown += 1
+                        continue
+                    if apartment_number not in latest or timestamp >= latest[apartment_number]['timestamp']:
+                        latest[apartment_number] = {
+                            'apartment_number': apartment_number,
+                            'voltage': voltage,
+                            'current': current,
+                            'power': power,
+                            'timestamp': timestamp
+                        }
+                    span = spans.get(apartment_number)
+                    if span is None:
+                        spans[apartment_number] = [timestamp, timestamp]
+                    elif timestamp < span[0]:
+                        span[0] = timestamp
+                    elif timestamp > span[1]:
+                        span[1] = timestamp
+                    rows.append({
+                        'user_id': user_id,
+                        'voltage': voltage,
+                        'current': current,
+                        'power': power,
+                        'timestamp': timestamp
+                    })
+
+                started = time.perf_counter()
+                if rows:
+                    if reading_store is not None:
+                        reading_store.append(rows)
+                    else:
+                        db.session.execute(db.insert(PowerReading), rows)
+                    # Energy counters and rollups are updated in the same transaction as the raw rows
+                    energies = self.energy.apply(rows)
+                    self.rollups.apply(rows, energies)
+                    if self.publish_latest:
+                        self._upsert_latest(list(latest.values()))
+                if anomalies:
+                    self._insert_anomalies(anomalies)
+                sealed = 0
+                if time.monotonic() >= self._next_seal:
+                    sealed = self.rollups.seal_expired()
+                    self._next_seal = time.monotonic() + ROLLUP_SEAL_INTERVAL
+                db.session.commit()
+                self.written += len(rows)
+
+                # Only after the commit, so a request cannot re-cache the old data
+                if self.cache is not None:
+                    for apartment_number, (oldest, newest) in spans.items():
+                        self.cache.invalidate(apartment_number, oldest, newest)
+                    if sealed:
+                        self.cache.invalidate_open('rollups')
+
+                committed = time.perf_counter()
+                db_commit_seconds.observe(committed - started)
+                batch_size_readings.observe(len(rows))
+                for item in batch:
+                    persist_seconds.observe(committed - item[5])
+            except Exception as e:
+                db.session.rollback()
+                # The integrator and open buckets already moved past the lost readings; those
+                # apartments resume from what the database has
+                user_ids = {row['user_id'] for row in rows}
+                self.energy.forget(user_ids)
+                self.rollups.forget(user_ids)
+                self.failed += len(batch)
+                error_log.warning("write_error readings=%d error=%s", len(batch), e)
+
+    def _insert_anomalies(self, anomalies):
+        rows = [
+            {
+                'user_id': self.user_ids[apartment_number],
+                'kind': kind,
+                'timestamp': timestamp,
+                'value': value,
+                'expected': expected,
+                'score': score
+            }
+            for apartment_number, kind, timestamp, value, expected, score in anomalies
+            if apartment_number in self.user_ids
+        ]
+        if rows:
+            db.session.execute(db.insert(Anomaly), rows)
+
+    def _upsert_latest(self, readings):
+        """Store the newest reading per apartment unless a newer one is already there"""
+        table = LatestReading.__table__
+        stmt = sqlite_insert(table)
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['apartment_number'],
+            set_={
+                'voltage': excluded.voltage,
+                'current': excluded.current,
+                'power': excluded.power,
+                'timestamp': excluded.timestamp
+            },
+            where=table.c.timestamp < excluded.timestamp
+        )
+        db.session.execute(stmt, readings)
+
+    def _resolve_user_ids(self, apartment_numbers):
+        """Look up User.id for apartments not seen before (one query per batch)"""
+        missing = [number for number in apartment_numbers if number not in self.user_ids]
+        if not missing:
+            return
+        users = db.session.query(User.apartment_number, User.id).filter(
+            User.apartment_number.in_(missing)
+        ).all()
+        for apartment_number, user_id in users:
+            self.user_ids[apartment_number] = user_id
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Multi-process MQTT ingest for Electricity Monitor
+Runs N consumer processes, each with its own MQTT client and batch writer, so ingest
+scales with cores; the web processes read the latest values from the database
+
+Partitioning strategies:
+    apartment  Each worker subscribes only to the apartments whose number hashes to it.
+               An apartment always lands on the same worker, which keeps its readings in
+               order for the rollup energy integration. Works with any broker.
+    shared     Workers join an MQTT shared-subscription group ($share/<group>/...) and the
+               broker spreads messages over them. Only use this with a broker configured
+               to route by topic (e.g. EMQX hash_topic); round-robin delivery splits an
+               apartment's readings across workers and double counts rollup energy.
+
+Usage:
+    INGEST_MODE=workers python app.py        # web tier only
+    python ingest_workers.py --workers 4     # ingest tier
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+from models import db, User, LatestReading
+from energy import to_epoch
+
+# Load environment variables
+load_dotenv()
+
+# Ingest Mode Configuration
+INGEST_MODE = os.getenv('INGEST_MODE', 'embedded')  # 'embedded' (MQTT in the web process) or 'workers'
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', multiprocessing.cpu_count()))
+INGEST_PARTITION = os.getenv('INGEST_PARTITION', 'apartment')  # 'apartment' or 'shared'
+INGEST_SHARE_GROUP = os.getenv('INGEST_SHARE_GROUP', 'electricity-ingest')
+INGEST_REFRESH_INTERVAL = float(os.getenv('INGEST_REFRESH_INTERVAL', 30))  # Seconds between apartment list reloads
+LIVE_POLL_INTERVAL = float(os.getenv('LIVE_POLL_INTERVAL', 1.0))  # Seconds between LatestReading polls
+INGEST_MODES = ('embedded', 'workers')
+PARTITION_STRATEGIES = ('apartment', 'shared')
+
+# Seconds re-read on every poll: workers commit independently, so a row may become
+# visible slightly after a newer one from another worker
+POLL_OVERLAP = 10
+
+def worker_for_apartment(apartment_number, workers):
+    """Index of the worker that owns an apartment (stable across processes and restarts)"""
+    return zlib.crc32(apartment_number.encode()) % workers
+
+def owned_apartments(index, workers):
+    """Registered apartments that hash to worker `index` (needs an app context)"""
+    apartments = [number for (number,) in db.session.query(User.apartment_number)]
+    return [number for number in apartments if worker_for_apartment(number, workers) == index]
+
+class LatestReadingPoller:
+    """Feeds LatestReading rows written by ingest workers into a web process's store and live streams"""
+
+    def __init__(self, app, store, broadcaster, interval=LIVE_POLL_INTERVAL, cache=None):
+        self.app = app
+        self.store = store
+        self.broadcaster = broadcaster
+        self.cache = cache  # Optional ResponseCache; workers cannot invalidate this process's cache
+        self.interval = interval
+        self.newest = None  # Newest timestamp seen so far
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the polling thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='latest-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Error polling latest readings: {e}")
+            self._stop_event.wait(self.interval)
+
+    def poll(self):
+        """Apply readings newer than the last poll; returns how many were new"""
+        with self.app.app_context():
+            query = LatestReading.query
+            if self.newest is not None:
+                query = query.filter(LatestReading.timestamp > self.newest - timedelta(seconds=POLL_OVERLAP))
+            readings = query.all()
+
+        updated = 0
+        for reading in readings:
+            seconds = to_epoch(reading.timestamp)
+            previous = self.store.latest(reading.apartment_number)
+            if previous is not None and previous.timestamp >= seconds:
+                continue
+            sample = self.store.update(reading.apartment_number, reading.voltage, reading.current,
+                                       reading.power, seconds)
+            self.broadcaster.publish(reading.apartment_number, sample.to_dict())
+            if self.cache is not None:
+                # Workers wrote everything up to this reading since the previous one seen here
+                oldest = datetime.utcfromtimestamp(previous.timestamp) if previous is not None else datetime.min
+                self.cache.invalidate(reading.apartment_number, oldest, reading.timestamp)
+            updated += 1
+            if self.newest is None or reading.timestamp > self.newest:
+                self.newest = reading.timestamp
+        return updated
+
+def run_worker(index, workers, partition, group):
+    """Consume this worker's share of the readings until SIGTERM or Ctrl+C"""
+    import app as app_module
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    if partition == 'shared':
+        topic_filters = [f"$share/{group}/{app_module.MQTT_TOPIC_PREFIX}/+/+",
+                         f"$share/{group}/{app_module.MQTT_TOPIC_PREFIX}/+/+/+"]
+    else:
+        topic_filters = []
+    manager = app_module.MQTTManager(client_id=f"{group}-{index}-{os.getpid()}", topic_filters=topic_filters)
+    app_module.mqtt_manager = manager
+
+    # This process's writer also publishes latest values for the web tier
+    writer = app_module.batch_writer
+    writer.publish_latest = True
+    writer.start()
+
+    next_refresh = 0
+    try:
+        manager.start_processing()
+        # Unlike MQTTManager.start, keep retrying until the broker is reachable
+        manager.client.connect_async(app_module.MQTT_BROKER, app_module.MQTT_PORT, 60,
+                                     properties=manager.connect_properties)
+        manager.client.loop_start()
+        while not stop.is_set():
+            if partition == 'apartment' and time.monotonic() >= next_refresh:
+                with app_module.app.app_context():
+                    owned = owned_apartments(index, workers)
+                added = manager.subscribe_to_apartments(owned)
+                if added:
+                    print(f"Worker {index}: subscribed to {len(added)} more apartment(s), {len(manager.apartments)} total")
+                next_refresh = time.monotonic() + INGEST_REFRESH_INTERVAL
+            stop.wait(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.client.loop_stop()
+        manager.client.disconnect()
+        manager.stop_processing()
+        writer.stop()
+        print(f"Worker {index}: stopped after writing {writer.written} readings "
+              f"({writer.dropped} dropped, {writer.unknown} unknown, {writer.failed} failed)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-process MQTT ingest for Electricity Monitor')
+    parser.add_argument('--workers', '-w', type=int, default=INGEST_WORKERS, help='Consumer processes')
+    parser.add_argument('--partition', choices=PARTITION_STRATEGIES, default=INGEST_PARTITION,
+                        help='How readings are split over the workers')
+    parser.add_argument('--group', default=INGEST_SHARE_GROUP, help='Shared-subscription group / client id prefix')
+    args = parser.parse_args()
+
+    from app import app, MQTT_BROKER, MQTT_PORT
+    from retention import RetentionJob
+    from migrate_db import migrate_database
+
+    with app.app_context():
+        migrate_database()
+
+    print("⚡ Electricity Monitor - Ingest Workers")
+    print("=" * 60)
+    print(f"MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}")
+    print(f"Workers: {args.workers}, partitioned by {args.partition}")
+    print("=" * 60)
+
+    context = multiprocessing.get_context('spawn')
+    processes = {}
+
+    def spawn(index):
+        process = context.Process(target=run_worker, args=(index, args.workers, args.partition, args.group),
+                                  name=f"ingest-worker-{index}")
+        process.start()
+        processes[index] = process
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    for index in range(args.workers):
+        spawn(index)
+    # One retention job for the whole ingest tier; web processes see deletions after their cache TTL
+    retention_job = RetentionJob(app)
+    retention_job.start()
+
+    try:
+        while not stopping.is_set():
+            # Restart workers that died so their partition is not left unconsumed
+            for index, process in list(processes.items()):
+                if not process.is_alive():
+                    print(f"❌ Worker {index} exited with code {process.exitcode}, restarting")
+                    spawn(index)
+            stopping.wait(2)
+    except KeyboardInterrupt:
+        print("\n⏹️ Stopping ingest workers")
+    finally:
+        retention_job.stop()
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in processes.values():
+            process.join(15)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Live reading fan-out for Electricity Monitor dashboards
+MQTTManager publishes each reading once; every dashboard watching that apartment gets it pushed
+"""
+
+import asyncio
+import json
+import threading
+
+class Subscription:
+    """One connected dashboard; holds only the newest reading not yet sent"""
+    __slots__ = ('apartment_number', 'pending', 'event')
+
+    def __init__(self, apartment_number):
+        self.apartment_number = apartment_number
+        self.pending = None
+        self.event = threading.Event()
+
+    def push(self, message):
+        # Overwrite instead of queueing: a slow client skips straight to the newest reading
+        self.pending = message
+        self.event.set()
+
+    def wait(self, timeout):
+        """Return the newest pending message, or None if nothing arrived within timeout"""
+        if not self.event.wait(timeout):
+            return None
+        self.event.clear()
+        message, self.pending = self.pending, None
+        return message
+
+class AsyncSubscription:
+    """A Subscription for an asyncio stream; push() may be called from any thread"""
+    __slots__ = ('apartment_number', 'pending', 'event', 'loop', 'thread_id', 'closed')
+
+    def __init__(self, apartment_number, loop):
+        self.apartment_number = apartment_number
+        self.pending = None
+        self.event = asyncio.Event()
+        self.loop = loop
+        self.thread_id = threading.get_ident()  # The loop's thread
+        self.closed = False
+
+    def push(self, message):
+        self.pending = message
+        if threading.get_ident() == self.thread_id:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+    def close(self):
+        """Wake the stream up for good (the client disconnected)"""
+        self.closed = True
+        self.event.set()
+
+    async def wait(self, timeout):
+        """Return the newest pending message, or None on timeout or once closed"""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.event.clear()
+        message, self.pending = self.pending, None
+        return message
+
+class LiveBroadcaster:
+    """Routes readings to the subscriptions of the apartment they belong to"""
+
+    def __init__(self):
+        self._subscribers = {}  # apartment_number -> set of Subscription
+        self._lock = threading.Lock()
+
+    def subscribe(self, apartment_number, subscription=None):
+        """Register a Subscription (or a given AsyncSubscription) for the apartment's readings"""
+        if subscription is None:
+            subscription = Subscription(apartment_number)
+        with self._lock:
+            self._subscribers.setdefault(apartment_number, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.apartment_number)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.apartment_number]
+
+    def publish(self, apartment_number, reading):
+        """Push a reading to everyone watching the apartment; cheap when nobody is"""
+        subscribers = self._subscribers.get(apartment_number)
+        if not subscribers:
+            return
+        with self._lock:
+            subscribers = tuple(subscribers)
+        # Encode once, not once per subscriber
+        message = format_event(reading)
+        for subscription in subscribers:
+            subscription.push(message)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+def format_event(reading):
+    """Format a reading dict as a Server-Sent Events message"""
+    return f"data: {json.dumps(reading, default=_json_default)}\n\n"
+
+def _json_default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Load generator for Electricity Monitor capacity tests
+Drives thousands of simulated apartment meters from a few worker processes,
+each with one MQTT connection and a scheduler instead of a thread per apartment.
+With --batch-interval every worker acts as a gateway and publishes the readings it
+collected as one batch message per interval.
+"""
+
+import argparse
+import heapq
+import multiprocessing
+import queue
+import random
+import ssl
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from mqtt_utils import MQTT_BROKER, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD, MQTT_TOPIC_PREFIX
+from payload_codecs import CODEC_NAMES, DEFAULT_CODEC, batch_topic, get_codec, reading_topic
+
+REPORT_INTERVAL = 1.0  # Seconds between progress reports from each worker
+
+def apartment_numbers(meters, units_per_floor):
+    """Apartment numbers like 101, 102, ... 2001 for the simulated building(s)"""
+    width = len(str(units_per_floor))
+    return [
+        f"{index // units_per_floor + 1}{index % units_per_floor + 1:0{width}d}"
+        for index in range(meters)
+    ]
+
+def burst_factor(elapsed, args):
+    """Rate multiplier at `elapsed` seconds into the run"""
+    if args.burst_every <= 0:
+        return 1.0
+    if elapsed % args.burst_every < args.burst_duration:
+        return args.burst_factor
+    return 1.0
+
+def create_client(args, worker_id):
+    client = mqtt.Client(client_id=f"load-generator-{worker_id}-{random.randrange(1 << 30)}")
+    if args.username:
+        client.username_pw_set(args.username, args.password)
+    if args.tls:
+        context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        client.tls_set_context(context)
+    # Never let paho hold more than this many unsent messages in memory
+    client.max_queued_messages_set(args.max_queued)
+    return client
+
+def run_worker(worker_id, apartments, args, reports):
+    """Publish readings for a slice of the apartments until the duration elapses"""
+    codec = get_codec(args.codec)
+    topics = [reading_topic(args.prefix, apartment, codec.name) for apartment in apartments]
+    gateway_topic = batch_topic(args.prefix, f"load-generator-{worker_id}", codec.name)
+    pending = []  # Readings collected for the next batch
+
+    connected = threading.Event()
+    client = create_client(args, worker_id)
+    client.on_connect = lambda c, userdata, flags, rc: connected.set() if rc == 0 else None
+    client.connect(args.broker, args.port, 60)
+    client.loop_start()
+    if not connected.wait(10):
+        reports.put((worker_id, 0, 0, 'connect timeout'))
+        client.loop_stop()
+        return
+
+    # Spread the first readings over one interval so meters do not start in lockstep
+    start = time.monotonic()
+    schedule = [(start + random.uniform(0, args.interval), index) for index in range(len(apartments))]
+    heapq.heapify(schedule)
+
+    published = failed = 0
+    next_report = start + REPORT_INTERVAL
+    next_batch = start + args.batch_interval
+    deadline = start + args.duration
+
+    def publish_pending():
+        nonlocal published, failed
+        result = client.publish(gateway_topic, codec.encode_batch(pending), qos=args.qos)
+        if result.rc == mqtt.MQTT_ERR_SUCCESS:
+            published += len(pending)
+        else:
+            failed += len(pending)
+        pending.clear()
+
+    try:
+        while schedule:
+            due, index = schedule[0]
+            now = time.monotonic()
+            if args.batch_interval > 0 and now >= next_batch:
+                if pending:
+                    publish_pending()
+                next_batch = now + args.batch_interval
+            if due > now:
+                if now >= next_report:
+                    reports.put((worker_id, published, failed, None))
+                    published = failed = 0
+                    next_report = now + REPORT_INTERVAL
+                time.sleep(min(due - now, 0.05))
+                continue
+            if now >= deadline:
+                break
+
+            reading = {
+                'voltage': round(random.uniform(220.0, 240.0), 2),
+                'current': round(random.uniform(0.5, 15.0), 2),
+                'timestamp': time.time()
+            }
+            if args.batch_interval > 0:
+                reading['apartment'] = apartments[index]
+                pending.append(reading)
+            else:
+                result = client.publish(topics[index], codec.encode(reading), qos=args.qos)
+                if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                    published += 1
+                else:
+                    failed += 1
+
+            period = args.interval / burst_factor(now - start, args)
+            jitter = random.uniform(-args.jitter, args.jitter) * period
+            heapq.heapreplace(schedule, (due + period + jitter, index))
+        if pending:
+            publish_pending()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reports.put((worker_id, published, failed, 'done'))
+        client.loop_stop()
+        client.disconnect()
+
+def main():
+    parser = argparse.ArgumentParser(description='MQTT load generator for Electricity Monitor')
+    parser.add_argument('--meters', '-m', type=int, default=1000, help='Number of simulated apartments')
+    parser.add_argument('--workers', '-w', type=int, default=multiprocessing.cpu_count(),
+                        help='Worker processes (one MQTT connection each)')
+    parser.add_argument('--interval', '-i', type=float, default=3.0, help='Seconds between readings per meter')
+    parser.add_argument('--jitter', type=float, default=0.3, help='Random spread of the interval (0.3 = ±30%%)')
+    parser.add_argument('--duration', '-d', type=float, default=60, help='Seconds to run')
+    parser.add_argument('--codec', choices=CODEC_NAMES, default=DEFAULT_CODEC, help='Payload encoding')
+    parser.add_argument('--qos', type=int, choices=(0, 1), default=0, help='MQTT QoS for publishes')
+    parser.add_argument('--batch-interval', type=float, default=0,
+                        help='Publish each worker\'s readings as one batch message per this many seconds (0 = off)')
+    parser.add_argument('--units-per-floor', type=int, default=20, help='Apartments per floor')
+    parser.add_argument('--burst-every', type=float, default=0, help='Seconds between bursts (0 = steady rate)')
+    parser.add_argument('--burst-duration', type=float, default=5, help='Length of each burst in seconds')
+    parser.add_argument('--burst-factor', type=float, default=5, help='Rate multiplier during a burst')
+    parser.add_argument('--max-queued', type=int, default=100000, help='Unsent messages buffered per worker')
+    parser.add_argument('--broker', '-b', default=MQTT_BROKER, help='MQTT broker address')
+    parser.add_argument('--port', '-p', type=int, default=MQTT_PORT, help='MQTT broker port')
+    parser.add_argument('--username', default=MQTT_USERNAME, help='MQTT username')
+    parser.add_argument('--password', default=MQTT_PASSWORD, help='MQTT password')
+    parser.add_argument('--prefix', default=MQTT_TOPIC_PREFIX, help='MQTT topic prefix')
+    parser.add_argument('--tls', action=argparse.BooleanOptionalAction, default=None,
+                        help='Use TLS (default: on for port 8883)')
+    args = parser.parse_args()
+    if args.tls is None:
+        args.tls = args.port == 8883
+
+    get_codec(args.codec)  # Fail early if an optional codec package is missing
+    apartments = apartment_numbers(args.meters, args.units_per_floor)
+    workers = max(1, min(args.workers, len(apartments)))
+    target_rate = args.meters / args.interval
+
+    print("🏠 Electricity Monitor - Load Generator")
+    print("=" * 60)
+    print(f"MQTT Broker: {args.broker}:{args.port} ({'TLS' if args.tls else 'plain'})")
+    print(f"Meters: {args.meters} across {workers} workers, codec: {args.codec}, QoS {args.qos}")
+    print(f"Target rate: {target_rate:.0f} msg/s (interval {args.interval}s ±{args.jitter * 100:.0f}%)")
+    if args.batch_interval > 0:
+        print(f"Batches: one message per worker every {args.batch_interval}s")
+    if args.burst_every > 0:
+        print(f"Bursts: x{args.burst_factor} for {args.burst_duration}s every {args.burst_every}s")
+    print("=" * 60)
+
+    reports = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(worker_id, apartments[worker_id::workers], args, reports),
+                                daemon=True)
+        for worker_id in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    started = time.monotonic()
+    total_published = total_failed = 0
+    window_published = 0
+    window_start = started
+    finished = 0
+    try:
+        while finished < workers:
+            try:
+                worker_id, published, failed, status = reports.get(timeout=REPORT_INTERVAL)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            total_published += published
+            total_failed += failed
+            window_published += published
+            if status is not None:
+                finished += 1
+                if status != 'done':
+                    print(f"❌ Worker {worker_id}: {status}")
+
+            now = time.monotonic()
+            if now - window_start >= 5:
+                print(f"📊 {window_published / (now - window_start):.0f} msg/s "
+                      f"(total {total_published}, failed {total_failed})")
+                window_published = 0
+                window_start = now
+    except KeyboardInterrupt:
+        print("\n⏹️ Load generator stopped by user")
+
+    for process in processes:
+        process.join(5)
+
+    elapsed = time.monotonic() - started
+    print("=" * 60)
+    print(f"Published {total_published} readings in {elapsed:.1f}s "
+          f"({total_published / elapsed:.0f} msg/s achieved, {target_rate:.0f} msg/s target)")
+    if total_failed:
+        print(f"❌ {total_failed} publishes failed (paho queue full or disconnected)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Database migration script
+Brings an existing electricity_monitor.db up to the current schema without dropping data
+"""
+
+from sqlalchemy import inspect
+
+from models import db
+
+def migrate_database():
+    """Create missing tables and indexes on an existing database"""
+    # New tables are created with their indexes; existing tables are left untouched
+    db.create_all()
+
+    inspector = inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine)
+                created.append(index.name)
+    return created
+
+if __name__ == "__main__":
+    from app import app
+
+    with app.app_context():
+        created = migrate_database()
+
+    if created:
+        print("Database migrated successfully!")
+        print("Indexes created:")
+        for name in created:
+            print(f"- {name}")
+    else:
+        print("Database is already up to date")
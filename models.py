@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Database models for Electricity Monitor
+Kept separate from app.py so background workers can import them
+"""
+
+from flask_sqlalchemy import SQLAlchemy
+from flask_login import UserMixin
+from datetime import datetime
+
+from storage import RoutingSession
+
+# Reads go to the read-only pool and writes to the single writer connection (see storage.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(128), nullable=False)
+    apartment_number = db.Column(db.String(10), unique=True, nullable=False)  # Floor/Apartment number
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PowerReading(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    voltage = db.Column(db.Float, nullable=False)
+    current = db.Column(db.Float, nullable=False)
+    power = db.Column(db.Float, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # History is always read per apartment in time order; SQLite appends the rowid (id)
+    # to every index, so this also serves the (timestamp, id) keyset order
+    __table_args__ = (
+        db.Index('ix_power_reading_user_timestamp', 'user_id', 'timestamp'),
+    )
+
+class PowerRollup(db.Model):
+    """Per-apartment aggregate of readings over one minute, hour or day bucket"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    resolution = db.Column(db.Integer, nullable=False)  # Bucket width in seconds
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    sample_count = db.Column(db.Integer, nullable=False, default=0)
+    voltage_min = db.Column(db.Float, nullable=False)
+    voltage_max = db.Column(db.Float, nullable=False)
+    voltage_sum = db.Column(db.Float, nullable=False)
+    current_min = db.Column(db.Float, nullable=False)
+    current_max = db.Column(db.Float, nullable=False)
+    current_sum = db.Column(db.Float, nullable=False)
+    power_min = db.Column(db.Float, nullable=False)
+    power_max = db.Column(db.Float, nullable=False)
+    power_sum = db.Column(db.Float, nullable=False)
+    energy_wh = db.Column(db.Float, nullable=False, default=0.0)
+    sealed = db.Column(db.Boolean, nullable=False, default=False)  # No more in-order data expected
+
+    __table_args__ = (
+        db.Index('ix_power_rollup_bucket', 'user_id', 'resolution', 'bucket_start', unique=True),
+        db.Index('ix_power_rollup_open', 'sealed', 'resolution', 'bucket_start'),
+    )
+
+class LatestReading(db.Model):
+    """Newest reading per apartment, written by ingest workers for the web processes"""
+    apartment_number = db.Column(db.String(10), primary_key=True)
+    voltage = db.Column(db.Float, nullable=False)
+    current = db.Column(db.Float, nullable=False)
+    power = db.Column(db.Float, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_latest_reading_timestamp', 'timestamp'),
+    )
+
+class EnergyCounter(db.Model):
+    """Running energy total of one apartment for one day, month, year or all time"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    period = db.Column(db.String(8), nullable=False)  # 'day', 'month', 'year' or 'total'
+    period_start = db.Column(db.DateTime, nullable=False)  # UTC; 1970-01-01 for 'total'
+    energy_wh = db.Column(db.Float, nullable=False, default=0.0)
+    covered_seconds = db.Column(db.Float, nullable=False, default=0.0)  # Time integrated into energy_wh
+    missing_seconds = db.Column(db.Float, nullable=False, default=0.0)  # Gaps too long to integrate
+    # Newest reading counted; on the 'total' row this is the checkpoint integration resumes from
+    last_timestamp = db.Column(db.DateTime)
+    last_power = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index('ix_energy_counter_period', 'user_id', 'period', 'period_start', unique=True),
+    )
+
+class Anomaly(db.Model):
+    """Unusual reading flagged by the streaming detectors"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # voltage_sag, voltage_swell, current_spike, ...
+    timestamp = db.Column(db.DateTime, nullable=False)
+    value = db.Column(db.Float, nullable=False)  # Reading that triggered the detector
+    expected = db.Column(db.Float)  # Baseline at that moment
+    score = db.Column(db.Float)  # z-score, CUSUM sum or repeat count, depending on the kind
+
+    __table_args__ = (
+        db.Index('ix_anomaly_user_timestamp', 'user_id', 'timestamp'),
+    )
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+asyncio integration for paho-mqtt clients in Electricity Monitor
+Drives a paho client from an event loop (socket readiness callbacks instead of loop_start's
+network thread), so MQTT messages are handled on the same loop as the async web server
+"""
+
+import asyncio
+import functools
+import random
+import threading
+
+import paho.mqtt.client as mqtt
+
+RECONNECT_MIN_DELAY = 1  # Seconds; doubles up to the maximum after each failed attempt
+RECONNECT_MAX_DELAY = 60
+MISC_INTERVAL = 1  # Seconds between keep-alive / retry checks
+PAUSE_CHECK_INTERVAL = 0.01  # Seconds between checks whether paused reading can resume
+
+class AsyncioHelper:
+    """Registers the client's socket with the loop through paho's external-loop callbacks"""
+
+    def __init__(self, loop, client, paused=None):
+        self.loop = loop
+        self.client = client
+        self.paused = paused  # Optional callable; while it returns True the socket is not read
+        self.thread_id = threading.get_ident()  # The loop's thread
+        self.disconnected = asyncio.Event()
+        self._misc = None
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def _call(self, function, *args):
+        # connect() runs in an executor so its DNS lookup and TLS handshake never block the
+        # loop; the socket callbacks it triggers there are moved onto the loop thread
+        if threading.get_ident() == self.thread_id:
+            function(*args)
+        else:
+            self.loop.call_soon_threadsafe(function, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self._call(self._open, sock)
+
+    def _open(self, sock):
+        self.disconnected.clear()
+        self.loop.add_reader(sock, self._read)
+        if self._misc is None or self._misc.done():
+            self._misc = self.loop.create_task(self._misc_loop())
+
+    def _read(self):
+        self.client.loop_read()
+        # TLS can hold decrypted bytes back that will not make the socket readable again
+        sock = self.client.socket()
+        while sock is not None and getattr(sock, 'pending', None) and sock.pending():
+            if self._pause(sock):
+                return
+            self.client.loop_read()
+            sock = self.client.socket()
+        if sock is not None:
+            self._pause(sock)
+
+    def _pause(self, sock):
+        """Stop reading while the consumer is full; the broker then holds further messages"""
+        if self.paused is None or not self.paused():
+            return False
+        self.loop.remove_reader(sock)
+        self.loop.call_later(PAUSE_CHECK_INTERVAL, self._resume, sock)
+        return True
+
+    def _resume(self, sock):
+        if self.client.socket() is not sock:
+            return  # Closed meanwhile; the next connection registers its own reader
+        if self.paused():
+            self.loop.call_later(PAUSE_CHECK_INTERVAL, self._resume, sock)
+        else:
+            self._read()
+            if self.client.socket() is sock and not self.paused():
+                self.loop.add_reader(sock, self._read)
+
+    def on_socket_close(self, client, userdata, sock):
+        self._call(self._close, sock)
+
+    def _close(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        self.disconnected.set()
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.add_writer, sock, self.client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self.loop.remove_writer, sock)
+
+    async def _misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(MISC_INTERVAL)
+
+    def cancel(self):
+        if self._misc is not None:
+            self._misc.cancel()
+
+async def run_client(client, host, port, keepalive=60, stopping=None, paused=None, properties=None):
+    """
+    Keep a paho client connected from the running loop until `stopping` is set
+
+    Reconnects with jittered exponential backoff; subscriptions are renewed by the client's
+    own on_connect callback. Disconnects cleanly when stopping or cancelled. While `paused()`
+    returns True, incoming messages are left unread. `properties` are the MQTT 5 CONNECT
+    properties, if any.
+    """
+    loop = asyncio.get_running_loop()
+    helper = AsyncioHelper(loop, client, paused)
+    stopping = stopping or asyncio.Event()
+    delay = RECONNECT_MIN_DELAY
+    first = True
+    try:
+        while not stopping.is_set():
+            try:
+                if first:
+                    await loop.run_in_executor(None, functools.partial(client.connect, host, port, keepalive,
+                                                                        properties=properties))
+                    first = False
+                else:
+                    await loop.run_in_executor(None, client.reconnect)
+                delay = RECONNECT_MIN_DELAY
+            except (OSError, ValueError) as e:
+                print(f"Failed to connect to MQTT broker: {e}, retrying in {delay} s")
+                await _wait(stopping, delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+
+            # Stay here while connected
+            stop_task = loop.create_task(stopping.wait())
+            disconnect_task = loop.create_task(helper.disconnected.wait())
+            try:
+                await asyncio.wait({stop_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                stop_task.cancel()
+                disconnect_task.cancel()
+            if not stopping.is_set():
+                await _wait(stopping, delay * random.uniform(0.5, 1.5))
+    finally:
+        if client.socket() is not None:
+            client.disconnect()
+            # Let the DISCONNECT packet go out before the socket is closed
+            client.loop_write()
+        helper.cancel()
+
+async def _wait(event, timeout):
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
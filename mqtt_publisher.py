@@ -5,13 +5,15 @@ Send real or simulated electricity data via MQTT
 """
 
 import paho.mqtt.client as mqtt
-import json
 import time
 import random
 import sys
 import argparse
 from datetime import datetime
 
+from mqtt_utils import MQTT_ACK_TIMEOUT, connect_client
+from payload_codecs import CODEC_NAMES, DEFAULT_CODEC, get_codec, reading_topic
+
 # MQTT Configuration
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
@@ -30,9 +32,10 @@ def on_publish(client, userdata, mid):
 def on_disconnect(client, userdata, rc):
     print("🔌 Disconnected from MQTT Broker")
 
-def send_single_reading(client, apartment_number, voltage, current, floor="1"):
-    """Send a single electricity reading"""
-    topic = f"{MQTT_TOPIC_PREFIX}/floor/{apartment_number}"
+def send_single_reading(client, apartment_number, voltage, current, floor="1", codec=DEFAULT_CODEC, qos=0):
+    """Send a single electricity reading (with QoS 1, wait for its acknowledgement)"""
+    codec = get_codec(codec)
+    topic = reading_topic(MQTT_TOPIC_PREFIX, apartment_number, codec.name)
     
     data = {
         "voltage": voltage,
@@ -42,10 +45,12 @@ def send_single_reading(client, apartment_number, voltage, current, floor="1"):
         "timestamp": datetime.now().isoformat()
     }
     
-    message = json.dumps(data)
-    result = client.publish(topic, message)
+    message = codec.encode(data)
+    result = client.publish(topic, message, qos)
+    if result.rc == mqtt.MQTT_ERR_SUCCESS and qos > 0:
+        result.wait_for_publish(MQTT_ACK_TIMEOUT)
     
-    if result.rc == mqtt.MQTT_ERR_SUCCESS:
+    if result.rc == mqtt.MQTT_ERR_SUCCESS and (qos == 0 or result.is_published()):
         power = voltage * current
         print(f"📊 Apartment {apartment_number}: V={voltage}V, I={current}A, P={power:.2f}W")
         return True
@@ -53,7 +58,7 @@ def send_single_reading(client, apartment_number, voltage, current, floor="1"):
         print(f"❌ Failed to publish for apartment {apartment_number}: {result.rc}")
         return False
 
-def simulate_continuous_data(client, apartment_number, floor="1", interval=3):
+def simulate_continuous_data(client, apartment_number, floor="1", interval=3, codec=DEFAULT_CODEC):
     """Simulate continuous electricity data"""
     print(f"🔄 Starting continuous simulation for apartment {apartment_number}")
     print("Press Ctrl+C to stop")
@@ -64,16 +69,16 @@ def simulate_continuous_data(client, apartment_number, floor="1", interval=3):
             voltage = round(random.uniform(220.0, 240.0), 2)
             current = round(random.uniform(0.5, 15.0), 2)
             
-            send_single_reading(client, apartment_number, voltage, current, floor)
+            send_single_reading(client, apartment_number, voltage, current, floor, codec)
             time.sleep(interval)
             
     except KeyboardInterrupt:
         print(f"\n⏹️ Stopped simulation for apartment {apartment_number}")
 
-def send_real_data(client, apartment_number, voltage, current, floor="1"):
+def send_real_data(client, apartment_number, voltage, current, floor="1", codec=DEFAULT_CODEC, qos=0):
     """Send real electricity data (from sensors)"""
     print(f"📡 Sending real data for apartment {apartment_number}")
-    return send_single_reading(client, apartment_number, voltage, current, floor)
+    return send_single_reading(client, apartment_number, voltage, current, floor, codec, qos)
 
 def main():
     parser = argparse.ArgumentParser(description='MQTT Publisher for Electricity Monitor')
@@ -85,6 +90,7 @@ def main():
     parser.add_argument('--interval', '-i', type=int, default=3, help='Interval in seconds for continuous mode')
     parser.add_argument('--broker', '-b', default=MQTT_BROKER, help='MQTT broker address')
     parser.add_argument('--port', '-p', type=int, default=MQTT_PORT, help='MQTT broker port')
+    parser.add_argument('--codec', choices=CODEC_NAMES, default=DEFAULT_CODEC, help='Payload encoding (default: json)')
     
     args = parser.parse_args()
     
@@ -101,31 +107,29 @@ def main():
     client.on_disconnect = on_disconnect
     
     try:
-        client.connect(args.broker, args.port, 60)
-        client.loop_start()
-        
-        # Wait for connection
-        time.sleep(2)
+        if not connect_client(client, args.broker, args.port):
+            print(f"❌ Could not connect to {args.broker}:{args.port}")
+            return
         
         if args.continuous:
             # Continuous simulation mode
-            simulate_continuous_data(client, args.apartment, args.floor, args.interval)
+            simulate_continuous_data(client, args.apartment, args.floor, args.interval, args.codec)
         else:
-            # Single reading mode
+            # Single reading mode: QoS 1, so the process exits once the broker has the reading
             if args.voltage is not None and args.current is not None:
                 # Send real data
-                send_real_data(client, args.apartment, args.voltage, args.current, args.floor)
+                send_real_data(client, args.apartment, args.voltage, args.current, args.floor, args.codec, qos=1)
             else:
                 # Send simulated data
                 voltage = round(random.uniform(220.0, 240.0), 2)
                 current = round(random.uniform(0.5, 15.0), 2)
-                send_single_reading(client, args.apartment, voltage, current, args.floor)
+                send_single_reading(client, args.apartment, voltage, current, args.floor, args.codec, qos=1)
     
     except Exception as e:
         print(f"❌ Error: {e}")
     finally:
-        client.loop_stop()
         client.disconnect()
+        client.loop_stop()
 
 if __name__ == "__main__":
     main()
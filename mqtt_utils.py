@@ -2,9 +2,15 @@
 """
 MQTT Utilities for Electricity Monitor
 Helper functions for publishing MQTT data
+
+Readings that cannot be published (broker unreachable, Wi-Fi down) are appended to an
+on-disk spool and replayed as batch messages, oldest first, once the connection is back.
+AsyncMQTTPublisher is the asyncio counterpart: one long-lived connection with many
+acknowledged publishes in flight.
 """
 
 import paho.mqtt.client as mqtt
+import asyncio
 import json
 import threading
 import time
@@ -12,6 +18,9 @@ from datetime import datetime
 import os
 from dotenv import load_dotenv
 
+from mqtt_asyncio import run_client
+from payload_codecs import batch_topic, get_codec, reading_topic
+
 # Load environment variables
 load_dotenv()
 
@@ -21,32 +30,262 @@ MQTT_PORT = int(os.getenv('MQTT_PORT', 8883))
 MQTT_USERNAME = os.getenv('MQTT_USERNAME', 'UNIVESP')
 MQTT_PASSWORD = os.getenv('MQTT_PASSWORD', 'Univesp2025')
 MQTT_TOPIC_PREFIX = os.getenv('MQTT_TOPIC_PREFIX', 'electricity/building')
+MQTT_PAYLOAD_CODEC = os.getenv('MQTT_PAYLOAD_CODEC', 'json')  # json, bin, msgpack or cbor
+MQTT_GATEWAY_ID = os.getenv('MQTT_GATEWAY_ID', 'gateway')  # Names the topic batches are published on
+MQTT_BATCH_MAX_READINGS = int(os.getenv('MQTT_BATCH_MAX_READINGS', 500))  # Readings per batch message at most
+MQTT_ACK_TIMEOUT = float(os.getenv('MQTT_ACK_TIMEOUT', 10))  # Seconds to wait for a CONNACK or PUBACK
+MQTT_MAX_INFLIGHT = int(os.getenv('MQTT_MAX_INFLIGHT', 100))  # Unacknowledged publishes of AsyncMQTTPublisher at most
+
+# Offline Spool Configuration
+MQTT_SPOOL_DIR = os.getenv('MQTT_SPOOL_DIR', 'mqtt_spool')  # Empty disables the spool
+MQTT_SPOOL_MAX_BYTES = int(os.getenv('MQTT_SPOOL_MAX_BYTES', 100 * 1024 * 1024))  # Oldest readings go first
+MQTT_SPOOL_REPLAY_RATE = float(os.getenv('MQTT_SPOOL_REPLAY_RATE', 1000))  # Readings/s replayed at most
+SPOOL_SEGMENT_BYTES = 1024 * 1024  # Size of one spool file; whole files are dropped and deleted
+
+class ReadingSpool:
+    """
+    Append-only, size-capped queue of readings on disk
+    
+    Readings are JSON Lines in numbered segment files. The read position (segment and byte
+    offset) is kept in a separate file, so a restart resumes where the last replay stopped.
+    When the spool outgrows max_bytes, its oldest segments are deleted.
+    """
+    
+    def __init__(self, directory, max_bytes=MQTT_SPOOL_MAX_BYTES, segment_bytes=SPOOL_SEGMENT_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.dropped_bytes = 0
+        self._lock = threading.Lock()
+        self._segments = None  # Segment numbers, oldest first (loaded on first use)
+        self._position = (0, 0)  # (segment, byte offset) of the next reading to replay
+    
+    def _load(self):
+        if self._segments is not None:
+            return
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []  # Created with the first append
+        self._segments = sorted(int(name[:-6]) for name in names if name.endswith('.jsonl'))
+        if self._segments:
+            self._repair(self._path(self._segments[-1]))
+        try:
+            with open(os.path.join(self.directory, 'position')) as f:
+                segment, offset = f.read().split()
+            self._position = (int(segment), int(offset))
+        except (FileNotFoundError, ValueError):
+            self._position = (self._segments[0] if self._segments else 0, 0)
+    
+    @staticmethod
+    def _repair(path):
+        """Cut a line torn by a crash while appending, so the next append starts on a new line"""
+        with open(path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+    
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment:012d}.jsonl")
+    
+    def empty(self):
+        with self._lock:
+            self._load()
+            if not self._segments:
+                return True
+            segment, offset = self._position
+            return len(self._segments) == 1 and segment == self._segments[0] and \
+                offset >= os.path.getsize(self._path(segment))
+    
+    def append(self, readings, sync=True):
+        """
+        Append reading dicts and make them durable before returning
+        
+        With sync=False they are only visible to read(); pass the returned path to sync() later.
+        """
+        lines = ''.join(json.dumps(reading, separators=(',', ':')) + '\n' for reading in readings)
+        with self._lock:
+            self._load()
+            os.makedirs(self.directory, exist_ok=True)
+            if not self._segments or os.path.getsize(self._path(self._segments[-1])) >= self.segment_bytes:
+                self._segments.append(self._segments[-1] + 1 if self._segments else 0)
+            path = self._path(self._segments[-1])
+            with open(path, 'a') as f:
+                f.write(lines)
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+            self._enforce_limit()
+        return path
+    
+    @staticmethod
+    def sync(path):
+        """Make readings appended to a segment with sync=False durable"""
+        try:
+            with open(path, 'rb') as f:
+                os.fsync(f.fileno())
+        except FileNotFoundError:
+            pass  # Already replayed (or dropped by the size limit) and deleted
+    
+    def _enforce_limit(self):
+        sizes = [os.path.getsize(self._path(segment)) for segment in self._segments]
+        total = sum(sizes)
+        # The segment being written to is never dropped
+        while total > self.max_bytes and len(self._segments) > 1:
+            segment = self._segments.pop(0)
+            total -= sizes.pop(0)
+            self.dropped_bytes += os.path.getsize(self._path(segment))
+            os.remove(self._path(segment))
+            print(f"⚠️  Spool over {self.max_bytes} bytes: dropped its oldest readings ({self._path(segment)})")
+            if self._position[0] <= segment:
+                self._position = (self._segments[0], 0)
+    
+    def read(self, limit):
+        """Up to limit of the oldest readings and the position after them (pass to commit)"""
+        with self._lock:
+            self._load()
+            segment, offset = self._position
+            for current in self._segments:
+                if current < segment:
+                    continue
+                if current > segment:
+                    offset = 0
+                readings = []
+                with open(self._path(current), 'rb') as f:
+                    f.seek(offset)
+                    while len(readings) < limit:
+                        line = f.readline()
+                        if not line.endswith(b'\n'):
+                            break  # End of the segment
+                        offset += len(line)
+                        try:
+                            readings.append(json.loads(line))
+                        except ValueError:
+                            continue
+                if readings:
+                    return readings, (current, offset)
+            return [], self._position
+    
+    def commit(self, position):
+        """Mark everything before position as delivered; finished segments are deleted"""
+        with self._lock:
+            self._position = position
+            while len(self._segments) > 1 and self._segments[0] < position[0]:
+                os.remove(self._path(self._segments.pop(0)))
+            path = os.path.join(self.directory, 'position')
+            with open(path + '.tmp', 'w') as f:
+                f.write(f"{position[0]} {position[1]}")
+            os.replace(path + '.tmp', path)
+
+def create_client():
+    """paho client with the broker credentials and TLS for HiveMQ Cloud"""
+    client = mqtt.Client()
+    client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+    
+    # Enable SSL/TLS for HiveMQ Cloud
+    import ssl
+    context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    client.tls_set_context(context)
+    return client
+
+def connect_client(client, host, port, keepalive=60, timeout=MQTT_ACK_TIMEOUT):
+    """
+    Connect a paho client, start its network thread and wait for the broker's CONNACK
+    
+    Returns True once connected, False when the connection is refused, fails or no CONNACK
+    arrives within timeout. The client's own on_connect callback still runs.
+    """
+    connack = threading.Event()
+    on_connect = client.on_connect
+    
+    def notify(client, userdata, flags, rc):
+        try:
+            if on_connect is not None:
+                on_connect(client, userdata, flags, rc)
+        finally:
+            connack.set()
+    
+    client.on_connect = notify
+    client.on_connect_fail = lambda client, userdata: connack.set()
+    try:
+        client.connect(host, port, keepalive)
+    except (OSError, ValueError) as e:
+        print(f"❌ Failed to connect to MQTT broker: {e}")
+        return False
+    client.loop_start()
+    connack.wait(timeout)
+    return client.is_connected()
+
+def reading_message(apartment_number, voltage, current, floor="1", additional_data=None):
+    """Message body of a single reading (the data format in MQTT_GUIDE.md)"""
+    data = {
+        "voltage": voltage,
+        "current": current,
+        "apartment": apartment_number,
+        "floor": floor,
+        "timestamp": datetime.now().isoformat(),
+        "power": voltage * current
+    }
+    
+    # Add any additional data
+    if additional_data:
+        data.update(additional_data)
+    return data
+
+def batch_items(readings, now=None):
+    """Batch message items of readings given as publish_reading arguments plus an optional timestamp"""
+    now = time.time() if now is None else now
+    items = []
+    for reading in readings:
+        item = dict(reading.get('additional_data') or {})
+        item.update({
+            "apartment": reading['apartment_number'],
+            "voltage": reading['voltage'],
+            "current": reading['current'],
+            "timestamp": reading.get('timestamp', now)
+        })
+        items.append(item)
+    return items
 
 class MQTTPublisher:
     """MQTT Publisher for sending electricity data"""
     
-    def __init__(self):
-        self.client = mqtt.Client()
-        self.client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+    def __init__(self, codec=MQTT_PAYLOAD_CODEC, spool_dir=MQTT_SPOOL_DIR, replay_rate=MQTT_SPOOL_REPLAY_RATE):
+        self.codec = get_codec(codec)
+        self.client = create_client()
         self.client.on_connect = self.on_connect
+        self.client.on_connect_fail = self.on_connect_fail
         self.client.on_publish = self.on_publish
         self.client.on_disconnect = self.on_disconnect
         self.connected = False
-        
-        # Enable SSL/TLS for HiveMQ Cloud
-        import ssl
-        context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE
-        self.client.tls_set_context(context)
+        self._connack = threading.Event()  # Set by a CONNACK or a failed attempt, cleared on disconnect
+        self.started = False  # Network loop running (paho reconnects on its own)
+        self.spool = ReadingSpool(spool_dir) if spool_dir else None
+        self.replay_rate = replay_rate
+        self.replaying = False  # New readings queue behind the spool until it is drained
+        self.spooled = 0
+        self.replayed = 0
+        self._lock = threading.Lock()
         
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             print("✅ MQTT Publisher connected!")
-            self.connected = True
+            with self._lock:
+                self.connected = True
+                start_replay = self.spool is not None and not self.replaying and not self.spool.empty()
+                if start_replay:
+                    self.replaying = True
+            if start_replay:
+                threading.Thread(target=self._replay, name='spool-replay', daemon=True).start()
         else:
             print(f"❌ MQTT Publisher failed to connect: {rc}")
             self.connected = False
+        self._connack.set()
+    
+    def on_connect_fail(self, client, userdata):
+        self._connack.set()
     
     def on_publish(self, client, userdata, mid):
         print(f"📤 Published message {mid}")
@@ -54,13 +293,21 @@ class MQTTPublisher:
     def on_disconnect(self, client, userdata, rc):
         print("🔌 MQTT Publisher disconnected")
         self.connected = False
+        self._connack.clear()
     
-    def connect(self):
-        """Connect to MQTT broker"""
+    def connect(self, timeout=MQTT_ACK_TIMEOUT):
+        """
+        Connect to MQTT broker and wait for its CONNACK (or a failed attempt) up to timeout
+        
+        If the broker is unreachable, paho keeps retrying in the background.
+        """
         try:
-            self.client.connect(MQTT_BROKER, MQTT_PORT, 60)
-            self.client.loop_start()
-            time.sleep(1)  # Wait for connection
+            if not self.started:
+                self._connack.clear()
+                self.client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
+                self.client.loop_start()
+                self.started = True
+            self._connack.wait(timeout)
             return self.connected
         except Exception as e:
             print(f"❌ Failed to connect to MQTT broker: {e}")
@@ -68,54 +315,242 @@ class MQTTPublisher:
     
     def disconnect(self):
         """Disconnect from MQTT broker"""
-        self.client.loop_stop()
+        # In this order the network thread sends DISCONNECT and exits at once
         self.client.disconnect()
+        self.client.loop_stop()
+        self.started = False
+        self.connected = False
     
-    def publish_reading(self, apartment_number, voltage, current, floor="1", additional_data=None):
-        """Publish a single electricity reading"""
-        if not self.connected:
-            print("❌ Not connected to MQTT broker")
-            return False
-        
-        topic = f"{MQTT_TOPIC_PREFIX}/floor/{apartment_number}"
-        
-        data = {
-            "voltage": voltage,
-            "current": current,
-            "apartment": apartment_number,
-            "floor": floor,
-            "timestamp": datetime.now().isoformat(),
-            "power": voltage * current
-        }
+    def _publish_or_spool(self, topic, message, items):
+        """
+        Publish a message live, or spool its reading items while offline or while older ones wait
         
-        # Add any additional data
-        if additional_data:
-            data.update(additional_data)
+        Returns 'published', 'spooled' or None (offline without a spool).
+        """
+        with self._lock:
+            if self.connected and not self.replaying:
+                if self.client.publish(topic, message).rc == mqtt.MQTT_ERR_SUCCESS:
+                    return 'published'
+            if self.spool is None:
+                return None
+            # Written under the lock so a replay cannot miss it, made durable outside it
+            path = self.spool.append(items, sync=False)
+            self.spooled += len(items)
+        self.spool.sync(path)
+        return 'spooled'
+    
+    def _replay(self):
+        """Drain the spool as batch messages, oldest first, at most replay_rate readings per second"""
+        topic = batch_topic(MQTT_TOPIC_PREFIX, MQTT_GATEWAY_ID, self.codec.name)
+        print("📤 Replaying spooled readings")
+        replayed = 0
+        pace = time.monotonic()
+        try:
+            while self.connected:
+                with self._lock:
+                    readings, position = self.spool.read(MQTT_BATCH_MAX_READINGS)
+                    if not readings:
+                        # Under the lock, so no new reading lands in the spool after this check
+                        self.replaying = False
+                        print(f"✅ Spool drained: {replayed} readings replayed")
+                        return
+                # QoS 1: the spool position only moves on once the broker has the batch
+                info = self.client.publish(topic, self.codec.encode_batch(readings), qos=1)
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    break
+                while not info.is_published() and self.connected:
+                    info.wait_for_publish(1)
+                if not info.is_published():
+                    break
+                self.spool.commit(position)
+                replayed += len(readings)
+                self.replayed += len(readings)
+                if self.replay_rate > 0:
+                    pace = max(pace, time.monotonic()) + len(readings) / self.replay_rate
+                    time.sleep(max(0.0, pace - time.monotonic()))
+        except Exception as e:
+            print(f"❌ Spool replay failed: {e}")
+        # Disconnected: the next connection resumes from the last acknowledged batch
+        with self._lock:
+            self.replaying = False
+        print(f"⏸️ Spool replay interrupted after {replayed} readings")
+    
+    def publish_reading(self, apartment_number, voltage, current, floor="1", additional_data=None):
+        """Publish a single electricity reading (spooled while offline)"""
+        topic = reading_topic(MQTT_TOPIC_PREFIX, apartment_number, self.codec.name)
+        data = reading_message(apartment_number, voltage, current, floor, additional_data)
         
-        message = json.dumps(data)
-        result = self.client.publish(topic, message)
+        # Spooled readings are replayed as batch items, which carry their own timestamp
+        item = dict(additional_data or {})
+        item.update({"apartment": apartment_number, "voltage": voltage, "current": current, "timestamp": time.time()})
         
-        if result.rc == mqtt.MQTT_ERR_SUCCESS:
-            power = voltage * current
+        outcome = self._publish_or_spool(topic, self.codec.encode(data), [item])
+        power = voltage * current
+        if outcome == 'published':
             print(f"📊 Published: Apartment {apartment_number} - V={voltage}V, I={current}A, P={power:.2f}W")
             return True
+        elif outcome == 'spooled':
+            print(f"💾 Spooled: Apartment {apartment_number} - V={voltage}V, I={current}A, P={power:.2f}W")
+            return True
         else:
-            print(f"❌ Failed to publish for apartment {apartment_number}: {result.rc}")
-            return False
-    
-    def publish_batch_readings(self, readings):
-        """Publish multiple readings at once"""
-        if not self.connected:
             print("❌ Not connected to MQTT broker")
             return False
+    
+    def publish_batch_readings(self, readings, gateway=MQTT_GATEWAY_ID):
+        """
+        Publish multiple readings, of any apartments, as batch messages (spooled while offline)
+        
+        Each reading takes the arguments of publish_reading plus an optional timestamp
+        (default: now). Up to MQTT_BATCH_MAX_READINGS readings go into one message.
+        """
+        topic = batch_topic(MQTT_TOPIC_PREFIX, gateway, self.codec.name)
+        items = batch_items(readings)
+        
+        published = spooled = 0
+        for index in range(0, len(items), MQTT_BATCH_MAX_READINGS):
+            chunk = items[index:index + MQTT_BATCH_MAX_READINGS]
+            outcome = self._publish_or_spool(topic, self.codec.encode_batch(chunk), chunk)
+            if outcome == 'published':
+                published += len(chunk)
+            elif outcome == 'spooled':
+                spooled += len(chunk)
+            else:
+                print(f"❌ Not connected to MQTT broker, {len(chunk)} readings lost")
+        
+        print(f"📊 Published {published}/{len(readings)} readings successfully"
+              + (f", {spooled} spooled" if spooled else ""))
+        return published + spooled == len(readings)
+
+class AsyncMQTTPublisher:
+    """
+    asyncio MQTT Publisher for sending electricity data over one long-lived connection
+    
+    The client is driven from the running event loop (see mqtt_asyncio) and reconnects on its
+    own. Every publish is awaited until the broker acknowledges it (QoS 1), and at most
+    max_inflight are unacknowledged at a time: run many concurrently (asyncio.gather) to
+    pipeline them, while a slow broker makes callers wait instead of queueing without bound.
+    QoS 1 publishes made while disconnected are kept by paho and sent after the reconnect.
+    
+    Usage:
+        async with AsyncMQTTPublisher() as publisher:
+            await publisher.publish_reading("101", 230.5, 5.2)
+    """
+    
+    def __init__(self, codec=MQTT_PAYLOAD_CODEC, qos=1, max_inflight=MQTT_MAX_INFLIGHT):
+        self.codec = get_codec(codec)
+        self.qos = qos
+        self.client = create_client()
+        self.client.max_inflight_messages_set(max_inflight)
+        self.client.on_connect = self.on_connect
+        self.client.on_publish = self.on_publish
+        self.client.on_disconnect = self.on_disconnect
+        self.connected = False
+        self._connack = asyncio.Event()  # Set by a CONNACK, cleared on disconnect
+        self._slots = asyncio.Semaphore(max_inflight)
+        self._pending = {}  # mid -> Future resolved by on_publish
+        self._stopping = None
+        self._task = None
+    
+    # paho calls these on the event loop's thread, which runs all of the client's network I/O
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            print("✅ MQTT Publisher connected!")
+            self.connected = True
+        else:
+            print(f"❌ MQTT Publisher failed to connect: {rc}")
+            self.connected = False
+        self._connack.set()
+    
+    def on_publish(self, client, userdata, mid):
+        future = self._pending.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(True)
+    
+    def on_disconnect(self, client, userdata, rc):
+        print("🔌 MQTT Publisher disconnected")
+        self.connected = False
+        self._connack.clear()
+    
+    async def connect(self, timeout=MQTT_ACK_TIMEOUT):
+        """
+        Open the connection (once) and wait for the broker's CONNACK up to timeout
+        
+        Returns whether the publisher is connected; if not, it keeps retrying in the background.
+        """
+        if self._task is None:
+            self._stopping = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(
+                run_client(self.client, MQTT_BROKER, MQTT_PORT, 60, self._stopping))
+        try:
+            await asyncio.wait_for(self._connack.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.connected
+    
+    async def disconnect(self):
+        """Disconnect cleanly; publishes still waiting for an acknowledgement return False"""
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+        self.connected = False
+        self._connack.clear()
+        for future in self._pending.values():
+            if not future.done():
+                future.set_result(False)
+        self._pending.clear()
+    
+    async def __aenter__(self):
+        await self.connect()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.disconnect()
+    
+    async def publish(self, topic, payload, qos=None):
+        """
+        Publish a message and wait until the broker has acknowledged it
         
-        success_count = 0
-        for reading in readings:
-            if self.publish_reading(**reading):
-                success_count += 1
+        Waits for an in-flight slot first. Returns False if the message was not sent (QoS 0
+        while disconnected, or disconnect() was called). Use asyncio.wait_for to bound the wait
+        while the broker is unreachable.
+        """
+        qos = self.qos if qos is None else qos
+        async with self._slots:
+            info = self.client.publish(topic, payload, qos)
+            if info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0:
+                pass  # Queued by paho until the reconnect
+            elif info.rc != mqtt.MQTT_ERR_SUCCESS:
+                return False
+            # on_publish runs from this loop's socket callbacks, so it cannot come before this
+            future = asyncio.get_running_loop().create_future()
+            self._pending[info.mid] = future
+            try:
+                return await future
+            finally:
+                self._pending.pop(info.mid, None)
+    
+    async def publish_reading(self, apartment_number, voltage, current, floor="1", additional_data=None):
+        """Publish a single electricity reading; True once acknowledged"""
+        topic = reading_topic(MQTT_TOPIC_PREFIX, apartment_number, self.codec.name)
+        data = reading_message(apartment_number, voltage, current, floor, additional_data)
+        return await self.publish(topic, self.codec.encode(data))
+    
+    async def publish_batch_readings(self, readings, gateway=MQTT_GATEWAY_ID):
+        """
+        Publish multiple readings as batch messages, all in flight at once
         
-        print(f"📊 Published {success_count}/{len(readings)} readings successfully")
-        return success_count == len(readings)
+        Takes the readings of MQTTPublisher.publish_batch_readings. True once every batch
+        message is acknowledged.
+        """
+        topic = batch_topic(MQTT_TOPIC_PREFIX, gateway, self.codec.name)
+        items = batch_items(readings)
+        results = await asyncio.gather(*(
+            self.publish(topic, self.codec.encode_batch(items[index:index + MQTT_BATCH_MAX_READINGS]))
+            for index in range(0, len(items), MQTT_BATCH_MAX_READINGS)
+        ))
+        return all(results)
 
 # Global publisher instance
 mqtt_publisher = MQTTPublisher()
@@ -132,11 +567,11 @@ def send_electricity_data(apartment_number, voltage, current, floor="1", additio
         additional_data (dict): Any additional data to include
     
     Returns:
-        bool: True if published successfully, False otherwise
+        bool: True if published or spooled, False otherwise
     """
-    if not mqtt_publisher.connected:
-        if not mqtt_publisher.connect():
-            return False
+    # While the broker is unreachable the reading is spooled and sent once it is back
+    if not mqtt_publisher.started and not mqtt_publisher.connect() and mqtt_publisher.spool is None:
+        return False
     
     return mqtt_publisher.publish_reading(apartment_number, voltage, current, floor, additional_data)
 
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Payload codecs for MQTT electricity readings
+Shared by the subscriber (app.py) and every publisher so both sides agree on the wire format
+
+Codecs are chosen by an optional topic suffix, e.g.
+    electricity/building/floor/101          -> compact JSON (default)
+    electricity/building/floor/101/bin      -> fixed binary struct
+    electricity/building/floor/101/msgpack  -> MessagePack (needs the msgpack package)
+    electricity/building/floor/101/cbor     -> CBOR (needs the cbor2 package)
+or, for MQTT 5 messages, by their content-type property.
+
+Gateways that read many meters publish batches instead, one message with the readings of
+any number of apartments, on
+    electricity/building/batch/<gateway>[/codec]
+"""
+
+import json
+import struct
+import time
+from datetime import datetime
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+class DecodeError(ValueError):
+    """Raised when a payload cannot be decoded by its codec"""
+
+def epoch_seconds(timestamp):
+    """Timestamp as seconds since the epoch (accepts numbers, ISO strings, datetimes or None for now)"""
+    if timestamp is None:
+        return time.time()
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp).timestamp()
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    return float(timestamp)
+
+def _batch_readings(data, kind):
+    """The reading maps of a decoded batch object"""
+    readings = data.get('readings') if isinstance(data, dict) else None
+    if not isinstance(readings, list) or not all(isinstance(reading, dict) for reading in readings):
+        raise DecodeError(f"{kind} batch is not a map with a list of reading maps")
+    return readings
+
+class JsonCodec:
+    """Compact JSON without whitespace; accepts any JSON object on decode"""
+    name = 'json'
+    content_type = 'application/json'
+
+    def encode(self, reading):
+        return json.dumps(reading, separators=(',', ':')).encode()
+
+    def decode(self, payload):
+        try:
+            data = json.loads(payload)
+        except (ValueError, UnicodeDecodeError) as e:
+            raise DecodeError(f"Invalid JSON payload: {e}")
+        if not isinstance(data, dict):
+            raise DecodeError("JSON payload is not an object")
+        return data
+
+    def encode_batch(self, readings):
+        return self.encode({'readings': readings})
+
+    def decode_batch(self, payload):
+        return _batch_readings(self.decode(payload), 'JSON')
+
+class StructCodec:
+    """
+    Fixed 16-byte little-endian layout: timestamp (float64 epoch seconds),
+    voltage (float32), current (float32). Apartment and floor come from the topic;
+    any other fields are not transmitted.
+
+    A batch is a run of 26-byte records that start with the apartment number
+    (10 bytes of UTF-8, NUL padded) followed by the single reading layout.
+    """
+    name = 'bin'
+    content_type = 'application/vnd.electricity.reading'
+    layout = struct.Struct('<dff')
+    batch_layout = struct.Struct('<10sdff')
+
+    def encode(self, reading):
+        return self.layout.pack(epoch_seconds(reading.get('timestamp')), reading['voltage'], reading['current'])
+
+    def decode(self, payload):
+        try:
+            timestamp, voltage, current = self.layout.unpack(payload)
+        except struct.error as e:
+            raise DecodeError(f"Invalid binary payload: {e}")
+        return {'timestamp': timestamp, 'voltage': voltage, 'current': current}
+
+    def encode_batch(self, readings):
+        pack = self.batch_layout.pack
+        return b''.join(
+            pack(str(reading['apartment']).encode(), epoch_seconds(reading.get('timestamp')),
+                 reading['voltage'], reading['current'])
+            for reading in readings
+        )
+
+    def decode_batch(self, payload):
+        try:
+            return [
+                {'apartment': apartment.rstrip(b'\0').decode(), 'timestamp': timestamp,
+                 'voltage': voltage, 'current': current}
+                for apartment, timestamp, voltage, current in self.batch_layout.iter_unpack(payload)
+            ]
+        except (struct.error, UnicodeDecodeError) as e:
+            raise DecodeError(f"Invalid binary batch payload: {e}")
+
+class MsgpackCodec:
+    """MessagePack map with the same keys as the JSON payload"""
+    name = 'msgpack'
+    content_type = 'application/msgpack'
+
+    def encode(self, reading):
+        return msgpack.packb(reading, use_bin_type=True)
+
+    def decode(self, payload):
+        try:
+            data = msgpack.unpackb(payload, raw=False)
+        except Exception as e:
+            raise DecodeError(f"Invalid MessagePack payload: {e}")
+        if not isinstance(data, dict):
+            raise DecodeError("MessagePack payload is not a map")
+        return data
+
+    def encode_batch(self, readings):
+        return self.encode({'readings': readings})
+
+    def decode_batch(self, payload):
+        return _batch_readings(self.decode(payload), 'MessagePack')
+
+class CborCodec:
+    """CBOR map with the same keys as the JSON payload"""
+    name = 'cbor'
+    content_type = 'application/cbor'
+
+    def encode(self, reading):
+        return cbor2.dumps(reading)
+
+    def decode(self, payload):
+        try:
+            data = cbor2.loads(payload)
+        except Exception as e:
+            raise DecodeError(f"Invalid CBOR payload: {e}")
+        if not isinstance(data, dict):
+            raise DecodeError("CBOR payload is not a map")
+        return data
+
+    def encode_batch(self, readings):
+        return self.encode({'readings': readings})
+
+    def decode_batch(self, payload):
+        return _batch_readings(self.decode(payload), 'CBOR')
+
+# All known codec names, including those whose optional package is missing
+CODEC_NAMES = ('json', 'bin', 'msgpack', 'cbor')
+
+CODECS = {'json': JsonCodec(), 'bin': StructCodec()}
+if msgpack is not None:
+    CODECS['msgpack'] = MsgpackCodec()
+if cbor2 is not None:
+    CODECS['cbor'] = CborCodec()
+
+CODECS_BY_CONTENT_TYPE = {codec.content_type: codec for codec in CODECS.values()}
+
+DEFAULT_CODEC = 'json'
+
+# Topic level that marks a gateway batch: <prefix>/batch/<gateway>[/codec]
+BATCH_SEGMENT = 'batch'
+
+def get_codec(name=None):
+    """Codec by name; raises ValueError if it is unknown or its package is not installed"""
+    name = name or DEFAULT_CODEC
+    if name not in CODECS:
+        if name in CODEC_NAMES:
+            raise ValueError(f"Codec '{name}' needs an optional package that is not installed")
+        raise ValueError(f"Unknown codec '{name}'")
+    return CODECS[name]
+
+def reading_topic(prefix, apartment_number, codec_name=DEFAULT_CODEC):
+    """Topic to publish an apartment's readings on with the given codec"""
+    topic = f"{prefix}/floor/{apartment_number}"
+    if codec_name != DEFAULT_CODEC:
+        topic += f"/{codec_name}"
+    return topic
+
+def batch_topic(prefix, gateway, codec_name=DEFAULT_CODEC):
+    """Topic a gateway publishes its batches on with the given codec"""
+    topic = f"{prefix}/{BATCH_SEGMENT}/{gateway}"
+    if codec_name != DEFAULT_CODEC:
+        topic += f"/{codec_name}"
+    return topic
+
+def _split_topic(topic):
+    parts = topic.split('/')
+    codec_name = DEFAULT_CODEC
+    if parts[-1] in CODEC_NAMES:
+        codec_name = parts.pop()
+    return parts, codec_name
+
+def parse_topic(topic):
+    """
+    Split a reading topic into (apartment_number, codec name)
+
+    Returns (None, None) for topics that are too short to name an apartment and for batch topics.
+    """
+    parts, codec_name = _split_topic(topic)
+    if len(parts) < 3 or parts[-2] == BATCH_SEGMENT:
+        return None, None
+    return parts[-1], codec_name
+
+def parse_batch_topic(topic):
+    """Codec name of a batch topic, or None if the topic is not one"""
+    parts, codec_name = _split_topic(topic)
+    if len(parts) < 3 or parts[-2] != BATCH_SEGMENT:
+        return None
+    return codec_name
+
+def codec_for_message(msg, codec_name=DEFAULT_CODEC):
+    """Codec for a received message; an MQTT 5 content-type overrides the topic suffix"""
+    properties = getattr(msg, 'properties', None)
+    content_type = getattr(properties, 'ContentType', None)
+    if content_type:
+        codec = CODECS_BY_CONTENT_TYPE.get(content_type)
+        if codec is None:
+            raise DecodeError(f"Unsupported content type '{content_type}'")
+        return codec
+    try:
+        return get_codec(codec_name)
+    except ValueError as e:
+        raise DecodeError(str(e))
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Retention of reading history for Electricity Monitor
+Raw readings and each rollup resolution are kept for their own number of days. A background
+job deletes what expired in small, time-boxed batches, raw readings only once the rollups
+covering them are sealed, and hands the freed pages back to the file system with
+incremental vacuum. Every batch is a short transaction with a pause after it, so the batch
+writer and web requests get the writer connection in between.
+
+Usage:
+    python retention.py                              # one sweep without a time limit
+    python retention.py --dry-run                    # show what would be deleted
+    python retention.py --enable-incremental-vacuum  # one-off VACUUM of an existing database
+"""
+
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+from models import db, User, PowerReading, PowerRollup
+from rollups import DAY, RESOLUTIONS, RESOLUTION_NAMES, ROLLUP_RETENTION_DAYS
+from columnar import reading_store
+from metrics import REGISTRY
+from storage import writing
+
+# Load environment variables
+load_dotenv()
+
+# Retention Configuration (days; 0 keeps data forever; rollup days are read in rollups.py)
+RETENTION_RAW_DAYS = int(os.getenv('RETENTION_RAW_DAYS', 0))
+RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', 3600))  # Seconds between sweeps
+RETENTION_TIME_BUDGET = float(os.getenv('RETENTION_TIME_BUDGET', 10))  # Seconds of work per sweep at most
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 2000))  # Rows per delete transaction
+RETENTION_PAUSE = float(os.getenv('RETENTION_PAUSE', 0.05))  # Seconds the writer is left to others after a batch
+RESOLUTION_KINDS = {resolution: name for name, resolution in RESOLUTION_NAMES.items()}
+VACUUM_STEP_PAGES = 256  # Pages released per incremental_vacuum transaction
+FIRST_SWEEP_DELAY = 60  # Seconds after start, so startup is not slowed down
+
+# Retention metrics (see /metrics)
+retention_deleted = REGISTRY.counter('retention_deleted_total', 'Expired readings and rollups deleted', ['kind'])
+retention_vacuumed_pages = REGISTRY.counter('retention_vacuumed_pages_total',
+                                            'Database pages released by incremental vacuum')
+retention_sweep_seconds = REGISTRY.histogram('retention_sweep_seconds', 'Duration of one retention sweep')
+
+class RetentionJob:
+    """Background thread that runs a time-boxed retention sweep every interval"""
+
+    def __init__(self, app, cache=None, interval=RETENTION_INTERVAL, budget=RETENTION_TIME_BUDGET,
+                 batch_size=RETENTION_BATCH_SIZE, pause=RETENTION_PAUSE):
+        self.app = app
+        self.cache = cache  # Optional ResponseCache; other processes' entries expire by TTL
+        self.interval = interval
+        self.budget = budget
+        self.batch_size = batch_size
+        self.pause = pause
+        self.dry_run = False
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return bool(RETENTION_RAW_DAYS or any(ROLLUP_RETENTION_DAYS.values()))
+
+    def start(self):
+        """Start the sweep thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        delay = min(FIRST_SWEEP_DELAY, self.interval)
+        while not self._stop_event.wait(delay):
+            try:
+                deleted = self.sweep()
+                if any(deleted.values()):
+                    print(f"Retention: deleted {', '.join(f'{count} {kind}' for kind, count in deleted.items() if count)}")
+            except Exception as e:
+                print(f"Error running retention sweep: {e}")
+            delay = self.interval
+
+    def sweep(self, budget=None, now=None):
+        """
+        Delete expired rows until done or the time budget is spent, then vacuum
+
+        Work left over is picked up by the next sweep. Returns deleted counts per kind.
+        """
+        budget = self.budget if budget is None else budget
+        deadline = time.monotonic() + budget if budget else None
+        now = now or datetime.utcnow()
+        started = time.perf_counter()
+        deleted = {'raw': 0, 'minute': 0, 'hour': 0, 'day': 0}
+
+        with self.app.app_context():
+            users = db.session.query(User.id, User.apartment_number).all()
+            if RETENTION_RAW_DAYS:
+                cutoff = now - timedelta(days=RETENTION_RAW_DAYS)
+                for user_id, apartment_number in users:
+                    if self._expired(deadline):
+                        break
+                    horizon = self.raw_horizon(user_id, cutoff)
+                    if horizon is not None:
+                        # Segments go a month at a time in one step; rows in batches
+                        deleted['raw'] += self._delete(deadline, lambda: self._delete_raw(user_id, horizon),
+                                                       apartment_number, horizon, 'raw',
+                                                       repeat=reading_store is None)
+
+            for resolution in RESOLUTIONS:
+                name = RESOLUTION_KINDS[resolution]
+                days = ROLLUP_RETENTION_DAYS[resolution]
+                if not days or self._expired(deadline):
+                    continue
+                cutoff = now - timedelta(days=days)
+                count = self._delete(deadline, lambda: self._delete_rollups(resolution, cutoff), None, cutoff, name)
+                if count and self.cache is not None:
+                    for _, apartment_number in users:
+                        self.cache.invalidate(apartment_number, datetime.min, cutoff)
+                deleted[name] += count
+
+            if not self.dry_run:
+                self._vacuum(deadline)
+        retention_sweep_seconds.observe(time.perf_counter() - started)
+        return deleted
+
+    def raw_horizon(self, user_id, cutoff):
+        """
+        Raw readings of an apartment older than this may go: the cutoff, but never past its
+        oldest open rollup bucket or the end of its newest sealed day (None: nothing rolled up)
+        """
+        open_start = db.session.query(db.func.min(PowerRollup.bucket_start)).filter(
+            PowerRollup.user_id == user_id,
+            PowerRollup.sealed.is_(False)
+        ).scalar()
+        sealed_day = db.session.query(db.func.max(PowerRollup.bucket_start)).filter(
+            PowerRollup.user_id == user_id,
+            PowerRollup.resolution == DAY,
+            PowerRollup.sealed.is_(True)
+        ).scalar()
+        if sealed_day is None:
+            return None
+        return min(value for value in (cutoff, open_start, sealed_day + timedelta(seconds=DAY)) if value is not None)
+
+    def _delete(self, deadline, batch, apartment_number, horizon, kind, repeat=True):
+        """Run delete batches until one comes back short or time is up; returns rows deleted"""
+        total = 0
+        while not self._expired(deadline):
+            count = batch()
+            total += count
+            if count < self.batch_size or self.dry_run or not repeat:
+                break
+            self._stop_event.wait(self.pause)
+        if total:
+            retention_deleted.inc(total, kind=kind)
+            if self.cache is not None and apartment_number is not None:
+                self.cache.invalidate(apartment_number, datetime.min, horizon)
+        return total
+
+    def _delete_raw(self, user_id, horizon):
+        if reading_store is not None:
+            return reading_store.drop_before(user_id, horizon, dry_run=self.dry_run)
+        ids = db.select(PowerReading.id).where(
+            PowerReading.user_id == user_id,
+            PowerReading.timestamp < horizon
+        ).limit(self.batch_size)
+        return self._execute_delete(db.delete(PowerReading).where(PowerReading.id.in_(ids)), ids)
+
+    def _delete_rollups(self, resolution, cutoff):
+        ids = db.select(PowerRollup.id).where(
+            PowerRollup.sealed.is_(True),
+            PowerRollup.resolution == resolution,
+            PowerRollup.bucket_start < cutoff
+        ).limit(self.batch_size)
+        return self._execute_delete(db.delete(PowerRollup).where(PowerRollup.id.in_(ids)), ids)
+
+    def _execute_delete(self, stmt, ids):
+        if self.dry_run:
+            return db.session.execute(db.select(db.func.count()).select_from(
+                ids.limit(None).subquery())).scalar()
+        with writing():
+            try:
+                count = db.session.execute(stmt, execution_options={'synchronize_session': False}).rowcount
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        return count
+
+    def _vacuum(self, deadline):
+        """Release free pages in small steps; needs auto_vacuum=INCREMENTAL (see --enable-incremental-vacuum)"""
+        while not self._expired(deadline):
+            # A connection per step, so the writer is free during the pause
+            with db.engine.connect() as connection:
+                if (connection.dialect.name != 'sqlite'
+                        or connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2):
+                    return
+                free = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+                if not free:
+                    return
+                # The sqlite3 driver steps the pragma once, and every step frees a single page
+                for _ in range(min(free, VACUUM_STEP_PAGES)):
+                    connection.exec_driver_sql("PRAGMA incremental_vacuum")
+                pages = free - connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+                connection.commit()
+            retention_vacuumed_pages.inc(pages)
+            self._stop_event.wait(self.pause)
+
+    def _expired(self, deadline):
+        return self._stop_event.is_set() or (deadline is not None and time.monotonic() >= deadline)
+
+def enable_incremental_vacuum():
+    """Switch an existing database to auto_vacuum=INCREMENTAL (rewrites the whole file)"""
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+        return cursor.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    finally:
+        connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete expired Electricity Monitor history')
+    parser.add_argument('--dry-run', action='store_true', help='Count what a sweep would delete')
+    parser.add_argument('--budget', type=float, default=0, help='Seconds of work at most (default: no limit)')
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help='Run VACUUM once so freed pages can be released incrementally (blocks writers)')
+    args = parser.parse_args()
+
+    from app import app
+
+    if args.enable_incremental_vacuum:
+        with app.app_context():
+            enabled = enable_incremental_vacuum()
+        print("✅ Incremental vacuum enabled" if enabled else "❌ Could not enable incremental vacuum")
+        return
+
+    job = RetentionJob(app)
+    job.dry_run = args.dry_run
+    if not job.enabled:
+        print("⚠️  No retention configured (set RETENTION_RAW_DAYS or RETENTION_<RESOLUTION>_DAYS)")
+        return
+    started = time.monotonic()
+    deleted = job.sweep(budget=args.budget)
+    verb = 'Would delete' if args.dry_run else 'Deleted'
+    print(f"✅ {verb} {deleted['raw']} raw readings and {deleted['minute']} minute, {deleted['hour']} hour, "
+          f"{deleted['day']} day rollups in {time.monotonic() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Incrementally maintained reading rollups for Electricity Monitor
+Each ingested batch is folded into 1-minute, 1-hour and 1-day buckets per apartment
+"""
+
+import os
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, PowerRollup
+from energy import EPOCH, ENERGY_MAX_GAP, to_epoch
+
+# Load environment variables
+load_dotenv()
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+RESOLUTIONS = (MINUTE, HOUR, DAY)
+RESOLUTION_NAMES = {'minute': MINUTE, 'hour': HOUR, 'day': DAY}
+
+# Rollup Configuration
+ROLLUP_MAX_POINTS = int(os.getenv('ROLLUP_MAX_POINTS', 1000))  # Buckets returned per query at most
+ROLLUP_SEAL_GRACE = float(os.getenv('ROLLUP_SEAL_GRACE', 120))  # Seconds late data may still arrive
+# Days each resolution is kept by retention.py (0 keeps it forever)
+ROLLUP_RETENTION_DAYS = {
+    MINUTE: int(os.getenv('RETENTION_MINUTE_DAYS', 0)),
+    HOUR: int(os.getenv('RETENTION_HOUR_DAYS', 0)),
+    DAY: int(os.getenv('RETENTION_DAY_DAYS', 0))
+}
+
+def bucket_start(timestamp, resolution):
+    """Start of the bucket of the given width that contains timestamp"""
+    seconds = to_epoch(timestamp)
+    return EPOCH + timedelta(seconds=seconds - seconds % resolution)
+
+def choose_resolution(start, end, max_points=ROLLUP_MAX_POINTS, resolutions=RESOLUTIONS):
+    """Finest of the given resolutions that covers [start, end) in at most max_points buckets"""
+    span = (end - start).total_seconds()
+    for resolution in resolutions:
+        if span / resolution <= max_points:
+            return resolution
+    return resolutions[-1]
+
+def retained_resolutions(start, now=None):
+    """Resolutions still kept for buckets starting at start (the coarsest always counts)"""
+    now = now or datetime.utcnow()
+    kept = [resolution for resolution in RESOLUTIONS
+            if not ROLLUP_RETENTION_DAYS[resolution] or start >= now - timedelta(days=ROLLUP_RETENTION_DAYS[resolution])]
+    return kept or [RESOLUTIONS[-1]]
+
+class _Delta:
+    """Aggregate of the readings of one batch that fall into one bucket"""
+    __slots__ = ('count', 'v_min', 'v_max', 'v_sum', 'i_min', 'i_max', 'i_sum',
+                 'p_min', 'p_max', 'p_sum', 'energy')
+
+    def __init__(self, voltage, current, power, energy):
+        self.count = 1
+        self.v_min = self.v_max = self.v_sum = voltage
+        self.i_min = self.i_max = self.i_sum = current
+        self.p_min = self.p_max = self.p_sum = power
+        self.energy = energy
+
+    def add(self, voltage, current, power, energy):
+        self.count += 1
+        self.v_min = min(self.v_min, voltage)
+        self.v_max = max(self.v_max, voltage)
+        self.v_sum += voltage
+        self.i_min = min(self.i_min, current)
+        self.i_max = max(self.i_max, current)
+        self.i_sum += current
+        self.p_min = min(self.p_min, power)
+        self.p_max = max(self.p_max, power)
+        self.p_sum += power
+        self.energy += energy
+
+class RollupAccumulator:
+    """Folds batches of readings into PowerRollup rows inside the writer's transaction"""
+
+    def __init__(self, resolutions=RESOLUTIONS, seal_grace=ROLLUP_SEAL_GRACE):
+        self.resolutions = resolutions
+        self.seal_grace = seal_grace
+        self.open_buckets = {}  # (user_id, resolution) -> start of the newest bucket seen
+
+    def apply(self, rows, energies):
+        """
+        Fold reading rows (dicts with user_id, voltage, current, power, timestamp) and the
+        energy of each row (Wh, from energy.EnergyAccumulator) into the rollup table.
+        Does not commit.
+        """
+        deltas = {}
+        to_seal = []
+
+        for row, energy in zip(rows, energies):
+            user_id = row['user_id']
+            timestamp = row['timestamp']
+            power = row['power']
+
+            for resolution in self.resolutions:
+                start = bucket_start(timestamp, resolution)
+
+                # A reading in a newer bucket closes the previous one
+                open_start = self.open_buckets.get((user_id, resolution))
+                if open_start is None or start > open_start:
+                    if open_start is not None:
+                        to_seal.append({'u': user_id, 'r': resolution, 's': open_start})
+                    self.open_buckets[(user_id, resolution)] = start
+
+                key = (user_id, resolution, start)
+                delta = deltas.get(key)
+                if delta is None:
+                    deltas[key] = _Delta(row['voltage'], row['current'], power, energy)
+                else:
+                    delta.add(row['voltage'], row['current'], power, energy)
+
+        if deltas:
+            self._upsert(deltas)
+        if to_seal:
+            table = PowerRollup.__table__
+            db.session.execute(
+                db.update(table).where(
+                    table.c.user_id == db.bindparam('u'),
+                    table.c.resolution == db.bindparam('r'),
+                    table.c.bucket_start == db.bindparam('s', type_=table.c.bucket_start.type)
+                ).values(sealed=True),
+                to_seal
+            )
+
+    def forget(self, user_ids):
+        """
+        Discard the open buckets of apartments whose batch was rolled back; a bucket left
+        unsealed by that is sealed by seal_expired
+        """
+        for key in [key for key in self.open_buckets if key[0] in user_ids]:
+            del self.open_buckets[key]
+
+    def seal_expired(self, now=None):
+        """Seal buckets that ended more than seal_grace ago (apartments that went quiet); returns how many"""
+        now = now or datetime.utcnow()
+        sealed = 0
+        for resolution in self.resolutions:
+            cutoff = now - timedelta(seconds=resolution + self.seal_grace)
+            sealed += PowerRollup.query.filter(
+                PowerRollup.sealed.is_(False),
+                PowerRollup.resolution == resolution,
+                PowerRollup.bucket_start < cutoff
+            ).update({'sealed': True}, synchronize_session=False)
+        return sealed
+
+    def _upsert(self, deltas):
+        table = PowerRollup.__table__
+        stmt = sqlite_insert(table)
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'resolution', 'bucket_start'],
+            set_={
+                'sample_count': table.c.sample_count + excluded.sample_count,
+                'voltage_min': db.func.min(table.c.voltage_min, excluded.voltage_min),
+                'voltage_max': db.func.max(table.c.voltage_max, excluded.voltage_max),
+                'voltage_sum': table.c.voltage_sum + excluded.voltage_sum,
+                'current_min': db.func.min(table.c.current_min, excluded.current_min),
+                'current_max': db.func.max(table.c.current_max, excluded.current_max),
+                'current_sum': table.c.current_sum + excluded.current_sum,
+                'power_min': db.func.min(table.c.power_min, excluded.power_min),
+                'power_max': db.func.max(table.c.power_max, excluded.power_max),
+                'power_sum': table.c.power_sum + excluded.power_sum,
+                'energy_wh': table.c.energy_wh + excluded.energy_wh,
+            }
+        )
+        db.session.execute(stmt, [
+            {
+                'user_id': user_id,
+                'resolution': resolution,
+                'bucket_start': start,
+                'sample_count': delta.count,
+                'voltage_min': delta.v_min,
+                'voltage_max': delta.v_max,
+                'voltage_sum': delta.v_sum,
+                'current_min': delta.i_min,
+                'current_max': delta.i_max,
+                'current_sum': delta.i_sum,
+                'power_min': delta.p_min,
+                'power_max': delta.p_max,
+                'power_sum': delta.p_sum,
+                'energy_wh': delta.energy,
+                'sealed': False
+            }
+            for (user_id, resolution, start), delta in deltas.items()
+        ])
+
+# Recomputes the finest buckets of one apartment in [:start, :end) from raw rows. Energy uses
+# the same trapezoidal rule as energy.EnergyIntegrator; rows up to :max_gap before :start are read
+# only to supply the previous sample of the first reading.
+_REBUILD_RAW_SQL = """
+INSERT INTO power_rollup (user_id, resolution, bucket_start, sample_count,
+                          voltage_min, voltage_max, voltage_sum,
+                          current_min, current_max, current_sum,
+                          power_min, power_max, power_sum, energy_wh, sealed)
+SELECT :user_id, :resolution,
+       strftime('%Y-%m-%d %H:%M:%S', bucket, 'unixepoch') || '.000000',
+       count(*), min(voltage), max(voltage), sum(voltage),
+       min(current), max(current), sum(current),
+       min(power), max(power), sum(power), sum(energy),
+       bucket + :resolution < :seal_before
+FROM (
+    SELECT voltage, current, power,
+           CAST(epoch / :resolution AS INTEGER) * :resolution AS bucket,
+           CASE WHEN epoch - prev_epoch > 0 AND epoch - prev_epoch <= :max_gap
+                THEN (power + prev_power) / 2 * (epoch - prev_epoch) / 3600 ELSE 0 END AS energy
+    FROM (
+        SELECT voltage, current, power, epoch,
+               LAG(epoch) OVER w AS prev_epoch,
+               LAG(power) OVER w AS prev_power
+        FROM (
+            -- SQLite date functions round to milliseconds, so whole seconds and the stored
+            -- fraction are converted separately
+            SELECT id, timestamp, voltage, current, power,
+                   CAST(strftime('%s', substr(timestamp, 1, 19)) AS INTEGER)
+                   + CAST('0' || substr(timestamp, 20) AS REAL) AS epoch
+            FROM power_reading
+            WHERE user_id = :user_id AND timestamp >= :read_from AND timestamp < :end
+        )
+        WINDOW w AS (ORDER BY timestamp, id)
+    )
+    WHERE epoch >= :start_epoch
+)
+GROUP BY bucket
+"""
+
+# Coarser buckets are folded from the finer ones just rebuilt instead of rescanning raw rows
+_REBUILD_FOLD_SQL = """
+INSERT INTO power_rollup (user_id, resolution, bucket_start, sample_count,
+                          voltage_min, voltage_max, voltage_sum,
+                          current_min, current_max, current_sum,
+                          power_min, power_max, power_sum, energy_wh, sealed)
+SELECT :user_id, :resolution,
+       strftime('%Y-%m-%d %H:%M:%S', bucket, 'unixepoch') || '.000000',
+       sum(sample_count), min(voltage_min), max(voltage_max), sum(voltage_sum),
+       min(current_min), max(current_max), sum(current_sum),
+       min(power_min), max(power_max), sum(power_sum), sum(energy_wh),
+       bucket + :resolution < :seal_before
+FROM (
+    SELECT *, CAST(strftime('%s', bucket_start) AS INTEGER) / :resolution * :resolution AS bucket
+    FROM power_rollup
+    WHERE user_id = :user_id AND resolution = :source AND bucket_start >= :start AND bucket_start < :end
+)
+GROUP BY bucket
+"""
+
+def rebuild_rollups(user_ids, start, end, max_gap=ENERGY_MAX_GAP, seal_grace=ROLLUP_SEAL_GRACE):
+    """
+    Recompute all rollups of the given apartments between start and end from PowerReading
+
+    The range is widened to whole days so every affected bucket of every resolution is
+    rebuilt completely. Used after bulk imports, which bypass RollupAccumulator. Does not commit.
+    """
+    start = bucket_start(start, DAY)
+    end = bucket_start(end, DAY) + timedelta(seconds=DAY)
+    seal_before = to_epoch(datetime.utcnow()) - seal_grace
+    date_type = PowerRollup.__table__.c.bucket_start.type
+    resolutions = sorted(RESOLUTIONS)
+    raw_sql = db.text(_REBUILD_RAW_SQL).bindparams(
+        db.bindparam('read_from', type_=date_type), db.bindparam('end', type_=date_type))
+    fold_sql = db.text(_REBUILD_FOLD_SQL).bindparams(
+        db.bindparam('start', type_=date_type), db.bindparam('end', type_=date_type))
+
+    for user_id in user_ids:
+        PowerRollup.query.filter(
+            PowerRollup.user_id == user_id,
+            PowerRollup.bucket_start >= start,
+            PowerRollup.bucket_start < end
+        ).delete(synchronize_session=False)
+        db.session.execute(raw_sql, {
+            'user_id': user_id,
+            'resolution': resolutions[0],
+            'read_from': start - timedelta(seconds=max_gap),
+            'end': end,
+            'start_epoch': to_epoch(start),
+            'max_gap': max_gap,
+            'seal_before': seal_before
+        })
+        for source, resolution in zip(resolutions, resolutions[1:]):
+            db.session.execute(fold_sql, {
+                'user_id': user_id,
+                'resolution': resolution,
+                'source': source,
+                'start': start,
+                'end': end,
+                'seal_before': seal_before
+            })
+
+def fetch_rollups(user_id, start, end, resolution=None):
+    """
+    Rollup buckets of one apartment overlapping [start, end), oldest first
+
+    Returns:
+        tuple: (resolution in seconds, list of PowerRollup)
+    """
+    if resolution is None:
+        resolution = choose_resolution(start, end)
+    buckets = PowerRollup.query.filter(
+        PowerRollup.user_id == user_id,
+        PowerRollup.resolution == resolution,
+        PowerRollup.bucket_start >= bucket_start(start, resolution),
+        PowerRollup.bucket_start < end
+    ).order_by(PowerRollup.bucket_start).all()
+    return resolution, buckets
+
+def rollup_to_dict(rollup):
+    """Serialize a PowerRollup for JSON responses"""
+    count = rollup.sample_count or 1
+    return {
+        'start': rollup.bucket_start.isoformat(),
+        'samples': rollup.sample_count,
+        'voltage': {'min': rollup.voltage_min, 'max': rollup.voltage_max, 'avg': rollup.voltage_sum / count},
+        'current': {'min': rollup.current_min, 'max': rollup.current_max, 'avg': rollup.current_sum / count},
+        'power': {'min': rollup.power_min, 'max': rollup.power_max, 'avg': rollup.power_sum / count},
+        'energy_wh': rollup.energy_wh,
+        'sealed': rollup.sealed
+    }
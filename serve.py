@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Production server for Electricity Monitor
+Runs the Flask app as an ASGI application under uvicorn: MQTT ingest and the live Server-Sent
+Events streams run on the event loop, regular Flask views on a bounded thread pool. Several
+worker processes can share one listening socket, each ingesting its own share of the apartments.
+
+Usage:
+    python serve.py --workers 4
+"""
+
+import argparse
+import asyncio
+import io
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+import uvicorn
+from flask_login import current_user
+
+import app as app_module
+from live import AsyncSubscription, format_event
+from migrate_db import migrate_database
+from retention import RetentionJob
+from mqtt_asyncio import run_client
+from ingest_workers import INGEST_MODE, INGEST_REFRESH_INTERVAL, owned_apartments
+
+# Load environment variables
+load_dotenv()
+
+# Server Configuration
+SERVE_HOST = os.getenv('SERVE_HOST', '0.0.0.0')
+SERVE_PORT = int(os.getenv('SERVE_PORT', 5000))
+SERVE_WORKERS = int(os.getenv('SERVE_WORKERS', 1))  # Processes sharing the listening socket
+SERVE_THREADS = int(os.getenv('SERVE_THREADS', 16))  # Threads per process for regular Flask views
+SERVE_SHUTDOWN_TIMEOUT = int(os.getenv('SERVE_SHUTDOWN_TIMEOUT', 10))  # Seconds open streams get to finish
+
+flask_app = app_module.app
+
+class Worker:
+    """State of this server process, set up by the lifespan startup and torn down by shutdown"""
+
+    def __init__(self, index=0, workers=1):
+        self.index = index
+        self.workers = workers
+        self.executor = None
+        self.stopping = None
+        self.tasks = []
+        self.retention_job = None  # Runs in the first ingesting process only
+        self.manager = None  # MQTTManager of this process, if it ingests
+        self.streams = set()  # Open AsyncSubscriptions
+
+    @property
+    def partitioned(self):
+        return self.workers > 1
+
+    async def startup(self):
+        loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(SERVE_THREADS, thread_name_prefix='flask')
+        self.stopping = asyncio.Event()
+        await loop.run_in_executor(self.executor, self._migrate)
+
+        if INGEST_MODE == 'workers':
+            # ingest_workers.py consumes MQTT; only follow the latest values it stores
+            app_module.latest_poller.start()
+            return
+
+        writer = app_module.batch_writer
+        if self.partitioned:
+            # Each process ingests the apartments that hash to it, publishes their latest values
+            # and follows the other processes' apartments like a workers-mode web process
+            manager = app_module.MQTTManager(client_id=f"serve-{self.index}-{os.getpid()}", topic_filters=[])
+            app_module.mqtt_manager = manager
+            writer.publish_latest = True
+            app_module.latest_poller.start()
+            self.tasks.append(loop.create_task(self._refresh_apartments(manager)))
+        else:
+            manager = app_module.mqtt_manager
+        writer.start()
+        # on_message runs on this loop, so a full queue pauses reading instead of blocking the loop
+        manager.blocking = False
+        manager.start_processing()
+        self.manager = manager
+        if self.index == 0:
+            self.retention_job = RetentionJob(app_module.app, cache=app_module.response_cache)
+            self.retention_job.start()
+        self.tasks.append(loop.create_task(run_client(manager.client, app_module.MQTT_BROKER,
+                                                      app_module.MQTT_PORT, 60, self.stopping, manager.paused,
+                                                      manager.connect_properties)))
+        print(f"Worker {self.index}: ingesting {'its share of the' if self.partitioned else 'all'} apartments")
+
+    def _migrate(self):
+        with flask_app.app_context():
+            migrate_database()
+
+    async def _refresh_apartments(self, manager):
+        """Subscribe to newly registered apartments owned by this process"""
+        loop = asyncio.get_running_loop()
+        while not self.stopping.is_set():
+            owned = await loop.run_in_executor(self.executor, self._owned)
+            added = manager.subscribe_to_apartments(owned)
+            if added:
+                print(f"Worker {self.index}: subscribed to {len(added)} more apartment(s), "
+                      f"{len(manager.apartments)} total")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), INGEST_REFRESH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def _owned(self):
+        with flask_app.app_context():
+            return owned_apartments(self.index, self.workers)
+
+    async def shutdown(self):
+        self.stopping.set()
+        if self.tasks:
+            # The MQTT task disconnects cleanly once stopping is set
+            await asyncio.wait(self.tasks, timeout=5)
+        loop = asyncio.get_running_loop()
+        # Stopping flushes what is still queued
+        if self.retention_job is not None:
+            await loop.run_in_executor(None, self.retention_job.stop)
+        if self.manager is not None:
+            await loop.run_in_executor(None, self.manager.stop_processing)
+        await loop.run_in_executor(None, app_module.batch_writer.stop)
+        await loop.run_in_executor(None, app_module.latest_poller.stop)
+        self.executor.shutdown(wait=False)
+
+    def close_streams(self):
+        for subscription in list(self.streams):
+            subscription.close()
+
+worker = Worker()
+
+class Server(uvicorn.Server):
+    """uvicorn server that ends the live streams first, so shutdown does not wait for them"""
+
+    async def shutdown(self, sockets=None):
+        worker.close_streams()
+        await super().shutdown(sockets)
+
+async def application(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http':
+        if scope['path'] == '/api/stream':
+            await stream_power_data(scope, receive, send)
+        else:
+            await call_flask(scope, receive, send)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await worker.startup()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await worker.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def call_flask(scope, receive, send):
+    """Run a Flask view on the thread pool, streaming its response back through the loop"""
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    environ = build_environ(scope, b''.join(chunks))
+    loop = asyncio.get_running_loop()
+
+    def send_sync(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    # Once the client is gone uvicorn silently discards what is sent, so the pool thread must
+    # be told to stop iterating a streamed response (an export) and release its connection
+    disconnected = threading.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = loop.create_task(watch_disconnect())
+    try:
+        await loop.run_in_executor(worker.executor, run_wsgi, environ, send_sync, disconnected)
+    except OSError:
+        pass  # Client went away while a streamed response was being sent
+    finally:
+        watcher.cancel()
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': worker.workers > 1,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            key = name
+        else:
+            key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def run_wsgi(environ, send_sync, disconnected=None):
+    """Call the Flask app and forward its response until `disconnected` is set; runs on a pool thread"""
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start['status'] = int(status.split(' ', 1)[0])
+        response_start['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                     for name, value in headers]
+        return lambda data: None
+
+    result = flask_app(environ, start_response)
+    try:
+        started = False
+        pending = None
+        # One chunk is held back, so the usual single-chunk response needs a single body message
+        for chunk in result:
+            if disconnected is not None and disconnected.is_set():
+                return  # close() below ends the view's generator
+            if not chunk:
+                continue
+            if not started:
+                send_sync({'type': 'http.response.start', 'status': response_start['status'],
+                           'headers': response_start['headers']})
+                started = True
+            if pending is not None:
+                send_sync({'type': 'http.response.body', 'body': pending, 'more_body': True})
+            pending = chunk
+        if not started:
+            send_sync({'type': 'http.response.start', 'status': response_start['status'],
+                       'headers': response_start['headers']})
+        send_sync({'type': 'http.response.body', 'body': pending or b''})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+def stream_apartment(environ):
+    """
+    Apartment of the user logged in on this request, or None; runs on a pool thread
+
+    Resolved by Flask-Login like the /api views, so a remember-me cookie works as well.
+    """
+    with flask_app.request_context(environ):
+        if not current_user.is_authenticated:
+            return None
+        return current_user.apartment_number
+
+async def stream_power_data(scope, receive, send):
+    """Server-Sent Events stream of the logged-in user's apartment, served on the event loop"""
+    loop = asyncio.get_running_loop()
+    apartment_number = await loop.run_in_executor(worker.executor, stream_apartment, build_environ(scope, b''))
+    if apartment_number is None:
+        await send({'type': 'http.response.start', 'status': 401,
+                    'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'Login required'})
+        return
+
+    subscription = AsyncSubscription(apartment_number, loop)
+    app_module.live_broadcaster.subscribe(apartment_number, subscription)
+    worker.streams.add(subscription)
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        subscription.close()
+
+    watcher = loop.create_task(watch_disconnect())
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        # Start with the latest known value so the dashboard is filled immediately
+        sample = app_module.power_store.latest(apartment_number)
+        if sample is not None:
+            await send({'type': 'http.response.body', 'body': format_event(sample.to_dict()).encode(),
+                        'more_body': True})
+        while not subscription.closed:
+            message = await subscription.wait(app_module.LIVE_KEEPALIVE)
+            if subscription.closed:
+                break
+            # Comments keep proxies from closing idle connections
+            body = message if message is not None else ": keep-alive\n\n"
+            await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+        # End the response properly (the server is shutting down or the client left)
+        await send({'type': 'http.response.body', 'body': b''})
+    except OSError:
+        pass  # Client went away mid-send
+    finally:
+        watcher.cancel()
+        worker.streams.discard(subscription)
+        app_module.live_broadcaster.unsubscribe(subscription)
+
+def server_config(host, port, workers):
+    return uvicorn.Config(application, host=host, port=port, lifespan='on', workers=workers,
+                          timeout_graceful_shutdown=SERVE_SHUTDOWN_TIMEOUT, log_level='info')
+
+def run_worker(index, workers, host, port, sockets):
+    """Serve on the inherited sockets until SIGTERM or Ctrl+C"""
+    global worker
+    worker = Worker(index, workers)
+    Server(server_config(host, port, workers)).run(sockets=sockets)
+
+def main():
+    parser = argparse.ArgumentParser(description='Production server for Electricity Monitor')
+    parser.add_argument('--host', default=SERVE_HOST, help='Interface to listen on')
+    parser.add_argument('--port', '-p', type=int, default=SERVE_PORT, help='Port to listen on')
+    parser.add_argument('--workers', '-w', type=int, default=SERVE_WORKERS, help='Server processes')
+    args = parser.parse_args()
+
+    print("⚡ Electricity Monitor - Server")
+    print("=" * 60)
+    print(f"Listening on http://{args.host}:{args.port}")
+    print(f"Workers: {args.workers}, {SERVE_THREADS} threads each, ingest mode {INGEST_MODE}")
+    print("=" * 60)
+
+    if args.workers <= 1:
+        Server(server_config(args.host, args.port, 1)).run()
+        return
+
+    # Bind once here; every worker accepts connections on the same socket
+    sock = server_config(args.host, args.port, args.workers).bind_socket()
+    context = multiprocessing.get_context('spawn')
+    processes = {}
+
+    def spawn(index):
+        process = context.Process(target=run_worker, args=(index, args.workers, args.host, args.port, [sock]),
+                                  name=f"server-worker-{index}")
+        process.start()
+        processes[index] = process
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    for index in range(args.workers):
+        spawn(index)
+
+    try:
+        while not stopping.is_set():
+            # Restart workers that died so their apartments keep being ingested
+            for index, process in list(processes.items()):
+                if not process.is_alive():
+                    print(f"❌ Worker {index} exited with code {process.exitcode}, restarting")
+                    spawn(index)
+            stopping.wait(2)
+    except KeyboardInterrupt:
+        print("\n⏹️ Stopping server")
+    finally:
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + SERVE_SHUTDOWN_TIMEOUT + 10
+        for process in processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+        sock.close()
+
+if __name__ == "__main__":
+    main()
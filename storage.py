@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+SQLite storage tuning for Electricity Monitor
+WAL journal and tuned pragmas; every write goes through one writer connection while reads are
+served from a small pool of read-only connections, so readers never wait behind the writer and
+concurrent writers queue in the pool instead of failing with "database is locked"
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session as SASession
+from sqlalchemy.sql.dml import UpdateBase
+from flask_sqlalchemy.session import Session
+
+# Load environment variables
+load_dotenv()
+
+# Storage Configuration
+SQLITE_TUNING = os.getenv('SQLITE_TUNING', 'on') == 'on'  # 'off' keeps SQLite's defaults (one shared pool)
+DATABASE_BUSY_TIMEOUT = float(os.getenv('DATABASE_BUSY_TIMEOUT', 30))  # Seconds to wait for a lock
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')  # NORMAL is crash-safe in WAL mode
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', 65536))  # Page cache per connection
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 268435456))  # Bytes of the file read through mmap
+SQLITE_READ_POOL_SIZE = int(os.getenv('SQLITE_READ_POOL_SIZE', 8))  # Read-only connections per process
+
+_read_engines = {}  # writer Engine -> read-only Engine
+_local = threading.local()
+
+def is_tunable(url):
+    """Only file-based SQLite databases get WAL and the separate read pool"""
+    url = make_url(url)
+    return SQLITE_TUNING and url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for the writer engine (Flask-SQLAlchemy's default bind)"""
+    if not make_url(url).get_backend_name() == 'sqlite':
+        return {}
+    options = {'connect_args': {'timeout': DATABASE_BUSY_TIMEOUT}}
+    if is_tunable(url):
+        # A single connection: writers in this process queue here instead of on SQLite's lock
+        options.update(pool_size=1, max_overflow=0, pool_timeout=DATABASE_BUSY_TIMEOUT)
+    return options
+
+def _apply_pragmas(dbapi_connection, read_only):
+    cursor = dbapi_connection.cursor()
+    try:
+        if not read_only:
+            # Only takes effect on a new file (or after VACUUM); lets retention release free pages
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cursor.execute("PRAGMA journal_mode = WAL")  # Persistent; readers no longer block on writes
+        cursor.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout = {int(DATABASE_BUSY_TIMEOUT * 1000)}")
+        cursor.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        if read_only:
+            cursor.execute("PRAGMA query_only = ON")
+    finally:
+        cursor.close()
+
+def init_storage(app, db):
+    """Tune the app's SQLite engine and create its read pool (call after db.init_app)"""
+    url = app.config['SQLALCHEMY_DATABASE_URI']
+    if not is_tunable(url):
+        return
+    with app.app_context():
+        writer = db.engine
+    event.listen(writer, 'connect', lambda connection, record: _apply_pragmas(connection, False))
+    # Switch the file to WAL now, before any reader opens it
+    with writer.connect():
+        pass
+
+    reader = create_engine(writer.url, pool_size=SQLITE_READ_POOL_SIZE, max_overflow=0,
+                           pool_timeout=DATABASE_BUSY_TIMEOUT,
+                           connect_args={'timeout': DATABASE_BUSY_TIMEOUT})
+    event.listen(reader, 'connect', lambda connection, record: _apply_pragmas(connection, True))
+    _read_engines[writer] = reader
+
+def read_engine(engine):
+    """The read-only engine paired with a writer engine (the engine itself if untuned)"""
+    return _read_engines.get(engine, engine)
+
+@contextmanager
+def writing():
+    """Route everything the current thread's session does to the writer, reads included"""
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+
+class RoutingSession(Session):
+    """
+    Flask-SQLAlchemy session that reads from the read pool and writes through the writer
+
+    Flushes and INSERT/UPDATE/DELETE statements use the writer; once a transaction has written,
+    its reads follow so it sees its own changes. Raw SQL that writes must run inside writing().
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        reader = _read_engines.get(engine) if bind is None else None
+        if reader is None:
+            return engine
+        if (self._flushing or isinstance(clause, UpdateBase) or getattr(_local, 'depth', 0)
+                or self.info.get('wrote')):
+            self.info['wrote'] = True
+            return engine
+        return reader
+
+@event.listens_for(SASession, 'after_commit')
+@event.listens_for(SASession, 'after_rollback')
+def _transaction_ended(session):
+    session.info.pop('wrote', None)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+In-memory latest-value store for Electricity Monitor
+Holds the newest sample and a fixed-size ring buffer of recent samples per apartment
+"""
+
+import threading
+import time
+from array import array
+from datetime import datetime
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Samples kept in memory per apartment (150 = 5 minutes at one reading every 2 s)
+LIVE_HISTORY_SIZE = int(os.getenv('LIVE_HISTORY_SIZE', 150))
+
+class Sample:
+    """One reading; never modified after it is published to readers"""
+    __slots__ = ('timestamp', 'voltage', 'current', 'power')
+
+    def __init__(self, timestamp, voltage, current, power):
+        self.timestamp = timestamp  # Seconds since the epoch
+        self.voltage = voltage
+        self.current = current
+        self.power = power
+
+    def to_dict(self):
+        return {
+            'voltage': self.voltage,
+            'current': self.current,
+            'power': self.power,
+            'timestamp': datetime.fromtimestamp(self.timestamp)
+        }
+
+class RingBuffer:
+    """Last `capacity` samples of one apartment in preallocated arrays"""
+    __slots__ = ('capacity', 'timestamps', 'voltages', 'currents', 'powers', 'head', 'size', 'lock')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.voltages = array('f', bytes(4 * capacity))
+        self.currents = array('f', bytes(4 * capacity))
+        self.powers = array('f', bytes(4 * capacity))
+        self.head = 0  # Next slot to write
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def append(self, sample):
+        with self.lock:
+            index = self.head
+            self.timestamps[index] = sample.timestamp
+            self.voltages[index] = sample.voltage
+            self.currents[index] = sample.current
+            self.powers[index] = sample.power
+            self.head = (index + 1) % self.capacity
+            if self.size < self.capacity:
+                self.size += 1
+
+    def since(self, cutoff):
+        """(timestamp, voltage, current, power) tuples newer than cutoff, oldest first"""
+        with self.lock:
+            start = (self.head - self.size) % self.capacity
+            indexes = [(start + offset) % self.capacity for offset in range(self.size)]
+            return [
+                (self.timestamps[i], self.voltages[i], self.currents[i], self.powers[i])
+                for i in indexes if self.timestamps[i] >= cutoff
+            ]
+
+class LatestValueStore:
+    """Thread-safe per-apartment store written by the MQTT thread and read by web requests"""
+
+    def __init__(self, history_size=LIVE_HISTORY_SIZE, aggregates=None):
+        self.history_size = history_size
+        self.aggregates = aggregates  # Optional BuildingAggregates kept in step with the latest values
+        self._latest = {}  # apartment_number -> Sample
+        self._history = {}  # apartment_number -> RingBuffer
+        self._lock = threading.Lock()  # Only guards creation of new buffers
+
+    def update(self, apartment_number, voltage, current, power, timestamp=None):
+        """Record a reading and return its Sample"""
+        sample = Sample(time.time() if timestamp is None else timestamp, voltage, current, power)
+        buffer = self._history.get(apartment_number)
+        if buffer is None:
+            with self._lock:
+                buffer = self._history.setdefault(apartment_number, RingBuffer(self.history_size))
+        buffer.append(sample)
+        # Replacing the reference is atomic, so readers never see a half-written sample
+        self._latest[apartment_number] = sample
+        if self.aggregates is not None:
+            self.aggregates.update(apartment_number, power, sample.timestamp)
+        return sample
+
+    def latest(self, apartment_number):
+        """Newest Sample of the apartment, or None if it has not reported yet"""
+        return self._latest.get(apartment_number)
+
+    def recent(self, apartment_number, seconds):
+        """Samples of the last `seconds` seconds, oldest first"""
+        buffer = self._history.get(apartment_number)
+        if buffer is None:
+            return []
+        return buffer.since(time.time() - seconds)
+
+    def stats(self, apartment_number, seconds):
+        """Summary of the last `seconds` seconds computed from memory"""
+        samples = self.recent(apartment_number, seconds)
+        if not samples:
+            return {'count': 0}
+        count = len(samples)
+        powers = [sample[3] for sample in samples]
+        return {
+            'count': count,
+            'voltage_avg': sum(sample[1] for sample in samples) / count,
+            'current_avg': sum(sample[2] for sample in samples) / count,
+            'power_avg': sum(powers) / count,
+            'power_min': min(powers),
+            'power_max': max(powers)
+        }
+
+    def __len__(self):
+        return len(self._latest)